@@ -0,0 +1,166 @@
+"""
+Reparto de las peticiones a S3 por prefijo de clave, antes y después de particionar.
+
+    python claves_s3.py [usuarios] [operaciones_por_fase] [hilos]
+
+Usa moto (`pip install "moto[s3]"`) como S3 local, en el mismo proceso. Un
+hook de botocore cuenta cada petición por los primeros 2 caracteres de su
+clave: S3 reparte la carga (3500 PUT/s y 5500 GET/s por prefijo) a partir
+del comienzo de la clave. Cada operación es una petición de la skill: lee el
+documento y, en el 20% de los casos, lo vuelve a escribir con la versión
+siguiente. Las operaciones de un usuario van siempre por el mismo hilo (una
+en vuelo por usuario). Fases:
+  1. legacy: claves <user_id> (S3_KEY_LAYOUT=legacy);
+  2. hashed, migrando: los documentos de la fase 1 con el adapter particionado;
+  3. hashed, otra vez: los que escribieron en la fase 2 ya están migrados;
+  4. hashed, con todos los usuarios migrados.
+Al final comprueba que cada usuario termina con tantas versiones como escrituras.
+"""
+import hashlib
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import entorno
+
+entorno.preparar(PERSISTENCE_BACKEND="s3", S3_PERSISTENCE_BUCKET="biblioteca-bench",
+                 AWS_DEFAULT_REGION="us-east-1", AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench")
+
+from moto import mock_aws  # noqa: E402
+
+from clients import cliente  # noqa: E402
+from persistence import HedgedS3Adapter, envelope_de_usuario, particion_s3  # noqa: E402
+
+BUCKET = "biblioteca-bench"
+PROPORCION_ESCRITURAS = 0.2
+CARGA_TOTAL = 20_000  # req/s agregadas para proyectar la carga del prefijo más ocupado
+LIMITE_PUT, LIMITE_GET = 3500, 5500
+
+
+class Contador:
+    """Peticiones a S3 por prefijo de 2 caracteres (hook before-parameter-build de botocore)."""
+
+    def __init__(self, s3_client):
+        self.por_prefijo = Counter()
+        self.por_operacion = Counter()
+        self._lock = threading.Lock()
+        s3_client.meta.events.register("before-parameter-build.s3.*", self._contar)
+
+    def _contar(self, params, model, **kwargs):
+        clave = params.get("Key")
+        if clave is None:
+            return
+        with self._lock:
+            self.por_prefijo[clave[:2]] += 1
+            self.por_operacion[model.name] += 1
+
+    def reiniciar(self):
+        with self._lock:
+            self.por_prefijo.clear()
+            self.por_operacion.clear()
+
+
+def operaciones(usuarios, n, semilla):
+    azar = random.Random(semilla)
+    return [(azar.choice(usuarios), azar.random() < PROPORCION_ESCRITURAS) for _ in range(n)]
+
+
+def correr_fase(adapter, plan, hilos, escrituras):
+    """Ejecuta el plan repartiendo los usuarios por hilo; devuelve los segundos que tardó."""
+    por_hilo = [[] for _ in range(hilos)]
+    for user_id, escribe in plan:
+        por_hilo[int(hashlib.md5(user_id.encode()).hexdigest(), 16) % hilos].append((user_id, escribe))
+
+    def trabajar(cola):
+        for user_id, escribe in cola:
+            envelope = envelope_de_usuario(user_id)
+            documento = adapter.get_attributes(envelope)
+            if escribe:
+                documento["version"] = documento.get("version", 0) + 1
+                adapter.save_attributes(envelope, documento)
+                escrituras[user_id] += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        list(ejecutor.map(trabajar, por_hilo))
+    return time.perf_counter() - inicio
+
+
+def informe(nombre, contador, segundos):
+    total = sum(contador.por_prefijo.values())
+    prefijo, mayor = contador.por_prefijo.most_common(1)[0]
+    parte = mayor / total
+    ops = ", ".join(f"{op} {n}" for op, n in sorted(contador.por_operacion.items()))
+    print(f"{nombre:<28} {len(contador.por_prefijo):>8} {parte:>14.1%} {parte * CARGA_TOTAL:>13.0f}/s"
+          f"   ({total / segundos:.0f} req/s medidas; {ops})")
+
+
+def main():
+    logging.disable(logging.WARNING)
+    n_usuarios = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_operaciones = int(sys.argv[2]) if len(sys.argv) > 2 else 6000
+    hilos = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    usuarios = [f"amzn1.ask.account.{random.Random(i).getrandbits(128):032X}" for i in range(n_usuarios)]
+    escrituras = Counter()
+
+    with mock_aws():
+        s3 = cliente("s3")
+        s3.create_bucket(Bucket=BUCKET)
+        contador = Contador(s3)
+        legacy = HedgedS3Adapter(BUCKET, s3_client=s3, cubrir=False, particionar=False)
+        particionado = HedgedS3Adapter(BUCKET, s3_client=s3, cubrir=False, particionar=True)
+        print(f"{len(usuarios)} usuarios, {n_operaciones} operaciones por fase "
+              f"({PROPORCION_ESCRITURAS:.0%} escrituras), {hilos} hilos")
+        print(f"{'claves':<28} {'prefijos':>8} {'prefijo mayor':>14} {f'a {CARGA_TOTAL} req/s':>15}")
+
+        # Todos los usuarios con un documento en la clave antigua
+        for user_id in usuarios:
+            legacy.save_attributes(envelope_de_usuario(user_id), {"version": 1})
+            escrituras[user_id] += 1
+
+        fases = (
+            ("legacy", legacy),
+            ("hashed, migrando", particionado),
+            ("hashed, tras esa fase", particionado),
+        )
+        for i, (nombre, adapter) in enumerate(fases):
+            contador.reiniciar()
+            segundos = correr_fase(adapter, operaciones(usuarios, n_operaciones, i), hilos, escrituras)
+            informe(nombre, contador, segundos)
+            if nombre == "hashed, migrando":
+                antiguas, borradas = particionado.lecturas_antiguas, contador.por_operacion["DeleteObject"]
+
+        # Quien no escribió sigue en la clave antigua: una escritura de cada uno lo migra
+        for user_id in usuarios:
+            envelope = envelope_de_usuario(user_id)
+            documento = particionado.get_attributes(envelope)
+            if user_id in particionado._antiguas:
+                documento["version"] += 1
+                particionado.save_attributes(envelope, documento)
+                escrituras[user_id] += 1
+        contador.reiniciar()
+        segundos = correr_fase(particionado, operaciones(usuarios, n_operaciones, len(fases)), hilos, escrituras)
+        informe("hashed, todos migrados", contador, segundos)
+
+        claves = [o["Key"] for p in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET)
+                  for o in p.get("Contents", [])]
+        correctos = sum(
+            1 for u in usuarios
+            if particionado.get_attributes(envelope_de_usuario(u)).get("version") == escrituras[u]
+        )
+
+    print(f"\nlímites por prefijo: {LIMITE_PUT} PUT/s, {LIMITE_GET} GET/s")
+    print(f"fase de migración: {antiguas} lecturas de la clave antigua, {borradas} claves antiguas borradas")
+    print(f"objetos al final: {len(claves)} (en clave particionada: "
+          f"{sum(1 for c in claves if c.partition('/')[0] == particion_s3(c.partition('/')[2]))})")
+    print(f"versión final correcta: {correctos} de {len(usuarios)}")
+    if correctos != len(usuarios) or len(claves) != len(usuarios):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Comprobación de concurrencia de singleflight.py sobre DatabaseManager.
+
+    python concurrencia.py [usuarios] [peticiones_por_usuario]
+
+Con latencia simulada en el backend en memoria:
+  1. lecturas simultáneas de `usuarios` usuarios: una sola carga del
+     almacenamiento por usuario, las demás comparten su resultado;
+  2. escrituras simultáneas de cada usuario mientras su primera escritura
+     sigue en curso: se agrupan en una sola escritura, la de versión más alta.
+Termina con código 1 si algún conteo no es el esperado.
+"""
+import copy
+import logging
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+import entorno
+
+entorno.preparar(PERSISTENCE_BACKEND="fake", ENABLE_DDB_CACHE="false",
+                 RETRY_QUEUE_DIR=tempfile.mkdtemp(prefix="pendientes-"))
+
+import persistence  # noqa: E402
+import database  # noqa: E402
+from database import DatabaseManager, FakeS3Adapter, _FAKE_STORE  # noqa: E402
+
+LATENCIA_S = 0.1
+
+
+class AdapterContado(FakeS3Adapter):
+    """FakeS3Adapter con latencia que cuenta lecturas y escrituras por usuario."""
+
+    def __init__(self):
+        super().__init__()
+        self.lecturas = Counter()
+        self.escrituras = Counter()
+        self.versiones = {}
+        self._lock = threading.Lock()
+        # Mientras esté sin marcar, las escrituras esperan (para acumular las siguientes)
+        self.soltar = threading.Event()
+        self.soltar.set()
+
+    def get_attributes(self, request_envelope):
+        with self._lock:
+            self.lecturas[self._user_id_from_envelope(request_envelope)] += 1
+        threading.Event().wait(LATENCIA_S)
+        return copy.deepcopy(super().get_attributes(request_envelope))
+
+    def save_attributes(self, request_envelope, attributes):
+        user_id = self._user_id_from_envelope(request_envelope)
+        with self._lock:
+            self.escrituras[user_id] += 1
+            self.versiones.setdefault(user_id, []).append(attributes.get("version"))
+        self.soltar.wait()
+        threading.Event().wait(LATENCIA_S)
+        super().save_attributes(request_envelope, copy.deepcopy(attributes))
+
+
+def en_paralelo(tareas):
+    """Ejecuta las funciones a la vez (arrancan juntas) y devuelve los errores."""
+    barrera = threading.Barrier(len(tareas))
+    errores = []
+
+    def correr(tarea):
+        barrera.wait()
+        try:
+            tarea()
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=correr, args=(tarea,)) for tarea in tareas]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return errores
+
+
+def comprobar(condicion, mensaje, fallas):
+    print(("ok    " if condicion else "FALLA ") + mensaje)
+    if not condicion:
+        fallas.append(mensaje)
+
+
+def main():
+    logging.disable(logging.WARNING)
+    usuarios = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    por_usuario = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    adapter = AdapterContado()
+    persistence._ADAPTER = adapter
+    ids = [f"usuario-{i}" for i in range(usuarios)]
+    for user_id in ids:
+        _FAKE_STORE[user_id] = dict(DatabaseManager.initial_data(), version=1)
+    fallas = []
+
+    # 1. Lecturas simultáneas con la caché en memoria vacía
+    antes = database._CARGAS.compartidas
+    errores = en_paralelo([
+        (lambda user_id=user_id: DatabaseManager.get_user_data(entorno.handler_input(user_id)))
+        for user_id in ids for _ in range(por_usuario)
+    ])
+    comprobar(not errores, f"lecturas sin errores ({errores[:1]})", fallas)
+    comprobar(all(adapter.lecturas[u] == 1 for u in ids),
+              f"una carga por usuario: {dict(adapter.lecturas)}", fallas)
+    comprobar(database._CARGAS.compartidas - antes == usuarios * (por_usuario - 1),
+              f"{database._CARGAS.compartidas - antes} lecturas servidas por la carga de otra", fallas)
+
+    # 2. Escrituras simultáneas: la primera de cada usuario queda en curso y las demás se agrupan
+    adapter.soltar.clear()
+    base = {u: DatabaseManager.get_user_data(entorno.handler_input(u)) for u in ids}
+
+    def guardar(user_id, i):
+        documento = copy.deepcopy(base[user_id])
+        documento["version"] = base[user_id]["version"] + i
+        documento["libros_disponibles"].append({"id": str(i), "titulo": f"Libro {i}"})
+        DatabaseManager.save_user_data(entorno.handler_input(user_id, f"{user_id}-{i}"), documento)
+
+    primeras = [threading.Thread(target=guardar, args=(u, 0)) for u in ids]
+    for hilo in primeras:
+        hilo.start()
+    while sum(adapter.escrituras.values()) < usuarios:
+        threading.Event().wait(0.01)
+    resto = [(lambda u=u, i=i: guardar(u, i)) for u in ids for i in range(1, por_usuario)]
+
+    def soltar_cuando_esperen_todas():
+        # Las primeras escrituras siguen retenidas hasta que todas las demás esperan turno
+        while sum(cola.esperando for cola in list(database._ESCRITURAS._colas.values())) < len(resto):
+            threading.Event().wait(0.005)
+        adapter.soltar.set()
+
+    threading.Thread(target=soltar_cuando_esperen_todas, daemon=True).start()
+    errores = en_paralelo(resto)
+    for hilo in primeras:
+        hilo.join()
+
+    comprobar(not errores, f"escrituras sin errores ({errores[:1]})", fallas)
+    comprobar(all(adapter.escrituras[u] == 2 for u in ids),
+              f"la primera escritura y una agrupada por usuario: {dict(adapter.escrituras)}", fallas)
+    mayor = base[ids[0]]["version"] + por_usuario
+    comprobar(all(adapter.versiones[u][-1] == mayor and _FAKE_STORE[u]["version"] == mayor for u in ids),
+              f"la escritura agrupada es la versión más alta ({mayor})", fallas)
+    comprobar(all(database._ultima_copia(u)["version"] == mayor for u in ids),
+              "la copia en memoria termina en la versión escrita", fallas)
+
+    if fallas:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+import sys
+
+# ==============================
+# Entorno común de los benchmarks
+# ==============================
+# Los scripts de esta carpeta importan el código de ../lambda tal cual se
+# despliega. La configuración se lee de variables de entorno al importar
+# config.py, así que `preparar` debe llamarse antes de importar la skill.
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "lambda")
+
+
+def preparar(**variables):
+    """Fija variables de entorno (sin pisar las que ya defina quien ejecuta) y agrega ../lambda al path."""
+    for nombre, valor in variables.items():
+        os.environ.setdefault(nombre, str(valor))
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+
+
+def handler_input(user_id, request_id=None):
+    """HandlerInput mínimo de `user_id` sobre el adapter de persistencia configurado."""
+    from ask_sdk_core.attributes_manager import AttributesManager
+    from ask_sdk_core.handler_input import HandlerInput
+    from ask_sdk_model import RequestEnvelope, Context, User, IntentRequest
+    from ask_sdk_model.interfaces.system import SystemState
+    from persistence import get_persistence_adapter
+
+    envelope = RequestEnvelope(
+        context=Context(system=SystemState(user=User(user_id=user_id))),
+        request=IntentRequest(request_id=request_id or f"bench-{user_id}"),
+    )
+    return HandlerInput(
+        request_envelope=envelope,
+        attributes_manager=AttributesManager(request_envelope=envelope,
+                                             persistence_adapter=get_persistence_adapter()),
+    )
@@ -0,0 +1,92 @@
+"""
+Costo de prestar, devolver y eliminar un libro según el tamaño de la biblioteca.
+
+    python mutaciones.py [rondas]
+
+Por cada tamaño (100 a 100 000 libros) arma un documento, lo deja en memoria
+con sus índices y su tabla columnar (como tras la primera petición del
+usuario) y mide `rondas` veces cada mutación de BibliotecaService sobre el
+backend en memoria. Con los mapas por id el préstamo y la devolución no
+dependen del tamaño; eliminar deja una lápida en la tabla y el libro sale de
+la lista persistida al guardar (un `del` de la lista, sin recorrer los libros).
+Al final comprueba que la tabla, la consulta sin filtros y la lista del
+documento coinciden, en el mismo orden.
+"""
+import logging
+import random
+import statistics
+import sys
+import time
+
+import entorno
+
+entorno.preparar(PERSISTENCE_BACKEND="fake", ENABLE_DDB_CACHE="false")
+
+from database import DatabaseManager, _FAKE_STORE  # noqa: E402
+from models import Libro, asignar_id  # noqa: E402
+from query import LibraryQuery  # noqa: E402
+from services import BibliotecaService  # noqa: E402
+
+TAMANOS = (100, 1_000, 10_000, 100_000)
+TIPOS = ("novela", "ensayo", "poesía", "cuento", "biografía")
+
+
+def documento(n):
+    datos = DatabaseManager.initial_data()
+    for i in range(n):
+        libro = Libro(f"Libro {i}", f"Autor {i % 997}", TIPOS[i % len(TIPOS)], id_libro=asignar_id(datos))
+        datos["libros_disponibles"].append(libro.to_dict())
+    datos["estadisticas"]["total_libros"] = n
+    return datos
+
+
+def medir(funcion):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    return (time.perf_counter() - inicio) * 1000, resultado
+
+
+def correr(n, rondas):
+    user_id = f"bench-{n}"
+    _FAKE_STORE[user_id] = documento(n)
+    DatabaseManager.limpiar_cache(user_id)
+    handler_input = entorno.handler_input(user_id)
+    # Primera petición: carga, índices y tabla columnar quedan en memoria
+    DatabaseManager.get_library_table(handler_input)
+    DatabaseManager.get_search_index(handler_input)
+    DatabaseManager.get_duplicate_index(handler_input)
+
+    azar = random.Random(n)
+    titulos = [f"Libro {i}" for i in azar.sample(range(n), 2 * rondas)]
+    tiempos = {"prestar": [], "devolver": [], "eliminar": []}
+    for prestado, eliminado in zip(titulos[:rondas], titulos[rondas:]):
+        ms, resultado = medir(lambda: BibliotecaService.registrar_prestamo(handler_input, prestado, "Ana"))
+        assert not isinstance(resultado, str), resultado
+        tiempos["prestar"].append(ms)
+        ms, resultado = medir(lambda: BibliotecaService.registrar_devolucion(handler_input, titulo=prestado))
+        assert not isinstance(resultado, str), resultado
+        tiempos["devolver"].append(ms)
+        # Tras eliminar, la tabla en memoria debe seguir resolviendo filas por id
+        ms, resultado = medir(lambda: BibliotecaService.eliminar_libro(handler_input, eliminado))
+        assert not isinstance(resultado, str), resultado
+        tiempos["eliminar"].append(ms)
+
+    tabla = DatabaseManager.get_library_table(handler_input)
+    ids = [libro["id"] for libro in DatabaseManager.get_user_data(handler_input)["libros_disponibles"]]
+    assert len(tabla) == len(ids) == n - rondas
+    assert all(tabla._posicion(i) == fila for fila, i in enumerate(tabla.ids) if i is not None)
+    assert [tabla.ids[i] for i in LibraryQuery(tabla).ejecutar()] == ids
+    return {operacion: statistics.median(valores) for operacion, valores in tiempos.items()}
+
+
+def main():
+    logging.disable(logging.WARNING)
+    rondas = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{'libros':>8}  {'prestar':>8}  {'devolver':>8}  {'eliminar':>8}   (ms, mediana de {rondas})")
+    for n in TAMANOS:
+        resultado = correr(n, rondas)
+        print(f"{n:>8}  {resultado['prestar']:>8.3f}  {resultado['devolver']:>8.3f}  {resultado['eliminar']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
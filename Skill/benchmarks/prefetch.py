@@ -0,0 +1,119 @@
+"""
+Latencia por turno con y sin el prefetch de PrefetchResponseInterceptor.
+
+    python prefetch.py [rondas] [libros] [prestamos]
+
+Cada ronda es una sesión nueva (usuario nuevo, documento recién cargado del
+backend en memoria) con dos pares de turnos:
+  1. ListarLibrosIntent y después SiguientePaginaIntent;
+  2. PrestarLibroIntent y después ConsultarPrestamosIntent.
+Entre un turno y el siguiente hay una pausa (el usuario escucha y contesta).
+Se mide el tiempo de lambda_handler en tres modos:
+  - sin prefetch: el interceptor no hace nada;
+  - síncrono: el prefetch corre antes de devolver la respuesta (como estaba);
+  - en segundo plano: el prefetch va a un hilo del pool y la respuesta no lo espera.
+Es un proceso que sigue corriendo entre turnos; en Lambda el contenedor se
+congela al responder y el prefetch termina recién en la invocación siguiente.
+"""
+import logging
+import statistics
+import sys
+import time
+
+import entorno
+
+entorno.preparar(PERSISTENCE_BACKEND="fake", ENABLE_DDB_CACHE="false")
+
+import lambda_function  # noqa: E402
+from database import DatabaseManager, _FAKE_STORE  # noqa: E402
+from models import Libro, Prestamo, asignar_id  # noqa: E402
+
+PAUSA_S = 0.2
+TIPOS = ("novela", "ensayo", "poesía", "cuento", "biografía")
+
+
+def documento(n_libros, n_prestamos):
+    datos = DatabaseManager.initial_data()
+    for i in range(n_libros):
+        libro = Libro(f"Libro {i}", f"Autor {i % 97}", TIPOS[i % len(TIPOS)], id_libro=asignar_id(datos))
+        datos["libros_disponibles"].append(libro.to_dict())
+    for libro in datos["libros_disponibles"][:n_prestamos]:
+        prestamo = Prestamo(libro["id"], libro["titulo"], f"Persona {len(datos['prestamos_activos']) % 13}",
+                            id_prestamo=asignar_id(datos))
+        libro["estado"] = "prestado"
+        datos["prestamos_activos"].append(prestamo.to_dict())
+    datos["estadisticas"]["total_libros"] = n_libros
+    datos["usuario_frecuente"] = True
+    return datos
+
+
+def evento(user_id, numero, intent, slots=None, sesion=None):
+    return {
+        "version": "1.0",
+        "session": {"new": False, "sessionId": f"sesion-{user_id}", "attributes": sesion or {},
+                    "application": {"applicationId": "bench"}, "user": {"userId": user_id}},
+        "context": {"System": {"application": {"applicationId": "bench"}, "user": {"userId": user_id}}},
+        "request": {
+            "type": "IntentRequest", "requestId": f"{user_id}-{numero}", "locale": "es-MX",
+            "timestamp": "2026-01-01T00:00:00Z",
+            "intent": {"name": intent, "confirmationStatus": "NONE", "slots": {
+                nombre: {"name": nombre, "value": valor, "confirmationStatus": "NONE"}
+                for nombre, valor in (slots or {}).items()
+            }},
+        },
+    }
+
+
+class Contexto:
+    def get_remaining_time_in_millis(self):
+        return 8000
+
+
+def turno(event):
+    inicio = time.perf_counter()
+    respuesta = lambda_function.lambda_handler(event, Contexto())
+    ms = (time.perf_counter() - inicio) * 1000
+    assert "outputSpeech" in respuesta["response"], respuesta
+    return ms, respuesta.get("sessionAttributes") or {}
+
+
+def sesion(user_id, n_libros, n_prestamos):
+    """Tiempos (ms) de los cuatro turnos de una sesión."""
+    _FAKE_STORE[user_id] = documento(n_libros, n_prestamos)
+    DatabaseManager.limpiar_cache(user_id)
+    tiempos = {}
+    tiempos["listar"], atributos = turno(evento(user_id, 1, "ListarLibrosIntent"))
+    time.sleep(PAUSA_S)
+    tiempos["siguiente"], _ = turno(evento(user_id, 2, "SiguientePaginaIntent", sesion=atributos))
+    tiempos["prestar"], atributos = turno(evento(
+        user_id, 3, "PrestarLibroIntent", {"titulo": f"Libro {n_libros - 1}", "nombre_persona": "Ana"}))
+    time.sleep(PAUSA_S)
+    tiempos["consultar"], _ = turno(evento(user_id, 4, "ConsultarPrestamosIntent", sesion=atributos))
+    return tiempos
+
+
+def main():
+    logging.disable(logging.WARNING)
+    rondas = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_libros = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    n_prestamos = int(sys.argv[3]) if len(sys.argv) > 3 else 2_000
+    en_segundo_plano = lambda_function.en_segundo_plano
+    modos = {
+        "sin prefetch": lambda funcion, *args: False,
+        "síncrono": lambda funcion, *args: funcion(*args) or True,
+        "en segundo plano": en_segundo_plano,
+    }
+    print(f"{n_libros} libros, {n_prestamos} préstamos activos, pausa de {PAUSA_S * 1000:.0f} ms entre turnos; "
+          f"p50 de {rondas} sesiones (ms)")
+    print(f"{'modo':<18} {'listar':>8} {'siguiente':>10} {'prestar':>8} {'consultar':>10}")
+    for nombre, entregar in modos.items():
+        lambda_function.en_segundo_plano = entregar
+        sesiones = [sesion(f"bench-{nombre}-{i}", n_libros, n_prestamos) for i in range(rondas)]
+        p50 = {turno_: statistics.median(s[turno_] for s in sesiones) for turno_ in sesiones[0]}
+        print(f"{nombre:<18} {p50['listar']:>8.2f} {p50['siguiente']:>10.2f} "
+              f"{p50['prestar']:>8.2f} {p50['consultar']:>10.2f}")
+    lambda_function.en_segundo_plano = en_segundo_plano
+
+
+if __name__ == "__main__":
+    main()
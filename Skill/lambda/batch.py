@@ -0,0 +1,79 @@
+import logging
+import os
+from itertools import islice
+from multiprocessing import Pool
+
+import clients
+import persistence
+from config import PERSISTENCE_BACKEND
+from persistence import get_persistence_adapter, envelope_de_usuario, iterar_usuarios
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Trabajos offline por lotes
+# ==============================
+# Los ids de usuario se leen del backend a medida que el pool los pide; cada
+# proceso carga con su propio adapter los documentos de su lote.
+
+# Usuarios por tarea del pool
+USUARIOS_POR_LOTE = 200
+
+# Datos de sólo lectura compartidos con los procesos (p. ej. matrices globales)
+_CONTEXTO = None
+
+
+def contexto():
+    return _CONTEXTO
+
+
+def _iniciar_proceso(valor, nuevo_adapter=False):
+    global _CONTEXTO
+    _CONTEXTO = valor
+    if nuevo_adapter:
+        # Los clientes de boto3 heredados del proceso padre no se comparten entre procesos
+        persistence._ADAPTER = None
+        clients.reiniciar()
+
+
+def numero_de_procesos(procesos=None):
+    if PERSISTENCE_BACKEND == "fake":
+        # El store falso vive en la memoria de este proceso
+        return 1
+    return procesos or os.cpu_count() or 1
+
+
+def usuarios():
+    return iterar_usuarios(get_persistence_adapter())
+
+
+def documentos(user_ids):
+    """(user_id, documento) de los usuarios con datos; los que fallan se registran y se saltan."""
+    adapter = get_persistence_adapter()
+    for user_id in user_ids:
+        try:
+            documento = adapter.get_attributes(envelope_de_usuario(user_id))
+        except Exception as e:
+            logger.warning(f"Documento de {user_id} omitido: {e}")
+            continue
+        if documento:
+            yield user_id, documento
+
+
+def lotes(user_ids, tamano=None):
+    user_ids = iter(user_ids)
+    while True:
+        lote = list(islice(user_ids, tamano or USUARIOS_POR_LOTE))
+        if not lote:
+            return
+        yield lote
+
+
+def mapear(funcion, user_ids, procesos=1, valor=None):
+    """Aplica `funcion(lote)` a lotes de ids, en paralelo si `procesos` > 1. `valor` queda en `contexto()`."""
+    if procesos <= 1:
+        _iniciar_proceso(valor)
+        yield from map(funcion, lotes(user_ids))
+        return
+    with Pool(procesos, initializer=_iniciar_proceso, initargs=(valor, True)) as pool:
+        yield from pool.imap_unordered(funcion, lotes(user_ids))
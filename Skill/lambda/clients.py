@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import boto3
+from botocore.config import Config
+
+from config import (
+    AWS_REGION, STORAGE_CONNECT_TIMEOUT, STORAGE_READ_TIMEOUT, STORAGE_MAX_ATTEMPTS,
+    STORAGE_POOL_SIZE, S3_HEDGE_MIN_DELAY_MS, PERSISTENCE_TIMEOUT_MS,
+)
+
+# ==============================
+# Fábrica de clientes de AWS
+# ==============================
+# Todos los clientes de S3 y DynamoDB salen de aquí con la misma configuración:
+# tiempos explícitos de conexión y lectura, reintentos adaptativos (con límite
+# de tasa del lado del cliente) y un pool de conexiones persistentes. Se crean
+# una vez por contenedor: las conexiones abiertas se reutilizan entre invocaciones.
+# Los clientes son thread-safe y se comparten; los resources no, y se guardan por hilo.
+#
+# deadline.llamar deja de esperar al agotarse el plazo, pero la llamada sigue en
+# su hilo hasta que botocore la corte. Por eso ningún intento espera más que el
+# tiempo máximo de la persistencia: una llamada trabada termina, como mucho, en
+# STORAGE_MAX_ATTEMPTS * (conexión + lectura) y libera su hilo.
+_LECTURA = min(STORAGE_READ_TIMEOUT, PERSISTENCE_TIMEOUT_MS / 1000)
+_CONEXION = min(STORAGE_CONNECT_TIMEOUT, _LECTURA)
+
+_CLIENTES = {}
+_LOCK = threading.Lock()
+_POR_HILO = threading.local()
+
+
+def configuracion(**extra):
+    """Config de botocore común; `extra` agrega o reemplaza opciones (p. ej. signature_version)."""
+    opciones = {
+        "connect_timeout": _CONEXION,
+        "read_timeout": _LECTURA,
+        "retries": {"mode": "adaptive", "max_attempts": STORAGE_MAX_ATTEMPTS},
+        "max_pool_connections": STORAGE_POOL_SIZE,
+        "tcp_keepalive": True,
+    }
+    opciones.update(extra)
+    return Config(**opciones)
+
+
+def _clave(servicio, region_name, endpoint_url, extra):
+    return servicio, region_name or AWS_REGION, endpoint_url, repr(sorted(extra.items()))
+
+
+def cliente(servicio, region_name=None, endpoint_url=None, **extra):
+    """Cliente compartido de `servicio`; `extra` son opciones de Config."""
+    clave = _clave(servicio, region_name, endpoint_url, extra)
+    encontrado = _CLIENTES.get(clave)
+    if encontrado is None:
+        # Crear clientes sobre la sesión por defecto no es thread-safe
+        with _LOCK:
+            encontrado = _CLIENTES.get(clave)
+            if encontrado is None:
+                encontrado = boto3.session.Session().client(
+                    servicio, region_name=clave[1], endpoint_url=endpoint_url, config=configuracion(**extra)
+                )
+                _CLIENTES[clave] = encontrado
+    return encontrado
+
+
+def recurso(servicio, region_name=None, endpoint_url=None, **extra):
+    """Resource de `servicio` (p. ej. tablas de DynamoDB), uno por hilo."""
+    recursos = getattr(_POR_HILO, "recursos", None)
+    if recursos is None:
+        recursos = _POR_HILO.recursos = {}
+    clave = _clave(servicio, region_name, endpoint_url, extra)
+    encontrado = recursos.get(clave)
+    if encontrado is None:
+        with _LOCK:
+            encontrado = boto3.session.Session().resource(
+                servicio, region_name=clave[1], endpoint_url=endpoint_url, config=configuracion(**extra)
+            )
+        recursos[clave] = encontrado
+    return encontrado
+
+
+def reiniciar():
+    """Olvida los clientes creados (procesos hijos: las conexiones del padre no se comparten)."""
+    global _POR_HILO
+    with _LOCK:
+        _CLIENTES.clear()
+        _POR_HILO = threading.local()
+
+
+# ==============================
+# GET de S3 cubierto (hedged)
+# ==============================
+# Muestras por ventana de latencias y mínimo de muestras antes de estimar el percentil
+VENTANA_LATENCIAS = 256
+MIN_MUESTRAS = 20
+PERCENTIL_COBERTURA = 0.95
+
+
+class Latencias:
+    """Ventana de las últimas latencias (s) con su percentil. La comparten los hilos de `s3-get`."""
+
+    def __init__(self, tamano=VENTANA_LATENCIAS):
+        self._muestras = deque(maxlen=tamano)
+        # Ordenar el deque mientras otro hilo le agrega una muestra lanza RuntimeError
+        self._lock = threading.Lock()
+
+    def agregar(self, segundos):
+        with self._lock:
+            self._muestras.append(segundos)
+
+    def percentil(self, p):
+        with self._lock:
+            muestras = list(self._muestras)
+        muestras.sort()
+        if len(muestras) < MIN_MUESTRAS:
+            return None
+        return muestras[min(len(muestras) - 1, int(p * len(muestras)))]
+
+
+class ClienteS3Cubierto:
+    """
+    Envuelve un cliente de S3: `get_object` manda una segunda petición si la
+    primera no respondió en el p95 de las latencias recientes (nunca antes de
+    S3_HEDGE_MIN_DELAY_MS) y devuelve la que termine primero. Así sólo ~5% de
+    las lecturas se duplica. El resto de métodos pasa directo al cliente.
+    """
+
+    def __init__(self, s3_client, latencias=None):
+        self._cliente = s3_client
+        self.latencias = latencias or Latencias()
+        self._ejecutor = ThreadPoolExecutor(max_workers=STORAGE_POOL_SIZE, thread_name_prefix="s3-get")
+        self.cubiertas = 0
+
+    def __getattr__(self, nombre):
+        return getattr(self._cliente, nombre)
+
+    def _get(self, kwargs):
+        inicio = time.monotonic()
+        respuesta = self._cliente.get_object(**kwargs)
+        self.latencias.agregar(time.monotonic() - inicio)
+        return respuesta
+
+    @staticmethod
+    def _cerrar(futuro):
+        # Cuerpo de la respuesta perdedora: se cierra para devolver la conexión al pool
+        if not futuro.cancelled() and futuro.exception() is None:
+            cuerpo = futuro.result().get("Body")
+            if cuerpo is not None:
+                cuerpo.close()
+
+    def get_object(self, **kwargs):
+        p95 = self.latencias.percentil(PERCENTIL_COBERTURA)
+        if p95 is None:
+            return self._get(kwargs)
+        primero = self._ejecutor.submit(self._get, kwargs)
+        if wait((primero,), timeout=max(p95, S3_HEDGE_MIN_DELAY_MS / 1000)).done:
+            return primero.result()
+
+        self.cubiertas += 1
+        segundo = self._ejecutor.submit(self._get, kwargs)
+        pendientes = {primero, segundo}
+        error = None
+        while pendientes:
+            listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                if futuro.exception() is None:
+                    for otro in pendientes:
+                        otro.add_done_callback(self._cerrar)
+                    return futuro.result()
+                error = error or futuro.exception()
+        raise error
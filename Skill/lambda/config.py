@@ -3,5 +3,68 @@ import os
 USE_FAKE_S3 = os.getenv("USE_FAKE_S3", "false").lower() == "true"
 ENABLE_DDB_CACHE = os.getenv("ENABLE_DDB_CACHE", "false").lower() == "true"
 CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+# Gracia tras el TTL: las lecturas responden con la copia vencida y la refrescan en segundo plano
+CACHE_STALE_GRACE_SECONDS = int(os.getenv("CACHE_STALE_GRACE_SECONDS", "900"))
 LIBROS_POR_PAGINA = 10
-S3_PERSISTENCE_BUCKET = os.environ.get("S3_PERSISTENCE_BUCKET")
\ No newline at end of file
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "512"))
+S3_PERSISTENCE_BUCKET = os.environ.get("S3_PERSISTENCE_BUCKET")
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+
+# Persistencia principal: "s3" (S3Adapter), "dynamodb" (single-table), "eventlog" o "fake" (memoria)
+PERSISTENCE_BACKEND = os.getenv("PERSISTENCE_BACKEND", "fake" if USE_FAKE_S3 else "s3").lower()
+DDB_DATA_TABLE = os.getenv("DDB_DATA_TABLE", "BibliotecaSkillData")
+# Endpoint alternativo (DynamoDB Local) para pruebas
+DDB_ENDPOINT_URL = os.getenv("DDB_ENDPOINT_URL") or None
+# Log de eventos: dónde se guardan ("dynamodb" o "memoria") y cada cuántos eventos se compacta
+EVENT_STORE = os.getenv("EVENT_STORE", "dynamodb").lower()
+DDB_EVENTS_TABLE = os.getenv("DDB_EVENTS_TABLE", "BibliotecaSkillEventos")
+EVENT_SNAPSHOT_EVERY = int(os.getenv("EVENT_SNAPSHOT_EVERY", "50"))
+# Recomendaciones precalculadas por el trabajo offline (recommender.py)
+RECOMMENDATIONS_TABLE = os.getenv("RECOMMENDATIONS_TABLE", "BibliotecaSkillCache")
+RECOMMENDATIONS_TOP_N = int(os.getenv("RECOMMENDATIONS_TOP_N", "10"))
+# Perfilado por petición (cProfile + tracemalloc): siempre, por muestreo o para ciertos usuarios
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_USERS = frozenset(u.strip() for u in os.getenv("PROFILE_USERS", "").split(",") if u.strip())
+# Destino de los reportes: bucket S3 si se define, si no un directorio local
+PROFILE_S3_BUCKET = os.getenv("PROFILE_S3_BUCKET") or None
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/perfiles")
+# Trazas por petición (spans anidados de handlers, servicio y almacenamiento)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+# Formato del archivo: "jsonl" (un span por línea) u "otlp" (OTLP/JSON, una petición por línea)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "/tmp/trazas.jsonl")
+# Plazo de respuesta: presupuesto de Alexa (ms), margen para armar la respuesta y tiempo máximo por nivel
+RESPONSE_BUDGET_MS = int(os.getenv("RESPONSE_BUDGET_MS", "7000"))
+RESPONSE_MARGIN_MS = int(os.getenv("RESPONSE_MARGIN_MS", "600"))
+DDB_CACHE_TIMEOUT_MS = int(os.getenv("DDB_CACHE_TIMEOUT_MS", "400"))
+PERSISTENCE_TIMEOUT_MS = int(os.getenv("PERSISTENCE_TIMEOUT_MS", "2500"))
+# Escrituras que no llegaron a la persistencia a tiempo (se reintentan en la siguiente petición)
+RETRY_QUEUE_DIR = os.getenv("RETRY_QUEUE_DIR", "/tmp/pendientes")
+# Antigüedad máxima (s) de una escritura encolada: más vieja, otro contenedor pudo haber escrito encima
+RETRY_QUEUE_MAX_AGE_SECONDS = int(os.getenv("RETRY_QUEUE_MAX_AGE_SECONDS", "900"))
+# Clientes de AWS (clients.py): tiempos (s), reintentos adaptativos y conexiones persistentes por cliente
+STORAGE_CONNECT_TIMEOUT = float(os.getenv("STORAGE_CONNECT_TIMEOUT", "1"))
+STORAGE_READ_TIMEOUT = float(os.getenv("STORAGE_READ_TIMEOUT", "2"))
+STORAGE_MAX_ATTEMPTS = int(os.getenv("STORAGE_MAX_ATTEMPTS", "3"))
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "16"))
+# Endpoint alternativo de S3 (MinIO, moto) para pruebas
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+# GET de S3 cubierto: si no responde en el p95 observado se manda un segundo y gana el primero
+S3_HEDGE_ENABLED = os.getenv("S3_HEDGE_ENABLED", "false").lower() == "true"
+S3_HEDGE_MIN_DELAY_MS = int(os.getenv("S3_HEDGE_MIN_DELAY_MS", "30"))
+# Respuestas ya dadas por requestId (Alexa puede reenviar una petición): memoria y tabla de caché
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "300"))
+IDEMPOTENCY_TABLE = os.getenv("IDEMPOTENCY_TABLE", "BibliotecaSkillCache")
+# Calentamiento (warmup.py): usuarios recientes a precargar, horas de actividad que se miran,
+# tiempo máximo (ms) y cada cuántos segundos un contenedor publica los usuarios que atendió
+WARMUP_USERS = int(os.getenv("WARMUP_USERS", "100"))
+WARMUP_LOOKBACK_HOURS = int(os.getenv("WARMUP_LOOKBACK_HOURS", "24"))
+WARMUP_BUDGET_MS = int(os.getenv("WARMUP_BUDGET_MS", "3000"))
+WARMUP_PUBLISH_SECONDS = int(os.getenv("WARMUP_PUBLISH_SECONDS", "60"))
+# Resumen por usuario en la tabla de caché (summary.py): falsos positivos del filtro de Bloom de títulos
+SUMMARY_BLOOM_FP_RATE = float(os.getenv("SUMMARY_BLOOM_FP_RATE", "0.0001"))
+# Claves de S3: "hashed" (<partición>/<user_id>, migra las antiguas al escribir) o "legacy" (<user_id>);
+# caracteres hex de la partición (2 -> 256 prefijos)
+S3_KEY_LAYOUT = os.getenv("S3_KEY_LAYOUT", "hashed").lower()
+S3_KEY_SHARD_CHARS = int(os.getenv("S3_KEY_SHARD_CHARS", "2"))
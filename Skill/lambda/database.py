@@ -1,8 +1,24 @@
 import logging
-import os
-from config import USE_FAKE_S3, ENABLE_DDB_CACHE, CACHE_TTL_SECONDS
-import boto3
+import threading
+from config import (
+    ENABLE_DDB_CACHE, CACHE_TTL_SECONDS, CACHE_STALE_GRACE_SECONDS,
+    DDB_CACHE_TIMEOUT_MS, PERSISTENCE_TIMEOUT_MS,
+)
 from datetime import datetime, timedelta
+from models import LibraryTable, LibraryIndex, CLAVE_SECUENCIA_ID
+from persistence import get_persistence_adapter, desde_dynamo, ConflictoSecuencia
+from clients import recurso
+from events import libro_agregado
+from search import SearchIndex, CLAVE_INDICE_BUSQUEDA
+from duplicates import DuplicateIndex, CLAVE_INDICE_DUPLICADOS
+from tracing import span, anotar, instrumentar_clase
+from deadline import llamar, PlazoAgotado
+import retry_queue
+from singleflight import SingleFlight, EscriturasAgrupadas
+from idempotency import verificar, omitir_escritura
+from summary import Resumen, clave_resumen
+from ask_sdk_core.exceptions import PersistenceException
+from botocore.exceptions import BotoCoreError, ClientError
 
 # ==============================
 # Adaptador de "Fake S3" (memoria)
@@ -33,28 +49,139 @@ class FakeS3Adapter:
             del _FAKE_STORE[uid]
             logger.info(f"FakeS3Adapter: atributos borrados para {uid}")
 
+    def iterar_usuarios(self):
+        return iter(list(_FAKE_STORE))
+
 
 # ==============================
 # Cache en memoria con TTL
 # ==============================
 _CACHE = {}
+# Protege el reemplazo de entradas: el refresco en segundo plano compite con las escrituras
+_CACHE_LOCK = threading.Lock()
+# Usuarios con un refresco en curso (uno a la vez por usuario)
+_REFRESCANDO = set()
+# Atributo de petición con el que un handler de sólo lectura acepta datos vencidos
+CLAVE_LECTURA_TOLERANTE = "lectura_tolerante"
+# Atributos de petición: la persistencia ya no respondió / la cola ya se reintentó en esta petición
+CLAVE_DEGRADADA = "lectura_degradada"
+CLAVE_REINTENTADA = "pendiente_reintentado"
 
-def _cache_get(user_id):
+def _cache_get(user_id, gracia=0):
+    """
+    (data, vencida) de la entrada en memoria. Una entrada vencida hace menos
+    de `gracia` segundos todavía se devuelve, marcada como vencida. Las
+    vencidas no se borran: son el respaldo si la persistencia no responde.
+    """
     item = _CACHE.get(user_id)
     if not item:
+        return None, False
+    ahora = datetime.now().timestamp()
+    if ahora <= item["expire_at"]:
+        return item["data"], False
+    if ahora <= item["expire_at"] + gracia:
+        return item["data"], True
+    return None, False
+
+def _ultima_copia(user_id):
+    """Último documento conocido del usuario, vencido o no."""
+    item = _CACHE.get(user_id)
+    return item["data"] if item else None
+
+def _vencimiento():
+    return (datetime.now() + timedelta(seconds=CACHE_TTL_SECONDS)).timestamp()
+
+# Vistas que se comprueban contra el documento al usarlas: se conservan mientras sea el mismo objeto
+_VISTAS_VERIFICADAS = ("resumen", "busqueda", "duplicados")
+# Índices que los documentos antiguos guardaban dentro; ahora viven sólo en memoria
+_CLAVES_OBSOLETAS = (CLAVE_INDICE_BUSQUEDA, CLAVE_INDICE_DUPLICADOS)
+
+def _sin_claves_obsoletas(data):
+    for clave in _CLAVES_OBSOLETAS:
+        data.pop(clave, None)
+
+def _cache_put(user_id, data, tabla=None, indice=None, solo_si_nueva=False):
+    _sin_claves_obsoletas(data)
+    with _CACHE_LOCK:
+        actual = _CACHE.get(user_id)
+        if solo_si_nueva and actual and actual["data"].get("version", 0) > data.get("version", 0):
+            return
+        mismo = actual is not None and actual["data"] is data
+        _CACHE[user_id] = {
+            "data": data,
+            "tabla": tabla,
+            "indice": indice,
+            **{clave: actual.get(clave) if mismo else None for clave in _VISTAS_VERIFICADAS},
+            "expire_at": _vencimiento()
+        }
+
+def _refrescar(user_id, request_envelope, viejo):
+    """
+    Relee el documento de la persistencia y renueva la entrada si nadie la
+    reemplazó mientras tanto (una escritura o una lectura síncrona ganan).
+    Con la misma versión se conservan la tabla y los índices ya construidos.
+    """
+    try:
+        with span("cache.refresco", user_id=user_id):
+            nuevo = get_persistence_adapter().get_attributes(request_envelope)
+        with _CACHE_LOCK:
+            item = _CACHE.get(user_id)
+            if item is None or item["data"] is not viejo:
+                return
+            version = (nuevo or {}).get("version", 0)
+            if version == viejo.get("version", 0):
+                item["expire_at"] = _vencimiento()
+            elif version > viejo.get("version", 0):
+                _CACHE[user_id] = {"data": nuevo, "tabla": None, "indice": None,
+                                   **dict.fromkeys(_VISTAS_VERIFICADAS), "expire_at": _vencimiento()}
+            # Más vieja: la copia en memoria tiene una escritura aún en la cola de reintentos
+        logger.info(f"🔄 Cache refrescada en segundo plano para {user_id}")
+    except Exception as e:
+        # La entrada vencida sigue sirviendo hasta agotar la gracia
+        logger.warning(f"Refresco en segundo plano fallido: {e}")
+    finally:
+        _REFRESCANDO.discard(user_id)
+
+# Fallas de almacenamiento que no son errores del código: la escritura se reintenta.
+# ConflictoSecuencia (otro escritor ganó) es una PersistenceException pero nunca se reintenta
+ERRORES_ALMACENAMIENTO = (PlazoAgotado, PersistenceException, BotoCoreError, ClientError)
+
+# Con peticiones simultáneas del mismo usuario: una sola carga del almacenamiento
+# en vuelo, y las escrituras que se cruzan se agrupan en la más nueva
+_CARGAS = SingleFlight()
+_ESCRITURAS = EscriturasAgrupadas()
+
+def _refrescar_en_segundo_plano(user_id, request_envelope, viejo):
+    # En Lambda el hilo se congela al devolver la respuesta y sigue en la
+    # siguiente invocación del contenedor; hasta entonces se sirve la copia vencida
+    if user_id in _REFRESCANDO:
+        return
+    _REFRESCANDO.add(user_id)
+    threading.Thread(target=_refrescar, args=(user_id, request_envelope, viejo),
+                     name=f"refresco-{user_id[-8:]}", daemon=True).start()
+
+def _cache_derivado(user_id, data, clave):
+    """Vista derivada (`tabla`, `indice`, `resumen`, `busqueda`, `duplicados`) ya construida para `data`, o None."""
+    item = _CACHE.get(user_id)
+    if item is None or item["data"] is not data:
         return None
-    if datetime.now().timestamp() > item["expire_at"]:
-        _CACHE.pop(user_id, None)
-        return None
-    return item["data"]
+    return item.get(clave)
 
-def _cache_put(user_id, data):
-    _CACHE[user_id] = {
-        "data": data,
-        "expire_at": (datetime.now() + timedelta(seconds=CACHE_TTL_SECONDS)).timestamp()
-    }
+def _resumen_de(user_id, data):
+    """Resumen de `data`: el de la entrada en memoria puesto al día, o uno nuevo (que queda en ella)."""
+    resumen = _cache_derivado(user_id, data, "resumen")
+    if resumen is not None and resumen.actualizar(data):
+        return resumen
+    resumen = Resumen.del_documento(data)
+    item = _CACHE.get(user_id)
+    if item is not None and item["data"] is data:
+        item["resumen"] = resumen
+    return resumen
 
-dynamodb = boto3.resource("dynamodb", region_name="us-east-1") if ENABLE_DDB_CACHE else None
+# DescribeTable de la tabla de caché: una vez por contenedor, no en cada lectura
+_TABLA_VERIFICADA = False
+# Usuarios cuyo último documento no llegó a la tabla de caché: su resumen puede ser viejo
+_RESUMEN_DUDOSO = set()
 
 class DatabaseManager:
     DDB_TABLE = "BibliotecaSkillCache"
@@ -65,87 +192,387 @@ class DatabaseManager:
 
     @staticmethod
     def _get_ddb_table():
+        global _TABLA_VERIFICADA
         if not ENABLE_DDB_CACHE:
             return None
         try:
-            table = dynamodb.Table(DatabaseManager.DDB_TABLE)
-            table.load()
+            table = recurso("dynamodb", region_name="us-east-1").Table(DatabaseManager.DDB_TABLE)
+            if not _TABLA_VERIFICADA:
+                table.load()
+                _TABLA_VERIFICADA = True
             return table
         except Exception as e:
             logger.warning(f"DDB deshabilitado o sin permisos: {e}")
             return None
 
+    @staticmethod
+    def _cache_ddb_get(user_id):
+        table = DatabaseManager._get_ddb_table()
+        if not table:
+            return None
+        with span("cache_ddb.get_item"):
+            return table.get_item(Key={"user_id": user_id})
+
+    @staticmethod
+    def _cache_ddb_put(user_id, data):
+        if not ENABLE_DDB_CACHE:
+            return
+        ttl = int((datetime.now() + timedelta(seconds=CACHE_TTL_SECONDS)).timestamp())
+        resumen = _resumen_de(user_id, data).a_item(user_id, ttl)
+        def escribir():
+            table = DatabaseManager._get_ddb_table()
+            if table:
+                # Documento y resumen en un solo BatchWriteItem
+                with span("cache_ddb.put_item"), table.batch_writer() as lote:
+                    lote.put_item(Item={"user_id": user_id, "data": data, "ttl": ttl})
+                    lote.put_item(Item=resumen)
+        try:
+            llamar(escribir, timeout_ms=DDB_CACHE_TIMEOUT_MS, nivel="cache_ddb")
+            _RESUMEN_DUDOSO.discard(user_id)
+        except Exception as e:
+            logger.warning(f"DDB put_item error: {e}")
+            _RESUMEN_DUDOSO.add(user_id)
+
+    @staticmethod
+    def get_resumen(handler_input):
+        """
+        Resumen del documento (summary.Resumen) leído de la tabla de caché sin
+        cargar el documento, o None si conviene cargarlo: ya está vigente en
+        memoria, hay una escritura propia pendiente o sin copiar a la tabla de
+        caché, no hay resumen o es más viejo que la última copia conocida.
+        """
+        user_id = DatabaseManager._user_id(handler_input)
+        if (not ENABLE_DDB_CACHE or _cache_get(user_id)[0] is not None
+                or retry_queue.hay_pendiente(user_id) or user_id in _RESUMEN_DUDOSO):
+            return None
+        def leer():
+            table = DatabaseManager._get_ddb_table()
+            if table:
+                with span("cache_ddb.resumen"):
+                    return table.get_item(Key={"user_id": clave_resumen(user_id)}).get("Item")
+        try:
+            item = llamar(leer, timeout_ms=DDB_CACHE_TIMEOUT_MS, nivel="cache_ddb")
+        except Exception as e:
+            logger.warning(f"Resumen no disponible: {e}")
+            return None
+        if not item or int(item.get("ttl", 0)) < datetime.now().timestamp():
+            return None
+        resumen = Resumen.desde_item(desde_dynamo(item))
+        ultima = _ultima_copia(user_id)
+        if ultima is not None and resumen.version < ultima.get("version", 0):
+            return None
+        anotar("nivel", "resumen")
+        return resumen
+
+    @staticmethod
+    def _persistir(handler_input, data, eventos=None, cambios=None):
+        """
+        Escribe en la persistencia principal con tiempo límite (PlazoAgotado si no termina).
+        `cambios` (LibraryIndex.tomar_cambios) limita la comparación a esos registros si el adapter lo admite.
+        """
+        adapter = get_persistence_adapter()
+        if eventos and hasattr(adapter, "append_events"):
+            llamar(adapter.append_events, handler_input.request_envelope, eventos, data,
+                   timeout_ms=PERSISTENCE_TIMEOUT_MS, nivel="persistencia")
+        elif cambios is not None and hasattr(adapter, "save_changes"):
+            llamar(adapter.save_changes, handler_input.request_envelope, data, cambios,
+                   timeout_ms=PERSISTENCE_TIMEOUT_MS, nivel="persistencia")
+        else:
+            attr_mgr = handler_input.attributes_manager
+            attr_mgr.persistent_attributes = data
+            llamar(attr_mgr.save_persistent_attributes, timeout_ms=PERSISTENCE_TIMEOUT_MS, nivel="persistencia")
+
+    @staticmethod
+    def _reintentar_pendiente(handler_input, user_id):
+        """
+        Reintenta la escritura encolada del usuario. Antes lee la versión
+        guardada: si otro contenedor ya escribió esa versión o una más nueva,
+        la entrada se descarta en lugar de pisarla. Si no, confirmada o no,
+        su documento es la versión más nueva y queda en memoria sobre lo guardado.
+        """
+        pendiente = retry_queue.leer(user_id)
+        if pendiente is None:
+            return
+        documento = pendiente["documento"]
+        try:
+            guardado = llamar(get_persistence_adapter().get_attributes, handler_input.request_envelope,
+                              timeout_ms=PERSISTENCE_TIMEOUT_MS, nivel="persistencia") or {}
+            if guardado.get("version", 0) >= documento.get("version", 0):
+                retry_queue.descartar(user_id)
+                logger.warning(f"🗑️ Escritura pendiente de {user_id} descartada: la persistencia ya tiene la "
+                               f"versión {guardado.get('version', 0)} (encolada: {documento.get('version')})")
+                _cache_put(user_id, guardado, solo_si_nueva=True)
+                return
+            DatabaseManager._persistir(handler_input, documento)
+            retry_queue.descartar(user_id)
+            logger.info(f"📤 Escritura pendiente de {user_id} confirmada (versión {documento.get('version')})")
+        except ERRORES_ALMACENAMIENTO as e:
+            logger.warning(f"Escritura pendiente de {user_id} sin confirmar: {e}")
+        actual = _ultima_copia(user_id)
+        if actual is None or actual.get("version", 0) < documento.get("version", 0):
+            _cache_put(user_id, documento)
+
     @staticmethod
     def get_user_data(handler_input):
         user_id = DatabaseManager._user_id(handler_input)
+        atributos = handler_input.attributes_manager.request_attributes
 
-        # 1) Cache en memoria
-        data = _cache_get(user_id)
+        # 0) Escritura propia que no llegó a la persistencia: se reintenta (una vez) antes de leer
+        if retry_queue.hay_pendiente(user_id) and not atributos.get(CLAVE_REINTENTADA):
+            atributos[CLAVE_REINTENTADA] = True
+            DatabaseManager._reintentar_pendiente(handler_input, user_id)
+
+        # Si la persistencia ya falló en esta petición no se vuelve a esperar
+        if atributos.get(CLAVE_DEGRADADA):
+            anotar("nivel", "degradado")
+            return _ultima_copia(user_id)
+
+        # 1) Cache en memoria (vencida dentro de la gracia sólo para lecturas)
+        tolerante = atributos.get(CLAVE_LECTURA_TOLERANTE)
+        if not tolerante:
+            # Puede escribir: ¿esta petición ya se procesó en otro contenedor?
+            verificar()
+        data, vencida = _cache_get(user_id, CACHE_STALE_GRACE_SECONDS if tolerante else 0)
         if data is not None:
-            logger.info("⚡ Cache hit (memoria)")
+            if vencida:
+                logger.info("⏳ Cache vencida (memoria): se responde y se refresca en segundo plano")
+                anotar("nivel", "memoria_vencida")
+                _refrescar_en_segundo_plano(user_id, handler_input.request_envelope, data)
+            else:
+                logger.info("⚡ Cache hit (memoria)")
+                anotar("nivel", "memoria")
             return data
 
+        # 2-4) Almacenamiento: una sola carga en vuelo por usuario
+        try:
+            return _CARGAS.hacer(user_id, lambda: DatabaseManager._cargar(handler_input, user_id))
+        except ERRORES_ALMACENAMIENTO as e:
+            # Las lecturas responden con la última copia conocida; las escrituras no parten de ella
+            respaldo = _ultima_copia(user_id) if tolerante else None
+            if respaldo is None:
+                raise
+            logger.warning(f"🐢 Persistencia sin respuesta ({e}): se responde con la última copia en memoria")
+            anotar("nivel", "degradado")
+            atributos[CLAVE_DEGRADADA] = True
+            return respaldo
+
+    @staticmethod
+    def _cargar(handler_input, user_id):
+        """Lee el documento de la caché de DynamoDB o de la persistencia y actualiza las cachés."""
         # 2) Cache en DDB (opcional)
         if ENABLE_DDB_CACHE:
             try:
-                table = DatabaseManager._get_ddb_table()
-                if table:
-                    resp = table.get_item(Key={"user_id": user_id})
-                    if "Item" in resp:
-                        data = resp["Item"].get("data", {})
-                        logger.info("⚡ Cache hit (DynamoDB)")
-                        _cache_put(user_id, data)
-                        return data
+                resp = llamar(DatabaseManager._cache_ddb_get, user_id, timeout_ms=DDB_CACHE_TIMEOUT_MS, nivel="cache_ddb")
+                if resp and "Item" in resp:
+                    data = desde_dynamo(resp["Item"].get("data", {}))
+                    logger.info("⚡ Cache hit (DynamoDB)")
+                    anotar("nivel", "dynamodb")
+                    _cache_put(user_id, data)
+                    return data
             except Exception as e:
                 logger.warning(f"DDB get_item error: {e}")
 
         # 3) Persistencia principal
+        anotar("nivel", "persistencia")
         attr_mgr = handler_input.attributes_manager
-        persistent = attr_mgr.persistent_attributes
+        persistent = llamar(lambda: attr_mgr.persistent_attributes,
+                            timeout_ms=PERSISTENCE_TIMEOUT_MS, nivel="persistencia")
         if not persistent:
             persistent = DatabaseManager.initial_data()
-            attr_mgr.persistent_attributes = persistent
-            attr_mgr.save_persistent_attributes()
+            try:
+                DatabaseManager._persistir(handler_input, persistent)
+            except ERRORES_ALMACENAMIENTO as e:
+                logger.warning(f"Documento inicial sin guardar: {e}")
+                retry_queue.encolar(user_id, persistent)
+                attr_mgr.request_attributes[CLAVE_REINTENTADA] = True
 
         # 4) Actualizar cachés
         _cache_put(user_id, persistent)
-        if ENABLE_DDB_CACHE:
-            try:
-                table = DatabaseManager._get_ddb_table()
-                if table:
-                    table.put_item(Item={
-                        "user_id": user_id,
-                        "data": persistent,
-                        "ttl": int((datetime.now() + timedelta(seconds=CACHE_TTL_SECONDS)).timestamp())
-                    })
-            except Exception as e:
-                logger.warning(f"DDB put_item error: {e}")
+        DatabaseManager._cache_ddb_put(user_id, persistent)
 
         return persistent
 
     @staticmethod
-    def save_user_data(handler_input, data):
+    def permitir_datos_vencidos(handler_input):
+        """
+        Marca la petición como de sólo lectura: si la copia en memoria venció
+        hace menos de CACHE_STALE_GRACE_SECONDS se responde con ella y se
+        refresca en segundo plano. Las escrituras nunca la usan: sin la marca,
+        una copia vencida se vuelve a leer antes de modificarla.
+        """
+        handler_input.attributes_manager.request_attributes[CLAVE_LECTURA_TOLERANTE] = True
+
+    @staticmethod
+    def limpiar_cache(user_id):
+        """Descarta la copia en memoria del usuario; la siguiente lectura va a la persistencia."""
+        _CACHE.pop(user_id, None)
+
+    @staticmethod
+    def en_memoria(user_id):
+        """True si el usuario tiene una copia vigente en memoria."""
+        return _cache_get(user_id)[0] is not None
+
+    @staticmethod
+    def precargar(user_id, data):
+        """Deja en memoria un documento leído fuera de una petición (calentamiento); nunca reemplaza uno más nuevo."""
+        _cache_put(user_id, data, solo_si_nueva=True)
+
+    @staticmethod
+    def get_version(handler_input):
+        """Versión del documento del usuario; cambia con cada escritura."""
+        return DatabaseManager.get_user_data(handler_input).get("version", 0)
+
+    @staticmethod
+    def _derivado(handler_input, clave, construir, vigente=None):
+        """
+        Vista derivada del documento, construida una vez por entrada de cache.
+        `vigente(vista)` False la reconstruye (el documento cambió sin actualizarla).
+        """
         user_id = DatabaseManager._user_id(handler_input)
+        user_data = DatabaseManager.get_user_data(handler_input)
+        item = _CACHE.get(user_id)
+        if item is None or item["data"] is not user_data:
+            return construir(user_data)
+        vista = item.get(clave)
+        if vista is None or (vigente is not None and not vigente(vista)):
+            vista = construir(user_data)
+            item[clave] = vista
+        return vista
 
-        # Persistencia principal
-        attr_mgr = handler_input.attributes_manager
-        attr_mgr.persistent_attributes = data
-        attr_mgr.save_persistent_attributes()
+    @staticmethod
+    def get_library_table(handler_input):
+        """Devuelve la vista columnar de los libros."""
+        # El índice normaliza los ids (documentos antiguos) antes de copiarlos a la tabla
+        DatabaseManager.get_library_index(handler_input)
+        return DatabaseManager._derivado(handler_input, "tabla", lambda user_data: LibraryTable.from_libros(
+            user_data.get("libros_disponibles", []), user_data.get("prestamos_activos", [])
+        ))
 
-        # Actualizar cachés
-        _cache_put(user_id, data)
+    @staticmethod
+    def get_library_index(handler_input):
+        """Devuelve los mapas por id (libros, préstamos, préstamo por libro) del documento."""
+        return DatabaseManager._derivado(handler_input, "indice", LibraryIndex)
 
-        if ENABLE_DDB_CACHE:
-            try:
-                table = DatabaseManager._get_ddb_table()
-                if table:
-                    table.put_item(Item={
-                        "user_id": user_id,
-                        "data": data,
-                        "ttl": int((datetime.now() + timedelta(seconds=CACHE_TTL_SECONDS)).timestamp())
-                    })
-            except Exception as e:
-                logger.warning(f"DDB put_item error: {e}")
+    @staticmethod
+    def get_search_index(handler_input):
+        """Índice de búsqueda de los libros: en memoria con el documento, se construye en la primera búsqueda."""
+        # Los ids se normalizan antes de indexar
+        indice = DatabaseManager.get_library_index(handler_input)
+        return DatabaseManager._derivado(
+            handler_input, "busqueda", lambda user_data: SearchIndex.de_libros(indice.libros.values()),
+            vigente=lambda busqueda: busqueda.total == len(indice.libros),
+        )
+
+    @staticmethod
+    def get_duplicate_index(handler_input):
+        """Cubetas LSH de los títulos: en memoria con el documento, se construyen la primera vez que se piden."""
+        indice = DatabaseManager.get_library_index(handler_input)
+        return DatabaseManager._derivado(
+            handler_input, "duplicados", lambda user_data: DuplicateIndex.de_libros(indice.libros.values()),
+            vigente=lambda duplicados: duplicados.total == len(indice.libros),
+        )
+
+    @staticmethod
+    def tabla_en_cache(handler_input, data):
+        """Tabla columnar de `data` si ya está construida (para actualizarla en sitio), o None."""
+        return _cache_derivado(DatabaseManager._user_id(handler_input), data, "tabla")
+
+    @staticmethod
+    def busqueda_en_cache(handler_input, data):
+        """Índice de búsqueda de `data` si ya está construido (para actualizarlo en sitio), o None."""
+        return _cache_derivado(DatabaseManager._user_id(handler_input), data, "busqueda")
+
+    @staticmethod
+    def duplicados_en_cache(handler_input, data):
+        """Índice de duplicados de `data` si ya está construido (para actualizarlo en sitio), o None."""
+        return _cache_derivado(DatabaseManager._user_id(handler_input), data, "duplicados")
+
+    @staticmethod
+    def append_libro(handler_input, data, libro):
+        """
+        Agrega un libro al documento de forma incremental: se añade al final
+        de la lista y a las vistas en caché que existan (índices, tabla columnar, búsqueda, duplicados y resumen)
+        en lugar de reconstruirlos, y se actualizan sólo los contadores afectados.
+        """
+        user_id = DatabaseManager._user_id(handler_input)
+        tabla = _cache_derivado(user_id, data, "tabla")
+        indice = _cache_derivado(user_id, data, "indice")
+        resumen = _cache_derivado(user_id, data, "resumen")
+        busqueda = _cache_derivado(user_id, data, "busqueda")
+        duplicados = _cache_derivado(user_id, data, "duplicados")
+        if indice is not None:
+            indice.agregar_libro(libro)
+        else:
+            data.setdefault("libros_disponibles", []).append(libro)
+        if busqueda is not None:
+            busqueda.agregar(libro)
+        if duplicados is not None:
+            duplicados.agregar(libro)
+        stats = data.setdefault("estadisticas", {})
+        stats["total_libros"] = len(data["libros_disponibles"])
+        if tabla is not None:
+            tabla.append(libro)
+        if resumen is not None:
+            resumen.agregar_titulo(libro.get("titulo"))
+
+        DatabaseManager.save_user_data(handler_input, data, tabla=tabla, indice=indice,
+                                       eventos=[libro_agregado(libro)])
+
+    @staticmethod
+    def save_user_data(handler_input, data, tabla=None, indice=None, eventos=None):
+        """
+        Persiste el documento. `tabla` e `indice` conservan las vistas derivadas si siguen siendo válidas.
+        `eventos` describe la mutación; con el backend de eventos sólo se escriben ellos.
+        Con `indice`, el backend single-table sólo compara los registros que el índice marcó.
+        Si la persistencia no responde a tiempo el documento queda en la cola local de reintentos.
+        """
+        user_id = DatabaseManager._user_id(handler_input)
+        _sin_claves_obsoletas(data)
+        cambios = None
+        if indice is not None:
+            # Los libros eliminados salen de la lista persistida recién ahora
+            indice.sincronizar()
+            cambios = indice.tomar_cambios()
+        if omitir_escritura():
+            # Otra entrega de esta petición ya guardó el cambio: la copia modificada en memoria se descarta
+            _CACHE.pop(user_id, None)
+            return
+        # Versión del documento: invalida todo lo derivado (fragmentos renderizados, prefetch)
+        data["version"] = data.get("version", 0) + 1
+
+        # Persistencia principal. Con una escritura anterior aún en la cola se guarda
+        # el documento completo: los eventos sueltos no la incluirían
+        if retry_queue.hay_pendiente(user_id):
+            eventos = cambios = None
+        elif eventos and hasattr(get_persistence_adapter(), "append_events"):
+            for evento in eventos:
+                evento["version"] = data["version"]
+                if CLAVE_SECUENCIA_ID in data:
+                    evento[CLAVE_SECUENCIA_ID] = data[CLAVE_SECUENCIA_ID]
+        def escribir(agrupada):
+            # Una escritura agrupada reemplaza a otras: sus eventos y cambios no bastan, va el documento completo
+            if agrupada:
+                DatabaseManager._persistir(handler_input, data)
+            else:
+                DatabaseManager._persistir(handler_input, data, eventos, cambios)
+
+        try:
+            _ESCRITURAS.escribir(user_id, data["version"], escribir)
+            retry_queue.descartar(user_id)
+        except ConflictoSecuencia:
+            # Otro contenedor escribió antes: el cambio parte de un documento viejo y
+            # reintentarlo lo pisaría. La copia modificada se descarta y la petición falla
+            _CACHE.pop(user_id, None)
+            raise
+        except ERRORES_ALMACENAMIENTO as e:
+            # El usuario recibe su respuesta; la escritura se reintenta en su siguiente petición
+            logger.warning(f"Persistencia sin respuesta al guardar: {e}")
+            retry_queue.encolar(user_id, data)
+            handler_input.attributes_manager.request_attributes[CLAVE_REINTENTADA] = True
+
+        # Actualizar cachés (una escritura simultánea más nueva no se pisa)
+        _cache_put(user_id, data, tabla, indice, solo_si_nueva=True)
+        DatabaseManager._cache_ddb_put(user_id, data)
 
     @staticmethod
     def initial_data():
@@ -161,4 +588,7 @@ class DatabaseManager:
             "historial_conversaciones": [],
             "configuracion": {"limite_prestamos": 10, "dias_prestamo": 7},  # Aumentado el límite
             "usuario_frecuente": False
-        }
\ No newline at end of file
+        }
+
+
+instrumentar_clase(DatabaseManager)
@@ -0,0 +1,104 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from functools import wraps
+
+from config import RESPONSE_BUDGET_MS, RESPONSE_MARGIN_MS
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Plazo de la petición
+# ==============================
+# Alexa corta la respuesta a los ~8 s. Al entrar al handler de Lambda se fija
+# un límite: el menor entre RESPONSE_BUDGET_MS y el tiempo que le queda a la
+# invocación, menos RESPONSE_MARGIN_MS para armar y devolver la respuesta.
+# Cada llamada al almacenamiento se corta en su propio tiempo máximo o en lo
+# que le quede a ese límite, lo que ocurra primero.
+_LIMITE = contextvars.ContextVar("limite_peticion", default=None)
+
+# Hilos que ejecutan las llamadas con tiempo límite. Una llamada cortada sigue
+# en su hilo hasta que botocore la termine (clients.py ajusta sus tiempos de
+# conexión y lectura al de la persistencia); su resultado se descarta. Una
+# llamada nueva sólo se entrega al pool cuando hay un hilo libre: si no se libera
+# ninguno dentro de su tiempo falla sin haberse encolado, en lugar de quedar en
+# la cola del pool y ejecutarse cuando ya nadie la espera.
+HILOS_ALMACENAMIENTO = 8
+_EJECUTOR = ThreadPoolExecutor(max_workers=HILOS_ALMACENAMIENTO, thread_name_prefix="almacenamiento")
+_LIBRES = threading.BoundedSemaphore(HILOS_ALMACENAMIENTO)
+
+
+class PlazoAgotado(Exception):
+    """Una llamada al almacenamiento no terminó a tiempo."""
+
+
+def restante():
+    """Segundos que le quedan a la petición actual, o None fuera de una petición."""
+    limite = _LIMITE.get()
+    return None if limite is None else limite - time.monotonic()
+
+
+def llamar(funcion, *args, timeout_ms, nivel="almacenamiento"):
+    """`funcion(*args)` cortada a `timeout_ms` o al plazo de la petición; si no termina lanza PlazoAgotado."""
+    espera = timeout_ms / 1000
+    queda = restante()
+    if queda is not None:
+        espera = min(espera, queda)
+    if espera <= 0:
+        raise PlazoAgotado(f"{nivel}: sin tiempo restante")
+    inicio = time.monotonic()
+    if not _LIBRES.acquire(timeout=espera):
+        raise PlazoAgotado(f"{nivel}: los {HILOS_ALMACENAMIENTO} hilos siguen ocupados con llamadas anteriores")
+    espera -= time.monotonic() - inicio
+    # El contexto viaja con la llamada: los spans siguen anidados bajo la petición
+    try:
+        futuro = _EJECUTOR.submit(contextvars.copy_context().run, funcion, *args)
+    except BaseException:
+        _LIBRES.release()
+        raise
+    futuro.add_done_callback(lambda _: _LIBRES.release())
+    try:
+        return futuro.result(timeout=espera)
+    except FuturesTimeout:
+        raise PlazoAgotado(f"{nivel}: sin respuesta en {espera * 1000:.0f} ms") from None
+
+
+def en_segundo_plano(funcion, *args):
+    """
+    Entrega `funcion(*args)` a un hilo libre del pool sin esperarla (trabajo
+    opcional, como el prefetch). Si no hay hilo libre no se ejecuta y retorna False.
+    """
+    if not _LIBRES.acquire(blocking=False):
+        return False
+    try:
+        futuro = _EJECUTOR.submit(contextvars.copy_context().run, funcion, *args)
+    except BaseException:
+        _LIBRES.release()
+        raise
+    futuro.add_done_callback(lambda _: _LIBRES.release())
+    return True
+
+
+@contextmanager
+def plazo(presupuesto_ms):
+    """Fija el límite de las llamadas con `llamar` dentro del bloque."""
+    token = _LIMITE.set(time.monotonic() + presupuesto_ms / 1000)
+    try:
+        yield
+    finally:
+        _LIMITE.reset(token)
+
+
+def con_plazo(lambda_handler):
+    """Envuelve el handler de Lambda fijando el plazo de cada invocación."""
+    @wraps(lambda_handler)
+    def handler(event, context):
+        presupuesto_ms = RESPONSE_BUDGET_MS
+        if hasattr(context, "get_remaining_time_in_millis"):
+            presupuesto_ms = min(presupuesto_ms, context.get_remaining_time_in_millis())
+        with plazo(presupuesto_ms - RESPONSE_MARGIN_MS):
+            return lambda_handler(event, context)
+    return handler
@@ -0,0 +1,73 @@
+import json
+import logging
+import sys
+
+import batch
+from duplicates import DuplicateIndex
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Limpieza de casi-duplicados
+# ==============================
+# Trabajo offline: recorre las bibliotecas de todos los usuarios en paralelo
+# y propone fusiones de títulos casi iguales. No modifica nada: escribe una
+# propuesta por línea (JSON) para revisarla antes de aplicarla.
+#
+#   python dedup.py [salida.jsonl] [procesos]
+
+
+def _prestados(documento):
+    return {p.get("libro_id") for p in documento.get("prestamos_activos", [])}
+
+
+def proponer_fusiones(documento):
+    """
+    Grupos de casi-duplicados del documento. En cada uno se propone conservar
+    el libro con más préstamos (o el más antiguo) y absorber el resto.
+    """
+    libros = {l.get("id"): l for l in documento.get("libros_disponibles", []) if l.get("id")}
+    indice = DuplicateIndex.de_libros(libros.values())
+    prestados = _prestados(documento)
+    propuestas = []
+    for grupo in indice.grupos_duplicados(libros):
+        grupo.sort(key=lambda l: (-(l.get("total_prestamos") or 0), l.get("fecha_agregado") or 0))
+        conservar, absorber = grupo[0], grupo[1:]
+        propuestas.append({
+            "conservar": {"id": conservar.get("id"), "titulo": conservar.get("titulo")},
+            "absorber": [
+                {"id": l.get("id"), "titulo": l.get("titulo"), "prestado": l.get("id") in prestados}
+                for l in absorber
+            ],
+            "total_prestamos": sum(l.get("total_prestamos") or 0 for l in grupo),
+        })
+    return propuestas
+
+
+def _proponer_lote(user_ids):
+    return [
+        {"user_id": user_id, **propuesta}
+        for user_id, documento in batch.documentos(user_ids)
+        for propuesta in proponer_fusiones(documento)
+    ]
+
+
+def ejecutar(salida=sys.stdout, procesos=None):
+    """Escribe las propuestas de todos los usuarios en `salida` (JSON por línea). Devuelve cuántas hubo."""
+    total = 0
+    for propuestas in batch.mapear(_proponer_lote, batch.usuarios(), batch.numero_de_procesos(procesos)):
+        for propuesta in propuestas:
+            salida.write(json.dumps(propuesta, ensure_ascii=False) + "\n")
+        total += len(propuestas)
+    logger.info(f"🔁 {total} fusiones propuestas")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    procesos = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    if len(sys.argv) > 1 and sys.argv[1] != "-":
+        with open(sys.argv[1], "w", encoding="utf-8") as archivo:
+            ejecutar(archivo, procesos)
+    else:
+        ejecutar(sys.stdout, procesos)
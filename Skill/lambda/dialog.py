@@ -0,0 +1,78 @@
+import json
+
+PASO_TITULO = "titulo"
+PASO_AUTOR = "autor"
+PASO_TIPO = "tipo"
+
+_PASOS = (PASO_TITULO, PASO_AUTOR, PASO_TIPO)
+
+# Claves de sesión del formato anterior (una por campo)
+_CLAVES_LEGADAS = ("agregando_libro", "esperando", "titulo_temp", "autor_temp", "tipo_temp", "paso_actual")
+
+class DialogoAgregarLibro:
+    """
+    Estado del diálogo de varios turnos para agregar un libro.
+    Se guarda en la sesión como un único token compacto en lugar de cinco
+    atributos sueltos, y cada turno sólo cambia el campo que se respondió.
+    """
+    CLAVE_SESION = "agregar_libro"
+
+    __slots__ = ("titulo", "autor", "tipo")
+
+    def __init__(self, titulo=None, autor=None, tipo=None):
+        self.titulo = titulo
+        self.autor = autor
+        self.tipo = tipo
+
+    @classmethod
+    def activo(cls, session_attrs):
+        return cls.CLAVE_SESION in session_attrs or bool(session_attrs.get("agregando_libro"))
+
+    @classmethod
+    def desde_sesion(cls, session_attrs):
+        """Recupera el diálogo en curso, o None si no hay uno."""
+        token = session_attrs.get(cls.CLAVE_SESION)
+        if token:
+            try:
+                return cls(*json.loads(token))
+            except (TypeError, ValueError):
+                return None
+        if session_attrs.get("agregando_libro"):
+            # Sesiones abiertas antes del cambio de formato
+            return cls(session_attrs.get("titulo_temp"), session_attrs.get("autor_temp"), session_attrs.get("tipo_temp"))
+        return None
+
+    def codificar(self):
+        return json.dumps([self.titulo, self.autor, self.tipo], ensure_ascii=False, separators=(",", ":"))
+
+    def guardar(self, session_attrs):
+        session_attrs[self.CLAVE_SESION] = self.codificar()
+        for clave in _CLAVES_LEGADAS:
+            session_attrs.pop(clave, None)
+
+    @classmethod
+    def terminar(cls, session_attrs):
+        session_attrs.pop(cls.CLAVE_SESION, None)
+        for clave in _CLAVES_LEGADAS:
+            session_attrs.pop(clave, None)
+
+    def completar(self, titulo=None, autor=None, tipo=None):
+        """Rellena los campos recibidos sin pisar los que ya se tenían."""
+        self.titulo = titulo or self.titulo
+        self.autor = autor or self.autor
+        self.tipo = tipo or self.tipo
+
+    @property
+    def paso_actual(self):
+        """Primer campo que falta, o None si el libro está completo."""
+        for paso in _PASOS:
+            if not getattr(self, paso):
+                return paso
+        return None
+
+    def responder(self, valor):
+        """Asigna `valor` al campo que se estaba esperando y devuelve el siguiente paso."""
+        paso = self.paso_actual
+        if paso:
+            setattr(self, paso, valor)
+        return self.paso_actual
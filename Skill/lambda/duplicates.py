@@ -0,0 +1,183 @@
+import random
+import re
+import zlib
+from functools import lru_cache
+
+from search import terminos
+
+# ==============================
+# Firmas MinHash de títulos
+# ==============================
+# Clave con la que los documentos antiguos guardaban el índice; ya no se persiste
+CLAVE_INDICE_DUPLICADOS = "indice_duplicados"
+
+# 32 permutaciones en 8 bandas de 4 filas: dos títulos con similitud ~0.6
+# caen en la misma cubeta con probabilidad 1/2, con 0.8 casi siempre
+NUM_PERMUTACIONES = 32
+FILAS_POR_BANDA = 4
+# Jaccard mínimo (sobre trigramas) para considerar dos títulos el mismo libro
+UMBRAL_SIMILITUD = 0.75
+
+# Cada "permutación" es un hash multiply-shift del crc32 del trigrama
+# ((a*x + b) mod 2^64, 32 bits altos): universal y sin la división de mod p.
+# Semilla fija: las mismas cubetas en todos los contenedores y en dedup.py
+_MASCARA_64 = (1 << 64) - 1
+_rng = random.Random(20240517)
+_COEFICIENTES = tuple((_rng.getrandbits(64) | 1, _rng.getrandbits(64)) for _ in range(NUM_PERMUTACIONES))
+del _rng
+
+_NUMEROS = re.compile(r"\d+")
+
+
+@lru_cache(maxsize=4096)
+def trigramas(titulo):
+    """
+    Trigramas de caracteres del título normalizado (sin acentos, stopwords
+    ni sufijos): "Harry Potter y la piedra filosofal" y "Harry Potter la
+    piedra filosofal" dan el mismo conjunto.
+    """
+    texto = " ".join(terminos(titulo))
+    if len(texto) < 3:
+        return frozenset((texto,)) if texto else frozenset()
+    return frozenset(texto[i:i + 3] for i in range(len(texto) - 2))
+
+
+def similitud(titulo_a, titulo_b):
+    """Jaccard de trigramas; 0 si los números (tomos, años) no coinciden."""
+    if set(_NUMEROS.findall(titulo_a or "")) != set(_NUMEROS.findall(titulo_b or "")):
+        return 0.0
+    a, b = trigramas(titulo_a), trigramas(titulo_b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+@lru_cache(maxsize=16384)
+def _permutaciones(trigrama):
+    """Valor del trigrama en cada permutación. Los trigramas se repiten mucho entre títulos."""
+    h = zlib.crc32(trigrama.encode("utf-8"))
+    return tuple(((a * h + b) & _MASCARA_64) >> 32 for a, b in _COEFICIENTES)
+
+
+def firma(titulo):
+    tris = trigramas(titulo)
+    if not tris:
+        return ()
+    # Mínimo por permutación sobre los trigramas: columna a columna, en C
+    return tuple(map(min, zip(*map(_permutaciones, tris))))
+
+
+@lru_cache(maxsize=4096)
+def cubetas(titulo):
+    """Claves LSH del título, una por banda ('<banda><hash de 24 bits de sus filas>')."""
+    valores = firma(titulo)
+    if not valores:
+        return ()
+    return tuple(
+        f"{banda}{zlib.crc32(repr(valores[inicio:inicio + FILAS_POR_BANDA]).encode()) & 0xFFFFFF:06x}"
+        for banda, inicio in enumerate(range(0, NUM_PERMUTACIONES, FILAS_POR_BANDA))
+    )
+
+
+# ==============================
+# Índice LSH por biblioteca
+# ==============================
+class DuplicateIndex:
+    """
+    Cubetas LSH de los títulos de un usuario para encontrar casi-duplicados
+    sin comparar contra toda la biblioteca. Igual que el índice de búsqueda,
+    vive en memoria junto al documento y se construye la primera vez que se
+    agrega un libro tras cargarlo:
+        {"b": {cubeta: [libro_id, ...]}, "n": libros indexados}
+    Los candidatos de las cubetas se confirman con el Jaccard exacto.
+    """
+    __slots__ = ("datos",)
+
+    def __init__(self, datos=None):
+        self.datos = datos or {"b": {}, "n": 0}
+
+    @classmethod
+    def de_libros(cls, libros):
+        """Índice de `libros` (ids únicos: no se busca cada id en su cubeta como en `agregar`)."""
+        indice = cls()
+        grupos = indice.datos["b"]
+        for libro in libros:
+            libro_id = libro.get("id")
+            if not libro_id:
+                continue
+            for cubeta in cubetas(libro.get("titulo") or ""):
+                grupos.setdefault(cubeta, []).append(libro_id)
+            indice.datos["n"] += 1
+        return indice
+
+    @property
+    def total(self):
+        """Libros indexados."""
+        return self.datos["n"]
+
+    def agregar(self, libro):
+        libro_id = libro.get("id")
+        if not libro_id:
+            return
+        grupos = self.datos["b"]
+        for cubeta in cubetas(libro.get("titulo") or ""):
+            ids = grupos.setdefault(cubeta, [])
+            if libro_id not in ids:
+                ids.append(libro_id)
+        self.datos["n"] += 1
+
+    def quitar(self, libro):
+        libro_id = libro.get("id")
+        grupos = self.datos["b"]
+        for cubeta in cubetas(libro.get("titulo") or ""):
+            ids = grupos.get(cubeta)
+            if ids and libro_id in ids:
+                ids.remove(libro_id)
+                if not ids:
+                    del grupos[cubeta]
+        self.datos["n"] = max(0, self.datos["n"] - 1)
+
+    def candidatos(self, titulo):
+        """Ids que comparten al menos una cubeta con `titulo`."""
+        grupos = self.datos["b"]
+        encontrados = set()
+        for cubeta in cubetas(titulo or ""):
+            encontrados.update(grupos.get(cubeta, ()))
+        return encontrados
+
+    def parecidos(self, titulo, libros):
+        """[(similitud, libro)] de los libros casi iguales a `titulo`, el más parecido primero. `libros` es id -> libro."""
+        resultado = []
+        for libro_id in self.candidatos(titulo):
+            libro = libros.get(libro_id)
+            if libro is None:
+                continue
+            valor = similitud(titulo, libro.get("titulo"))
+            if valor >= UMBRAL_SIMILITUD:
+                resultado.append((valor, libro))
+        resultado.sort(key=lambda par: par[0], reverse=True)
+        return resultado
+
+    def grupos_duplicados(self, libros):
+        """Grupos (listas de libros, dos o más) de casi-duplicados dentro de la biblioteca."""
+        padre = {}
+
+        def raiz(libro_id):
+            while padre.get(libro_id, libro_id) != libro_id:
+                libro_id = padre[libro_id]
+            return libro_id
+
+        for ids in self.datos["b"].values():
+            for i, a in enumerate(ids):
+                for b in ids[i + 1:]:
+                    if raiz(a) == raiz(b) or a not in libros or b not in libros:
+                        continue
+                    if similitud(libros[a].get("titulo"), libros[b].get("titulo")) >= UMBRAL_SIMILITUD:
+                        padre[raiz(b)] = raiz(a)
+
+        grupos = {}
+        for libro_id in padre:
+            grupos.setdefault(raiz(libro_id), set()).add(libro_id)
+        for cabeza, miembros in grupos.items():
+            miembros.add(cabeza)
+        return [[libros[i] for i in sorted(miembros)] for miembros in grupos.values()]
@@ -0,0 +1,103 @@
+from datetime import datetime
+from models import CLAVE_SECUENCIA_ID, contar_para_persona
+from fechas import normalizar_campos
+
+# ==============================
+# Eventos de mutación
+# ==============================
+BOOK_ADDED = "BookAdded"
+BOOK_LENT = "BookLent"
+BOOK_RETURNED = "BookReturned"
+BOOK_DELETED = "BookDeleted"
+
+
+def crear_evento(tipo, **datos):
+    """Evento serializable; `ts` queda como traza de auditoría."""
+    return {"tipo": tipo, "ts": int(datetime.now().timestamp()), **datos}
+
+
+def libro_agregado(libro):
+    # Copia: el dict del documento se sigue modificando después del evento
+    return crear_evento(BOOK_ADDED, libro=dict(libro))
+
+
+def libro_prestado(prestamo):
+    return crear_evento(BOOK_LENT, prestamo=dict(prestamo))
+
+
+def libro_devuelto(prestamo_finalizado):
+    return crear_evento(
+        BOOK_RETURNED,
+        prestamo_id=prestamo_finalizado.get("id"),
+        fecha_devolucion=prestamo_finalizado.get("fecha_devolucion"),
+        devuelto_a_tiempo=prestamo_finalizado.get("devuelto_a_tiempo"),
+    )
+
+
+def libro_eliminado(libro):
+    return crear_evento(BOOK_DELETED, libro_id=libro.get("id"), titulo=libro.get("titulo"))
+
+
+# ==============================
+# Reconstrucción del estado
+# ==============================
+def _buscar_libro(libros, libro_id, titulo=None):
+    for libro in libros:
+        if libro.get("id") == libro_id:
+            return libro
+    if titulo:
+        # Documentos antiguos: el id se asignó en el mismo préstamo
+        for libro in libros:
+            if not libro.get("id") and libro.get("titulo", "").lower() == titulo.lower():
+                libro["id"] = libro_id
+                return libro
+    return None
+
+
+def aplicar_evento(documento, evento):
+    """Aplica un evento sobre el documento (en sitio) igual que lo hizo BibliotecaService."""
+    tipo = evento.get("tipo")
+    libros = documento.setdefault("libros_disponibles", [])
+    prestamos = documento.setdefault("prestamos_activos", [])
+    stats = documento.setdefault("estadisticas", {})
+
+    if tipo == BOOK_ADDED:
+        libros.append(dict(evento["libro"]))
+        stats["total_libros"] = len(libros)
+
+    elif tipo == BOOK_LENT:
+        prestamo = dict(evento["prestamo"])
+        prestamos.append(prestamo)
+        libro = _buscar_libro(libros, prestamo.get("libro_id"), prestamo.get("titulo"))
+        if libro is not None:
+            libro["estado"] = "prestado"
+            libro["total_prestamos"] = libro.get("total_prestamos", 0) + 1
+        stats["total_prestamos"] = stats.get("total_prestamos", 0) + 1
+        contar_para_persona(documento, prestamo.get("persona"), prestamos=1)
+
+    elif tipo == BOOK_RETURNED:
+        for i, prestamo in enumerate(prestamos):
+            if prestamo.get("id") == evento.get("prestamo_id"):
+                finalizado = normalizar_campos(prestamos.pop(i), ("fecha_prestamo", "fecha_limite"))
+                finalizado["fecha_devolucion"] = evento.get("fecha_devolucion")
+                finalizado["estado"] = "devuelto"
+                finalizado["devuelto_a_tiempo"] = evento.get("devuelto_a_tiempo")
+                documento.setdefault("historial_prestamos", []).append(finalizado)
+                libro = _buscar_libro(libros, finalizado.get("libro_id"))
+                if libro is not None:
+                    libro["estado"] = "disponible"
+                contar_para_persona(documento, finalizado.get("persona"), devoluciones=1,
+                                    devoluciones_tarde=0 if finalizado["devuelto_a_tiempo"] else 1)
+                break
+        stats["total_devoluciones"] = stats.get("total_devoluciones", 0) + 1
+
+    elif tipo == BOOK_DELETED:
+        libro = _buscar_libro(libros, evento.get("libro_id"), evento.get("titulo"))
+        documento["libros_disponibles"] = [l for l in libros if l is not libro]
+        stats["total_libros"] = len(documento["libros_disponibles"])
+
+    if "version" in evento:
+        documento["version"] = evento["version"]
+    if CLAVE_SECUENCIA_ID in evento:
+        documento[CLAVE_SECUENCIA_ID] = evento[CLAVE_SECUENCIA_ID]
+    return documento
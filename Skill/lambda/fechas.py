@@ -0,0 +1,72 @@
+import time
+from datetime import date, datetime
+from functools import lru_cache
+
+# ==============================
+# Fechas como enteros epoch
+# ==============================
+# Los documentos guardan segundos epoch (int). Los documentos antiguos tienen
+# cadenas ISO; se convierten al leerlas y quedan como int con la siguiente escritura.
+SEGUNDOS_POR_DIA = 86400
+
+# Nombres fijos: no dependen del locale del proceso (Lambda corre en inglés)
+MESES = (
+    "enero", "febrero", "marzo", "abril", "mayo", "junio",
+    "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre",
+)
+
+def ahora():
+    return int(time.time())
+
+def en_dias(dias, desde=None):
+    return (desde if desde is not None else ahora()) + dias * SEGUNDOS_POR_DIA
+
+@lru_cache(maxsize=4096)
+def _iso_a_epoch(valor):
+    return int(datetime.fromisoformat(valor).timestamp())
+
+def fecha_a_epoch(valor):
+    """Convierte una fecha ISO (formato legado) o un entero a segundos epoch; 0 si no se puede."""
+    if isinstance(valor, int):
+        return valor
+    if not valor:
+        return 0
+    try:
+        return _iso_a_epoch(valor)
+    except (TypeError, ValueError):
+        return 0
+
+def normalizar_campos(registro, campos):
+    """Pasa a epoch, en sitio, los campos de fecha que sigan como cadena ISO."""
+    for campo in campos:
+        valor = registro.get(campo)
+        if isinstance(valor, str):
+            registro[campo] = fecha_a_epoch(valor)
+    return registro
+
+def dias_restantes(epoch, referencia=None):
+    """Días completos hasta `epoch` (negativo si ya pasó), como `timedelta.days`."""
+    return (epoch - (referencia if referencia is not None else ahora())) // SEGUNDOS_POR_DIA
+
+# ==============================
+# Textos por día (memoizados)
+# ==============================
+def _dia(epoch):
+    return date.fromtimestamp(epoch).toordinal()
+
+@lru_cache(maxsize=1024)
+def _texto_dia_mes(ordinal):
+    dia = date.fromordinal(ordinal)
+    return f"{dia.day} de {MESES[dia.month - 1]}"
+
+@lru_cache(maxsize=1024)
+def _texto_iso(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+def dia_y_mes(epoch):
+    """'25 de octubre'."""
+    return _texto_dia_mes(_dia(epoch))
+
+def fecha_iso(epoch):
+    """'2026-10-25' (día local)."""
+    return _texto_iso(_dia(epoch))
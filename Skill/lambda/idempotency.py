@@ -0,0 +1,160 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+
+from config import ENABLE_DDB_CACHE, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_TABLE, DDB_CACHE_TIMEOUT_MS
+from clients import recurso
+from deadline import llamar, PlazoAgotado
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Peticiones repetidas
+# ==============================
+# Alexa puede reenviar una petición con el mismo requestId. Si esa petición
+# escribió (agregar, prestar, devolver...), repetirla duplicaría el cambio.
+# La respuesta de toda petición que escribió se guarda IDEMPOTENCY_TTL_SECONDS:
+#   - en memoria: una repetición en el mismo contenedor se responde sin ejecutar nada
+#     (y si llega mientras la original sigue en curso, espera su respuesta);
+#   - en la tabla de caché (ENABLE_DDB_CACHE), clave PETICION#<requestId>: si la
+#     repetición cae en otro contenedor, se consulta en su primera lectura del
+#     documento, antes de que el handler decida nada con él (la repetición de un
+#     préstamo ya vería el libro prestado y respondería otra cosa). Sus escrituras
+#     se omiten y se responde lo mismo que la original. omitir_escritura vuelve a
+#     comprobarlo justo antes de escribir, por si la petición escribe sin leer.
+# Las peticiones de sólo lectura (DatabaseManager.permitir_datos_vencidos) y las
+# que no tocan el documento no guardan ni consultan nada.
+
+MAX_RESPUESTAS_EN_MEMORIA = 1000
+
+_RESPUESTAS = OrderedDict()
+_LOCK = threading.Lock()
+_EN_CURSO = SingleFlight()
+# Estado de la petición actual: {"request_id", "escribio", "verificada", "repetida"}
+_ESTADO = ContextVar("idempotencia", default=None)
+
+
+def _clave(request_id):
+    return f"PETICION#{request_id}"
+
+
+def _memoria_get(request_id):
+    with _LOCK:
+        guardada = _RESPUESTAS.get(request_id)
+        if guardada is None:
+            return None
+        respuesta, vence = guardada
+        if time.time() > vence:
+            del _RESPUESTAS[request_id]
+            return None
+        return respuesta
+
+
+def _memoria_put(request_id, respuesta):
+    with _LOCK:
+        _RESPUESTAS[request_id] = (respuesta, time.time() + IDEMPOTENCY_TTL_SECONDS)
+        _RESPUESTAS.move_to_end(request_id)
+        while len(_RESPUESTAS) > MAX_RESPUESTAS_EN_MEMORIA:
+            _RESPUESTAS.popitem(last=False)
+
+
+def _tabla():
+    return recurso("dynamodb").Table(IDEMPOTENCY_TABLE)
+
+
+def _tabla_get(request_id):
+    if not ENABLE_DDB_CACHE:
+        return None
+    try:
+        item = llamar(lambda: _tabla().get_item(Key={"user_id": _clave(request_id)}).get("Item"),
+                      timeout_ms=DDB_CACHE_TIMEOUT_MS, nivel="idempotencia")
+    except Exception as e:
+        # Sin confirmación se escribe igual: es lo que pasaba antes
+        logger.warning(f"Idempotencia sin verificar: {e}")
+        return None
+    if not item or int(item.get("ttl", 0)) < time.time():
+        return None
+    return json.loads(item["respuesta"])
+
+
+def _tabla_put(request_id, respuesta):
+    if not ENABLE_DDB_CACHE:
+        return
+    item = {
+        "user_id": _clave(request_id),
+        # Como texto: la respuesta tiene floats que DynamoDB no acepta sin convertir
+        "respuesta": json.dumps(respuesta, ensure_ascii=False, default=str),
+        "ttl": int(time.time()) + IDEMPOTENCY_TTL_SECONDS,
+    }
+    try:
+        llamar(lambda: _tabla().put_item(Item=item), timeout_ms=DDB_CACHE_TIMEOUT_MS, nivel="idempotencia")
+    except Exception as e:
+        logger.warning(f"Respuesta de {request_id} sin guardar en DynamoDB: {e}")
+
+
+def verificar():
+    """Consulta (una vez por petición) si otra entrega de esta misma petición ya escribió."""
+    estado = _ESTADO.get()
+    if estado is None or estado["verificada"]:
+        return
+    estado["verificada"] = True
+    estado["repetida"] = _tabla_get(estado["request_id"])
+    if estado["repetida"] is not None:
+        logger.info(f"🔁 Petición {estado['request_id']} ya procesada en otro contenedor: no se escribe")
+
+
+def omitir_escritura():
+    """
+    Llamar antes de escribir. True si otra entrega de esta misma petición ya
+    escribió: la escritura se omite y se responderá lo que respondió aquella.
+    """
+    estado = _ESTADO.get()
+    if estado is None:
+        return False
+    verificar()
+    if estado["repetida"] is not None:
+        return True
+    estado["escribio"] = True
+    return False
+
+
+def _procesar(lambda_handler, event, context, request_id):
+    estado = {"request_id": request_id, "escribio": False, "verificada": False, "repetida": None}
+    token = _ESTADO.set(estado)
+    try:
+        respuesta = lambda_handler(event, context)
+    finally:
+        _ESTADO.reset(token)
+    if estado["repetida"] is not None:
+        _memoria_put(request_id, estado["repetida"])
+        return estado["repetida"]
+    if estado["escribio"]:
+        _memoria_put(request_id, respuesta)
+        _tabla_put(request_id, respuesta)
+    return respuesta
+
+
+def idempotente(lambda_handler):
+    """Envuelve el handler de Lambda: una petición repetida recibe la respuesta de la original."""
+    @wraps(lambda_handler)
+    def handler(event, context):
+        request_id = ((event or {}).get("request") or {}).get("requestId")
+        if not request_id:
+            return lambda_handler(event, context)
+        guardada = _memoria_get(request_id)
+        if guardada is not None:
+            logger.info(f"🔁 Petición {request_id} repetida: se responde desde la caché")
+            return guardada
+        try:
+            return _EN_CURSO.hacer(request_id, lambda: _procesar(lambda_handler, event, context, request_id))
+        except PlazoAgotado:
+            # La original sigue en curso y no hay tiempo de esperarla; si ya escribió,
+            # la verificación de la tabla (o la respuesta en memoria) evita repetir el cambio
+            guardada = _memoria_get(request_id)
+            return guardada if guardada is not None else _procesar(lambda_handler, event, context, request_id)
+    return handler
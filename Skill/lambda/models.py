@@ -1,41 +1,103 @@
-import uuid
-from datetime import datetime, timedelta
-from ask_sdk_core.handler_input import HandlerInput
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from fechas import ahora, en_dias, fecha_a_epoch, dia_y_mes
 
-def generar_id_unico():
-    return str(uuid.uuid4())[:8]
+# ==============================
+# Identificadores compactos
+# ==============================
+# Base32 de Crockford: sin i, l, o ni u, así que un id se puede dictar sin ambigüedad
+_ALFABETO_ID = "0123456789abcdefghjkmnpqrstvwxyz"
+_EQUIVALENCIAS_ID = str.maketrans({"i": "1", "l": "1", "o": "0"})
+# Contador por usuario guardado en el documento; libros y préstamos comparten la secuencia
+CLAVE_SECUENCIA_ID = "siguiente_id"
 
-def generar_id_prestamo():
-    return str(uuid.uuid4())[:8]
+def codificar_id(numero):
+    """Entero positivo -> id base32 ('1', 'z', '10', ...)."""
+    digitos = []
+    while True:
+        numero, resto = divmod(numero, 32)
+        digitos.append(_ALFABETO_ID[resto])
+        if not numero:
+            return "".join(reversed(digitos))
+
+def normalizar_id(texto):
+    """Id tal como llega de la voz ('B 7', 'bo-7') -> forma canónica ('b7', 'b07')."""
+    if not texto:
+        return texto
+    compacto = "".join(texto.lower().split()).replace("-", "")
+    return compacto.translate(_EQUIVALENCIAS_ID)
+
+def asignar_id(documento):
+    """
+    Reserva el siguiente id del usuario. Es monotónico y nunca se reutiliza,
+    así que no colisiona con otro libro o préstamo del mismo usuario. Los ids
+    antiguos (8 caracteres hexadecimales) no se alcanzan hasta 32**7 ids.
+    """
+    numero = documento.get(CLAVE_SECUENCIA_ID, 1)
+    documento[CLAVE_SECUENCIA_ID] = numero + 1
+    return codificar_id(numero)
+
+# ==============================
+# Personas (prestatarios)
+# ==============================
+CLAVE_ESTADISTICAS_PERSONAS = "estadisticas_personas"
+
+def normalizar_persona(nombre):
+    """Clave de una persona: sin mayúsculas, acentos ni espacios repetidos ('  José ' -> 'jose')."""
+    if not nombre:
+        return "un amigo"
+    sin_acentos = unicodedata.normalize("NFKD", nombre.casefold())
+    sin_acentos = "".join(c for c in sin_acentos if not unicodedata.combining(c))
+    return " ".join(sin_acentos.split())
+
+def contar_para_persona(documento, nombre, **incrementos):
+    """Acumula estadísticas de por vida de una persona (préstamos, devoluciones, tardías)."""
+    por_persona = documento.setdefault(CLAVE_ESTADISTICAS_PERSONAS, {})
+    stats = por_persona.setdefault(normalizar_persona(nombre), {"nombre": nombre})
+    for campo, cantidad in incrementos.items():
+        stats[campo] = stats.get(campo, 0) + cantidad
+    return stats
 
 class Prestamo:
-    def __init__(self, libro_id, titulo, nombre_persona, dias_prestamo=7):
-        self.id = generar_id_prestamo()
+    __slots__ = ("id", "libro_id", "titulo", "persona", "fecha_prestamo", "fecha_limite", "estado")
+
+    def __init__(self, libro_id, titulo, nombre_persona, id_prestamo, dias_prestamo=7):
+        # El id sale siempre de asignar_id (LibraryIndex.nuevo_id): único dentro del usuario
+        self.id = id_prestamo
         self.libro_id = libro_id
         self.titulo = titulo
         self.persona = nombre_persona if nombre_persona else "un amigo"
-        self.fecha_prestamo = datetime.now().isoformat()
-        self.fecha_limite = (datetime.now() + timedelta(days=dias_prestamo)).isoformat()
+        self.fecha_prestamo = ahora()
+        self.fecha_limite = en_dias(dias_prestamo, self.fecha_prestamo)
         self.estado = "activo"
-        
+
+    @classmethod
+    def from_dict(cls, data):
+        prestamo = cls.__new__(cls)
+        for campo in cls.__slots__:
+            setattr(prestamo, campo, data.get(campo))
+        return prestamo
+
     def to_dict(self):
-        return self.__dict__
+        return {campo: getattr(self, campo) for campo in self.__slots__}
 
     @property
     def fecha_limite_readable(self):
-        try:
-            return datetime.fromisoformat(self.fecha_limite).strftime("%d de %B")
-        except:
-            return "una semana"
+        fecha_limite = fecha_a_epoch(self.fecha_limite)
+        return dia_y_mes(fecha_limite) if fecha_limite else "una semana"
 
 class Libro:
-    def __init__(self, titulo, autor, tipo):
+    __slots__ = ("titulo", "autor", "tipo", "id", "fecha_agregado", "total_prestamos", "estado")
+
+    def __init__(self, titulo, autor, tipo, id_libro):
         self.titulo = titulo
         self.autor = self._normalize_value(autor, "Desconocido")
         self.tipo = self._normalize_value(tipo, "Sin categoría")
-        
-        self.id = generar_id_unico()
-        self.fecha_agregado = datetime.now().isoformat()
+
+        self.id = id_libro
+        self.fecha_agregado = ahora()
         self.total_prestamos = 0
         self.estado = "disponible"
 
@@ -45,7 +107,302 @@ class Libro:
             return default
         return value if value else default
 
+    @classmethod
+    def from_dict(cls, data):
+        libro = cls.__new__(cls)
+        for campo in cls.__slots__:
+            setattr(libro, campo, data.get(campo))
+        return libro
+
     def to_dict(self):
-        return self.__dict__
-        
-    
\ No newline at end of file
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+
+# ==============================
+# Tabla columnar de libros
+# ==============================
+ESTADO_DISPONIBLE = 0
+ESTADO_PRESTADO = 1
+
+class LibraryTable:
+    """
+    Libros de un usuario almacenados como columnas paralelas.
+    Autores y tipos se internan (se repiten mucho), el estado es un byte por
+    libro y las fechas son enteros epoch, así que filtrar no toca diccionarios.
+    Eliminar deja una lápida (id None) en la fila en lugar de desplazar las
+    columnas; las consultas recorren sólo `vivas()` y las lápidas se compactan
+    cuando llegan a ser la mitad de las filas.
+    """
+    __slots__ = ("ids", "titulos", "autores", "tipos", "estados", "fechas", "total_prestamos",
+                 "posiciones", "borradas", "cache")
+
+    def __init__(self):
+        self.ids = []
+        self.titulos = []
+        self.autores = []
+        self.tipos = []
+        self.estados = bytearray()
+        self.fechas = array("q")
+        self.total_prestamos = array("I")
+        # id -> fila, para actualizar un libro sin recorrer la tabla; las lápidas no renumeran nada
+        self.posiciones = {}
+        self.borradas = 0
+        # Índices derivados (listas por valor, permutaciones ordenadas); se invalidan al modificar
+        self.cache = {}
+
+    @classmethod
+    def from_libros(cls, libros, prestamos=()):
+        ids_prestados = {p.get("libro_id") for p in prestamos}
+        tabla = cls()
+        for libro in libros:
+            tabla.append(libro, libro.get("id") in ids_prestados)
+        return tabla
+
+    def append(self, libro, prestado=False):
+        self.posiciones[libro.get("id")] = len(self.ids)
+        self.ids.append(libro.get("id"))
+        self.titulos.append(libro.get("titulo", ""))
+        self.autores.append(sys.intern(libro.get("autor") or "Desconocido"))
+        self.tipos.append(sys.intern(libro.get("tipo") or "Sin categoría"))
+        self.estados.append(ESTADO_PRESTADO if prestado else ESTADO_DISPONIBLE)
+        self.fechas.append(fecha_a_epoch(libro.get("fecha_agregado")))
+        self.total_prestamos.append(libro.get("total_prestamos", 0) or 0)
+        self.cache.clear()
+
+    def actualizar(self, libro, prestado):
+        """Refleja un préstamo o devolución en la fila del libro. Retorna False si no está en la tabla."""
+        i = self._posicion(libro.get("id"))
+        if i is None:
+            return False
+        self.estados[i] = ESTADO_PRESTADO if prestado else ESTADO_DISPONIBLE
+        self.total_prestamos[i] = libro.get("total_prestamos", 0) or 0
+        # Sólo se invalida lo que depende de las columnas modificadas
+        for clave in ("valores_estado", "orden_prestamos"):
+            self.cache.pop(clave, None)
+        return True
+
+    def quitar(self, libro_id):
+        """Marca la fila del libro como eliminada; las demás conservan su fila y su orden. Retorna False si no está."""
+        i = self.posiciones.pop(libro_id, None)
+        if i is None:
+            return False
+        self.ids[i] = None
+        self.titulos[i] = ""
+        self.borradas += 1
+        self.cache.clear()
+        if self.borradas * 2 > len(self.ids):
+            self._compactar()
+        return True
+
+    def _compactar(self):
+        """Descarta las lápidas (lineal, pero sólo tras eliminar la mitad de las filas)."""
+        vivas = self.vivas()
+        self.ids = [self.ids[i] for i in vivas]
+        self.titulos = [self.titulos[i] for i in vivas]
+        self.autores = [self.autores[i] for i in vivas]
+        self.tipos = [self.tipos[i] for i in vivas]
+        self.estados = bytearray(self.estados[i] for i in vivas)
+        self.fechas = array("q", (self.fechas[i] for i in vivas))
+        self.total_prestamos = array("I", (self.total_prestamos[i] for i in vivas))
+        self.posiciones = {libro_id: i for i, libro_id in enumerate(self.ids)}
+        self.borradas = 0
+        self.cache.clear()
+
+    def _posicion(self, libro_id):
+        return self.posiciones.get(libro_id)
+
+    def vivas(self):
+        """Filas no eliminadas, en el orden en que se agregaron."""
+        if not self.borradas:
+            return range(len(self.ids))
+        vivas = self.cache.get("vivas")
+        if vivas is None:
+            vivas = [i for i, libro_id in enumerate(self.ids) if libro_id is not None]
+            self.cache["vivas"] = vivas
+        return vivas
+
+    def __len__(self):
+        return len(self.ids) - self.borradas
+
+    def fila(self, i):
+        return {
+            "id": self.ids[i],
+            "titulo": self.titulos[i],
+            "autor": self.autores[i],
+            "tipo": self.tipos[i],
+            "estado": "prestado" if self.estados[i] == ESTADO_PRESTADO else "disponible",
+            "fecha_agregado": self.fechas[i],
+            "total_prestamos": self.total_prestamos[i],
+        }
+
+    def filas(self, indices):
+        return [self.fila(i) for i in indices]
+
+
+# ==============================
+# Índices del documento por id
+# ==============================
+class LibraryIndex:
+    """
+    Mapas por id sobre los dicts del documento (son los mismos objetos, no
+    copias): libros y préstamos ordenados por id, préstamo activo por libro
+    y libros por título exacto. Prestar, devolver y eliminar consultan y
+    actualizan estos mapas en lugar de recorrer las listas. El documento
+    persistido sigue usando las listas de siempre; un libro eliminado sale
+    de `libros_disponibles` recién en `sincronizar`, al guardar.
+    """
+    __slots__ = ("documento", "libros", "por_titulo", "prestamos", "prestamo_por_libro", "por_persona",
+                 "numeros", "altas", "quitados", "pendientes", "cambios")
+
+    def __init__(self, documento):
+        self.documento = documento
+        self.libros = {}
+        self.por_titulo = {}
+        self.prestamos = {}
+        self.prestamo_por_libro = {}
+        # persona normalizada -> {id de préstamo: préstamo activo}
+        self.por_persona = {}
+        # id -> número de alta (su posición en la lista al indexarlo). La posición actual
+        # es ese número menos los ya quitados de la lista antes que él (`quitados`, ordenados);
+        # `pendientes` son los eliminados que siguen en la lista hasta sincronizar
+        self.numeros = {}
+        self.altas = 0
+        self.quitados = []
+        self.pendientes = []
+        # (lista, id) -> registro modificado, o None si se quitó, desde la última escritura.
+        # None: no se sabe qué cambió y la siguiente escritura compara el documento entero
+        self.cambios = {}
+        for libro in documento.setdefault("libros_disponibles", []):
+            if not libro.get("id") or libro["id"] in self.libros:
+                # Documentos antiguos sin id, o ids truncados que colisionan: el id
+                # nuevo se persiste con la siguiente escritura
+                libro["id"] = asignar_id(documento)
+                self.cambios = None
+            self._indexar_libro(libro)
+        for prestamo in documento.setdefault("prestamos_activos", []):
+            if not prestamo.get("id"):
+                self.cambios = None
+            self._indexar_prestamo(prestamo)
+
+    def _indexar_libro(self, libro):
+        self.libros[libro["id"]] = libro
+        self.numeros[libro["id"]] = self.altas
+        self.altas += 1
+        # Lista por título: los documentos antiguos pueden repetir títulos
+        self.por_titulo.setdefault(libro.get("titulo", "").lower(), []).append(libro)
+
+    def _indexar_prestamo(self, prestamo):
+        self.prestamos[prestamo.get("id")] = prestamo
+        self.prestamo_por_libro[prestamo.get("libro_id")] = prestamo
+        self.por_persona.setdefault(normalizar_persona(prestamo.get("persona")), {})[prestamo.get("id")] = prestamo
+
+    # ------------------------------
+    # Consultas
+    # ------------------------------
+    def libro(self, libro_id):
+        return self.libros.get(libro_id)
+
+    def libro_por_titulo(self, titulo):
+        if not titulo:
+            return None
+        mismos = self.por_titulo.get(titulo.lower())
+        return mismos[0] if mismos else None
+
+    def prestamo(self, prestamo_id):
+        """Préstamo activo por id; acepta el id tal como se dictó."""
+        if not prestamo_id:
+            return None
+        return self.prestamos.get(prestamo_id) or self.prestamos.get(normalizar_id(prestamo_id))
+
+    def prestamos_de_persona(self, nombre):
+        """Préstamos activos de una persona, en el orden en que se hicieron."""
+        return list(self.por_persona.get(normalizar_persona(nombre), {}).values())
+
+    def nuevo_id(self):
+        return asignar_id(self.documento)
+
+    def prestamo_de_libro(self, libro_id):
+        return self.prestamo_por_libro.get(libro_id)
+
+    # ------------------------------
+    # Mutaciones (documento e índices a la vez)
+    # ------------------------------
+    def _marcar(self, lista, registro_id, registro):
+        if self.cambios is not None:
+            self.cambios[(lista, registro_id)] = registro
+
+    def tomar_cambios(self):
+        """Registros modificados desde la última llamada (ver `cambios`); se vacían al tomarlos."""
+        cambios, self.cambios = self.cambios, {}
+        return cambios
+
+    def agregar_libro(self, libro):
+        self.documento["libros_disponibles"].append(libro)
+        self._indexar_libro(libro)
+        self._marcar("libros_disponibles", libro["id"], libro)
+
+    def quitar_libro(self, libro):
+        del self.libros[libro["id"]]
+        titulo = libro.get("titulo", "").lower()
+        mismos = [l for l in self.por_titulo.get(titulo, ()) if l is not libro]
+        if mismos:
+            self.por_titulo[titulo] = mismos
+        else:
+            self.por_titulo.pop(titulo, None)
+        self.pendientes.append(self.numeros.pop(libro["id"]))
+        self._marcar("libros_disponibles", libro["id"], None)
+
+    def sincronizar(self):
+        """Quita de `libros_disponibles` los libros eliminados desde la última escritura (llamar antes de guardar)."""
+        libros = self.documento["libros_disponibles"]
+        for numero in sorted(self.pendientes):
+            del libros[numero - bisect_left(self.quitados, numero)]
+            insort(self.quitados, numero)
+        self.pendientes.clear()
+
+    def agregar_prestamo(self, prestamo):
+        self.documento["prestamos_activos"].append(prestamo)
+        self._indexar_prestamo(prestamo)
+        self._marcar("prestamos_activos", prestamo.get("id"), prestamo)
+        libro = self.libros.get(prestamo.get("libro_id"))
+        if libro is not None:
+            libro["estado"] = "prestado"
+            libro["total_prestamos"] = libro.get("total_prestamos", 0) + 1
+            self._marcar("libros_disponibles", libro["id"], libro)
+        return libro
+
+    def _desindexar_prestamo(self, prestamo):
+        self.prestamos.pop(prestamo.get("id"), None)
+        if self.prestamo_por_libro.get(prestamo.get("libro_id")) is prestamo:
+            del self.prestamo_por_libro[prestamo.get("libro_id")]
+        clave_persona = normalizar_persona(prestamo.get("persona"))
+        de_persona = self.por_persona.get(clave_persona)
+        if de_persona is not None:
+            de_persona.pop(prestamo.get("id"), None)
+            if not de_persona:
+                del self.por_persona[clave_persona]
+        self._marcar("prestamos_activos", prestamo.get("id"), None)
+        libro = self.libros.get(prestamo.get("libro_id"))
+        if libro is not None:
+            libro["estado"] = "disponible"
+            self._marcar("libros_disponibles", libro["id"], libro)
+        return libro
+
+    def quitar_prestamo(self, prestamo):
+        """Saca el préstamo de los activos y marca el libro como disponible; retorna el libro."""
+        libro = self._desindexar_prestamo(prestamo)
+        activos = self.documento["prestamos_activos"]
+        # Se recorre sólo la lista de préstamos activos, no la biblioteca
+        for i, p in enumerate(activos):
+            if p is prestamo:
+                del activos[i]
+                break
+        return libro
+
+    def quitar_prestamos(self, prestamos):
+        """Como `quitar_prestamo` para varios préstamos, con una sola pasada por la lista; retorna los libros."""
+        libros = [self._desindexar_prestamo(p) for p in prestamos]
+        quitados = {id(p) for p in prestamos}
+        activos = self.documento["prestamos_activos"]
+        activos[:] = [p for p in activos if id(p) not in quitados]
+        return libros
@@ -0,0 +1,741 @@
+import copy
+import json
+import zlib
+import hashlib
+import logging
+import threading
+from decimal import Decimal
+from os.path import join
+
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer, Binary
+from ask_sdk_core.attributes_manager import AbstractPersistenceAdapter
+from ask_sdk_core.exceptions import PersistenceException
+from ask_sdk_s3.adapter import S3Adapter
+from ask_sdk_model import RequestEnvelope, Context, User
+from ask_sdk_model.interfaces.system import SystemState
+from botocore.exceptions import ClientError
+
+from config import (
+    PERSISTENCE_BACKEND, S3_PERSISTENCE_BUCKET, DDB_DATA_TABLE, DDB_ENDPOINT_URL,
+    EVENT_STORE, DDB_EVENTS_TABLE, EVENT_SNAPSHOT_EVERY, S3_ENDPOINT_URL, S3_HEDGE_ENABLED,
+    S3_KEY_LAYOUT, S3_KEY_SHARD_CHARS,
+)
+from clients import cliente, recurso, ClienteS3Cubierto
+from events import aplicar_evento
+from fechas import fecha_a_epoch, fecha_iso
+from tracing import instrumentar_metodos
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# DynamoDB single-table
+# ==============================
+# Una partición por usuario (pk = USER#<user_id>) con un item por registro:
+#   META              -> todo lo que no es lista (estadísticas, configuración, versión...)
+#   LIBRO#<id>        -> un libro
+#   PRESTAMO#<id>     -> un préstamo activo (lleva gsi1pk/gsi1sk: GSI disperso por vencimiento)
+#   HIST#<secuencia>  -> un préstamo ya devuelto
+SK_META = "META"
+PREFIJO_LIBRO = "LIBRO#"
+PREFIJO_PRESTAMO = "PRESTAMO#"
+PREFIJO_HISTORIAL = "HIST#"
+GSI_VENCIMIENTOS = "PrestamosPorVencimiento"
+
+_LISTAS = {
+    "libros_disponibles": PREFIJO_LIBRO,
+    "prestamos_activos": PREFIJO_PRESTAMO,
+    "historial_prestamos": PREFIJO_HISTORIAL,
+}
+_CAMPOS_CONTROL = ("pk", "sk", "orden", "huella", "gsi1pk", "gsi1sk")
+# Items que ya no se escriben (los índices de búsqueda y de duplicados viven en memoria); se borran al escribir
+_SK_OBSOLETOS = ("BUSQUEDA", "DUPLICADOS")
+
+# TransactWriteItems admite como máximo 100 operaciones
+MAX_OPERACIONES_TRANSACCION = 100
+
+
+def desde_dynamo(valor):
+    """Convierte los Decimal que devuelve DynamoDB a int/float."""
+    if isinstance(valor, Decimal):
+        return int(valor) if valor == valor.to_integral_value() else float(valor)
+    if isinstance(valor, Binary):
+        return bytes(valor.value)
+    if isinstance(valor, dict):
+        return {k: desde_dynamo(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [desde_dynamo(v) for v in valor]
+    return valor
+
+
+def _huella(item):
+    """Huella del contenido de un item (sin su propio atributo `huella`)."""
+    contenido = {k: v for k, v in item.items() if k != "huella"}
+    return hashlib.blake2b(json.dumps(contenido, sort_keys=True, default=str).encode("utf-8"),
+                           digest_size=12).digest()
+
+
+class DynamoDBSingleTableAdapter(AbstractPersistenceAdapter):
+    """
+    Persistencia principal en DynamoDB con un item por libro, préstamo y
+    registro de historial. `get_attributes` reconstruye el documento con un
+    Query paginado de la partición; `save_attributes` compara contra la
+    última versión leída o escrita y sólo escribe los items que cambiaron
+    (un préstamo son el libro, el préstamo nuevo y META en una transacción).
+    Cada item guarda su huella: si el documento no se leyó con este adapter
+    (caché de DynamoDB, calentamiento, otro contenedor) se leen sólo las
+    huellas y el orden de la partición, no todo se da por cambiado.
+    `save_changes` recibe además los registros que marcó LibraryIndex y sólo
+    calcula la huella de esos y de META.
+    """
+
+    def __init__(self, table_name=DDB_DATA_TABLE, dynamodb_client=None):
+        self.table_name = table_name
+        self.client = dynamodb_client or cliente("dynamodb", endpoint_url=DDB_ENDPOINT_URL)
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+        # user_id -> {sk: huella} de lo que hay en la tabla; evita reescribir items sin cambios
+        self._huellas = {}
+        # user_id -> {sk: orden}; el orden de un item no cambia al borrar otros
+        self._ordenes = {}
+        # user_id -> orden del próximo item nuevo
+        self._siguiente_orden = {}
+
+    @staticmethod
+    def _user_id(request_envelope):
+        return request_envelope.context.system.user.user_id
+
+    @staticmethod
+    def _pk(user_id):
+        return f"USER#{user_id}"
+
+    # ------------------------------
+    # Documento <-> items
+    # ------------------------------
+    def _a_items(self, user_id, attributes, cambios=None):
+        """
+        Descompone el documento en ({sk: item}, [sk a borrar]). Sin `cambios` van
+        todos los registros y no se sabe qué borrar (lo decide _operaciones). Con
+        `cambios` ({(lista, id): registro, o None si se quitó}, de LibraryIndex)
+        van sólo META, esos registros y el historial nuevo.
+        """
+        pk = self._pk(user_id)
+        meta = {k: v for k, v in attributes.items() if k not in _LISTAS}
+        items = {SK_META: {"pk": pk, "sk": SK_META, "data": meta}}
+        borrar = []
+        ordenes = self._ordenes[user_id]
+        siguiente = self._siguiente_orden[user_id]
+
+        def orden_de(sk):
+            nonlocal siguiente
+            orden = ordenes.get(sk)
+            if orden is None:
+                orden, siguiente = siguiente, siguiente + 1
+            return orden
+
+        def item_de(lista, registro, posicion):
+            sk = _LISTAS[lista] + str(registro.get("id") or f"sin-id-{posicion}")
+            item = dict(registro, pk=pk, sk=sk, orden=orden_de(sk))
+            if lista == "prestamos_activos" and registro.get("fecha_limite") is not None:
+                # Sólo los préstamos activos llevan estas claves: el índice es disperso
+                item["gsi1pk"] = f"VENCE#{fecha_iso(fecha_a_epoch(registro['fecha_limite']))}"
+                item["gsi1sk"] = pk
+            items[sk] = item
+
+        historial = attributes.get("historial_prestamos", [])
+        if cambios is None:
+            for lista in ("libros_disponibles", "prestamos_activos"):
+                for posicion, registro in enumerate(attributes.get(lista, [])):
+                    item_de(lista, registro, posicion)
+            nuevos_historial = range(len(historial))
+        else:
+            for (lista, registro_id), registro in cambios.items():
+                if registro is None:
+                    borrar.append(_LISTAS[lista] + str(registro_id))
+                else:
+                    item_de(lista, registro, None)
+            # El historial sólo crece: los registros nuevos son los del final que no están en la tabla
+            huellas = self._huellas[user_id]
+            primero = len(historial)
+            while primero and f"{PREFIJO_HISTORIAL}{primero - 1:08d}" not in huellas:
+                primero -= 1
+            nuevos_historial = range(primero, len(historial))
+            borrar.extend(_SK_OBSOLETOS)
+
+        for orden in nuevos_historial:
+            sk = f"{PREFIJO_HISTORIAL}{orden:08d}"
+            items[sk] = dict(historial[orden], pk=pk, sk=sk)
+        return items, borrar
+
+    @staticmethod
+    def _a_documento(items):
+        documento = {}
+        listas = {nombre: [] for nombre in _LISTAS}
+        for item in items:
+            sk = item["sk"]
+            if sk == SK_META:
+                documento.update(item.get("data", {}))
+                continue
+            for nombre, prefijo in _LISTAS.items():
+                if sk.startswith(prefijo):
+                    orden = item.get("orden", sk)
+                    registro = {k: v for k, v in item.items() if k not in _CAMPOS_CONTROL}
+                    listas[nombre].append((orden, registro))
+                    break
+        for nombre, registros in listas.items():
+            registros.sort(key=lambda par: par[0])
+            documento[nombre] = [registro for _, registro in registros]
+        return documento
+
+    # ------------------------------
+    # Lectura
+    # ------------------------------
+    def _query_particion(self, user_id, proyeccion=None):
+        parametros = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "pk = :pk",
+            "ExpressionAttributeValues": {":pk": {"S": self._pk(user_id)}},
+        }
+        if proyeccion:
+            parametros["ProjectionExpression"] = proyeccion
+        paginador = self.client.get_paginator("query")
+        for pagina in paginador.paginate(**parametros):
+            for item in pagina.get("Items", []):
+                yield desde_dynamo({k: self._deserializer.deserialize(v) for k, v in item.items()})
+
+    def get_attributes(self, request_envelope):
+        user_id = self._user_id(request_envelope)
+        try:
+            items = list(self._query_particion(user_id))
+        except Exception as e:
+            raise PersistenceException(f"Failed to get attributes from DynamoDB table {self.table_name}: {e}")
+        self._recordar(user_id, items)
+        return self._a_documento(items) if items else {}
+
+    def _recordar(self, user_id, items):
+        """Guarda huellas y orden de los items que hay en la tabla (completos o proyectados)."""
+        # Items escritos antes de guardar la huella: se calcula (completos) o queda None y se reescriben
+        self._huellas[user_id] = {
+            item["sk"]: item.get("huella") or (_huella(item) if "pk" in item else None) for item in items
+        }
+        ordenes = {item["sk"]: item["orden"] for item in items if "orden" in item}
+        self._ordenes[user_id] = ordenes
+        self._siguiente_orden[user_id] = max(ordenes.values(), default=-1) + 1
+
+    def _olvidar(self, user_id):
+        self._huellas.pop(user_id, None)
+        self._ordenes.pop(user_id, None)
+        self._siguiente_orden.pop(user_id, None)
+
+    def iterar_usuarios(self):
+        """user_id de todas las particiones (Scan de los items META; para trabajos offline)."""
+        paginador = self.client.get_paginator("scan")
+        for pagina in paginador.paginate(
+            TableName=self.table_name,
+            FilterExpression="sk = :meta",
+            ExpressionAttributeValues={":meta": {"S": SK_META}},
+            ProjectionExpression="pk",
+        ):
+            for item in pagina.get("Items", []):
+                yield item["pk"]["S"][len("USER#"):]
+
+    def consultar_vencimientos(self, fecha):
+        """Préstamos activos de todos los usuarios que vencen en `fecha` (YYYY-MM-DD), vía el GSI disperso."""
+        paginador = self.client.get_paginator("query")
+        for pagina in paginador.paginate(
+            TableName=self.table_name,
+            IndexName=GSI_VENCIMIENTOS,
+            KeyConditionExpression="gsi1pk = :v",
+            ExpressionAttributeValues={":v": {"S": f"VENCE#{fecha}"}},
+        ):
+            for item in pagina.get("Items", []):
+                yield desde_dynamo({k: self._deserializer.deserialize(v) for k, v in item.items()})
+
+    # ------------------------------
+    # Escritura
+    # ------------------------------
+    def _operaciones(self, user_id, attributes, cambios=None):
+        """(items a escribir, sk a borrar) contra las huellas de lo que hay en la tabla."""
+        if user_id not in self._huellas:
+            # Sin estado conocido (el documento vino de otra caché): se leen sólo huellas y orden
+            self._recordar(user_id, list(self._query_particion(user_id, proyeccion="sk, huella, orden")))
+        huellas = self._huellas[user_id]
+        items, borrar = self._a_items(user_id, attributes, cambios)
+        puts = []
+        for sk, item in items.items():
+            item["huella"] = _huella(item)
+            if huellas.get(sk) != item["huella"]:
+                puts.append(item)
+        if cambios is None:
+            deletes = [sk for sk in huellas if sk not in items]
+        else:
+            deletes = [sk for sk in borrar if sk in huellas and sk not in items]
+        return puts, deletes
+
+    def save_attributes(self, request_envelope, attributes):
+        self.save_changes(request_envelope, attributes, None)
+
+    def save_changes(self, request_envelope, attributes, cambios):
+        """
+        Como save_attributes, pero con los registros que cambiaron desde la
+        última escritura ({(lista, id): registro o None}, LibraryIndex.tomar_cambios):
+        sólo se comparan esos. Con `cambios` None se compara el documento entero.
+        """
+        user_id = self._user_id(request_envelope)
+        pk = self._pk(user_id)
+        puts, deletes = self._operaciones(user_id, attributes or {}, cambios)
+        if not puts and not deletes:
+            return
+
+        try:
+            if len(puts) + len(deletes) <= MAX_OPERACIONES_TRANSACCION:
+                operaciones = [
+                    {"Put": {"TableName": self.table_name,
+                             "Item": {k: self._serializer.serialize(v) for k, v in item.items()}}}
+                    for item in puts
+                ] + [
+                    {"Delete": {"TableName": self.table_name,
+                                "Key": {"pk": {"S": pk}, "sk": {"S": sk}}}}
+                    for sk in deletes
+                ]
+                self.client.transact_write_items(TransactItems=operaciones)
+            else:
+                # Migraciones o cambios masivos: por lotes, sin atomicidad
+                tabla = recurso("dynamodb", endpoint_url=DDB_ENDPOINT_URL).Table(self.table_name)
+                with tabla.batch_writer() as lote:
+                    for item in puts:
+                        lote.put_item(Item=item)
+                    for sk in deletes:
+                        lote.delete_item(Key={"pk": pk, "sk": sk})
+        except Exception as e:
+            self._olvidar(user_id)
+            raise PersistenceException(f"Failed to save attributes to DynamoDB table {self.table_name}: {e}")
+
+        huellas, ordenes = self._huellas[user_id], self._ordenes[user_id]
+        for item in puts:
+            huellas[item["sk"]] = item["huella"]
+            if "orden" in item:
+                ordenes[item["sk"]] = item["orden"]
+                self._siguiente_orden[user_id] = max(self._siguiente_orden[user_id], item["orden"] + 1)
+        for sk in deletes:
+            huellas.pop(sk, None)
+            ordenes.pop(sk, None)
+        logger.info(f"DynamoDB: {len(puts)} items escritos y {len(deletes)} borrados para {user_id}")
+
+    def delete_attributes(self, request_envelope):
+        user_id = self._user_id(request_envelope)
+        pk = self._pk(user_id)
+        tabla = recurso("dynamodb", endpoint_url=DDB_ENDPOINT_URL).Table(self.table_name)
+        with tabla.batch_writer() as lote:
+            for item in self._query_particion(user_id, proyeccion="sk"):
+                lote.delete_item(Key={"pk": pk, "sk": item["sk"]})
+        self._olvidar(user_id)
+
+    # ------------------------------
+    # Administración
+    # ------------------------------
+    def crear_tabla(self):
+        """Crea la tabla y el GSI disperso (útil contra DynamoDB Local)."""
+        self.client.create_table(
+            TableName=self.table_name,
+            BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[
+                {"AttributeName": "pk", "AttributeType": "S"},
+                {"AttributeName": "sk", "AttributeType": "S"},
+                {"AttributeName": "gsi1pk", "AttributeType": "S"},
+                {"AttributeName": "gsi1sk", "AttributeType": "S"},
+            ],
+            KeySchema=[
+                {"AttributeName": "pk", "KeyType": "HASH"},
+                {"AttributeName": "sk", "KeyType": "RANGE"},
+            ],
+            GlobalSecondaryIndexes=[{
+                "IndexName": GSI_VENCIMIENTOS,
+                "KeySchema": [
+                    {"AttributeName": "gsi1pk", "KeyType": "HASH"},
+                    {"AttributeName": "gsi1sk", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }],
+        )
+
+
+# ==============================
+# Log de eventos con snapshots
+# ==============================
+class ConflictoSecuencia(PersistenceException):
+    """Otro escritor ya usó la secuencia: el documento en memoria quedó viejo y no se debe reintentar tal cual."""
+
+
+def _es_conflicto(error):
+    """True si un ClientError de put_item/transact_write_items se debe a la condición de la secuencia."""
+    codigo = error.response.get("Error", {}).get("Code")
+    if codigo == "ConditionalCheckFailedException":
+        return True
+    motivos = error.response.get("CancellationReasons") or ()
+    return codigo == "TransactionCanceledException" and any(
+        motivo.get("Code") == "ConditionalCheckFailed" for motivo in motivos)
+
+
+class MemoryEventStore:
+    """Log de eventos en memoria del proceso, para pruebas."""
+
+    def __init__(self):
+        self._eventos = {}
+        self._snapshots = {}
+
+    def leer_snapshot(self, user_id):
+        seq, documento = self._snapshots.get(user_id, (0, None))
+        return seq, copy.deepcopy(documento)
+
+    def leer_eventos(self, user_id, desde_seq):
+        return [(seq, copy.deepcopy(ev)) for seq, ev in self._eventos.get(user_id, []) if seq > desde_seq]
+
+    def agregar(self, user_id, seq_inicial, eventos):
+        log = self._eventos.setdefault(user_id, [])
+        if log and log[-1][0] >= seq_inicial:
+            raise ConflictoSecuencia(f"Conflicto de secuencia para {user_id}")
+        log.extend((seq_inicial + i, copy.deepcopy(ev)) for i, ev in enumerate(eventos))
+
+    def guardar_snapshot(self, user_id, seq, documento):
+        self._snapshots[user_id] = (seq, copy.deepcopy(documento))
+
+    def iterar_usuarios(self):
+        return iter(set(self._eventos) | set(self._snapshots))
+
+
+class DynamoDBEventStore:
+    """
+    Eventos y snapshots en una tabla DynamoDB (pk = USER#<id>):
+      EV#<seq 12 dígitos>  -> un evento (Put condicional: dos escritores no comparten secuencia)
+      SNAPSHOT             -> documento comprimido con zlib y la secuencia que cubre
+    Los eventos no se borran al compactar: son la traza de auditoría.
+    """
+
+    def __init__(self, table_name=DDB_EVENTS_TABLE, dynamodb_client=None):
+        self.table_name = table_name
+        self.client = dynamodb_client or cliente("dynamodb", endpoint_url=DDB_ENDPOINT_URL)
+
+    @staticmethod
+    def _pk(user_id):
+        return {"S": f"USER#{user_id}"}
+
+    def leer_snapshot(self, user_id):
+        resp = self.client.get_item(
+            TableName=self.table_name, Key={"pk": self._pk(user_id), "sk": {"S": "SNAPSHOT"}}
+        )
+        item = resp.get("Item")
+        if not item:
+            return 0, None
+        documento = json.loads(zlib.decompress(item["doc"]["B"]).decode("utf-8"))
+        return int(item["seq"]["N"]), documento
+
+    def leer_eventos(self, user_id, desde_seq):
+        paginador = self.client.get_paginator("query")
+        for pagina in paginador.paginate(
+            TableName=self.table_name,
+            KeyConditionExpression="pk = :pk AND sk BETWEEN :desde AND :hasta",
+            ExpressionAttributeValues={
+                ":pk": self._pk(user_id),
+                ":desde": {"S": f"EV#{desde_seq + 1:012d}"},
+                ":hasta": {"S": "EV#999999999999"},
+            },
+        ):
+            for item in pagina.get("Items", []):
+                yield int(item["sk"]["S"][3:]), json.loads(item["evento"]["S"])
+
+    def agregar(self, user_id, seq_inicial, eventos):
+        operaciones = [{
+            "Put": {
+                "TableName": self.table_name,
+                "Item": {
+                    "pk": self._pk(user_id),
+                    "sk": {"S": f"EV#{seq_inicial + i:012d}"},
+                    "evento": {"S": json.dumps(evento, ensure_ascii=False, separators=(",", ":"))},
+                },
+                "ConditionExpression": "attribute_not_exists(sk)",
+            }
+        } for i, evento in enumerate(eventos)]
+        try:
+            if len(operaciones) == 1:
+                self.client.put_item(**operaciones[0]["Put"])
+            else:
+                self.client.transact_write_items(TransactItems=operaciones)
+        except ClientError as e:
+            if _es_conflicto(e):
+                raise ConflictoSecuencia(f"Conflicto de secuencia para {user_id}: {e}") from e
+            raise
+
+    def guardar_snapshot(self, user_id, seq, documento):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "pk": self._pk(user_id),
+                "sk": {"S": "SNAPSHOT"},
+                "seq": {"N": str(seq)},
+                "doc": {"B": zlib.compress(json.dumps(documento, separators=(",", ":")).encode("utf-8"))},
+            },
+        )
+
+    def iterar_usuarios(self):
+        # Todo usuario tiene su primer evento o un snapshot (si sólo hubo save_attributes)
+        vistos = set()
+        paginador = self.client.get_paginator("scan")
+        for pagina in paginador.paginate(
+            TableName=self.table_name,
+            FilterExpression="sk IN (:snapshot, :primero)",
+            ExpressionAttributeValues={":snapshot": {"S": "SNAPSHOT"}, ":primero": {"S": f"EV#{1:012d}"}},
+            ProjectionExpression="pk",
+        ):
+            for item in pagina.get("Items", []):
+                user_id = item["pk"]["S"][len("USER#"):]
+                if user_id not in vistos:
+                    vistos.add(user_id)
+                    yield user_id
+
+
+class EventLogAdapter(AbstractPersistenceAdapter):
+    """
+    Persistencia por eventos: cada mutación de BibliotecaService se guarda
+    como un evento pequeño (BookAdded, BookLent, BookReturned, BookDeleted)
+    y el documento se reconstruye desde el último snapshot más la cola de
+    eventos. Cada `snapshot_cada` eventos se escribe un snapshot nuevo.
+    `save_attributes` (cambios que no son eventos) escribe un snapshot.
+    """
+
+    def __init__(self, store=None, snapshot_cada=EVENT_SNAPSHOT_EVERY):
+        self.store = store or DynamoDBEventStore()
+        self.snapshot_cada = snapshot_cada
+        # user_id -> (última secuencia conocida, secuencia del snapshot)
+        self._secuencias = {}
+
+    @staticmethod
+    def _user_id(request_envelope):
+        return request_envelope.context.system.user.user_id
+
+    def _cargar(self, user_id):
+        seq_snapshot, documento = self.store.leer_snapshot(user_id)
+        documento = documento or {}
+        seq = seq_snapshot
+        for seq, evento in self.store.leer_eventos(user_id, seq_snapshot):
+            aplicar_evento(documento, evento)
+        self._secuencias[user_id] = (seq, seq_snapshot)
+        return documento
+
+    def get_attributes(self, request_envelope):
+        try:
+            return self._cargar(self._user_id(request_envelope))
+        except PersistenceException:
+            raise
+        except Exception as e:
+            raise PersistenceException(f"Failed to rebuild attributes from event log: {e}")
+
+    def append_events(self, request_envelope, eventos, documento):
+        """Agrega eventos al log; `documento` es el estado resultante (para compactar)."""
+        user_id = self._user_id(request_envelope)
+        if user_id not in self._secuencias:
+            self._cargar(user_id)
+        seq, seq_snapshot = self._secuencias[user_id]
+        try:
+            self.store.agregar(user_id, seq + 1, eventos)
+        except ConflictoSecuencia:
+            # Otro escritor avanzó la secuencia: la próxima lectura reconstruye desde el log
+            self._secuencias.pop(user_id, None)
+            raise
+        except Exception as e:
+            # No se sabe si llegó a escribirse: la próxima escritura relee la secuencia
+            self._secuencias.pop(user_id, None)
+            raise PersistenceException(f"Failed to append events: {e}")
+        seq += len(eventos)
+        if seq - seq_snapshot >= self.snapshot_cada:
+            self.store.guardar_snapshot(user_id, seq, documento)
+            seq_snapshot = seq
+            logger.info(f"EventLog: snapshot compactado en la secuencia {seq} para {user_id}")
+        self._secuencias[user_id] = (seq, seq_snapshot)
+
+    def save_attributes(self, request_envelope, attributes):
+        user_id = self._user_id(request_envelope)
+        if user_id not in self._secuencias:
+            self._cargar(user_id)
+        seq, _ = self._secuencias[user_id]
+        self.store.guardar_snapshot(user_id, seq, attributes or {})
+        self._secuencias[user_id] = (seq, seq)
+
+    def delete_attributes(self, request_envelope):
+        user_id = self._user_id(request_envelope)
+        seq, _ = self._secuencias.get(user_id, (0, 0))
+        self.store.guardar_snapshot(user_id, seq, {})
+        self._secuencias[user_id] = (seq, seq)
+
+    def iterar_eventos(self, user_id, desde_seq=0):
+        """Traza completa de eventos (auditoría, analítica)."""
+        return self.store.leer_eventos(user_id, desde_seq)
+
+    def iterar_usuarios(self):
+        return self.store.iterar_usuarios()
+
+
+# ==============================
+# S3
+# ==============================
+# S3 reparte la carga por prefijo de clave, y todos los user_id de Alexa
+# empiezan igual ("amzn1.ask.account."): con la clave de S3Adapter (el user_id
+# tal cual) todo el tráfico cae en una sola partición. Con S3_KEY_LAYOUT=hashed
+# la clave lleva delante S3_KEY_SHARD_CHARS caracteres hex del sha256 del
+# user_id, <path_prefix>/<3f>/<user_id>, y las peticiones se reparten entre
+# 16^S3_KEY_SHARD_CHARS prefijos.
+# Migración perezosa: si la clave nueva no existe se lee la antigua
+# (<path_prefix>/<user_id>); la primera escritura guarda en la nueva y borra
+# la antigua. Quien nunca vuelve a escribir se queda con la antigua.
+def particion_s3(user_id):
+    return hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:S3_KEY_SHARD_CHARS]
+
+
+def clave_particionada(request_envelope):
+    """object_keygen de S3Adapter: <partición>/<user_id>."""
+    user_id = request_envelope.context.system.user.user_id
+    return f"{particion_s3(user_id)}/{user_id}"
+
+
+class HedgedS3Adapter(S3Adapter):
+    """
+    S3Adapter sobre el cliente compartido de clients.py (timeouts, reintentos
+    adaptativos, conexiones persistentes). Con `cubrir` los GET lentos se
+    duplican pasado el p95 (ClienteS3Cubierto). Con `particionar` las claves
+    llevan el prefijo de partición y los documentos con la clave antigua se
+    migran al escribirlos.
+    """
+
+    def __init__(self, bucket_name, path_prefix=None, s3_client=None, cubrir=S3_HEDGE_ENABLED,
+                 particionar=S3_KEY_LAYOUT == "hashed"):
+        s3_client = s3_client or cliente("s3", endpoint_url=S3_ENDPOINT_URL)
+        if cubrir:
+            s3_client = ClienteS3Cubierto(s3_client)
+        super().__init__(bucket_name=bucket_name, path_prefix=path_prefix, s3_client=s3_client,
+                         **({"object_keygen": clave_particionada} if particionar else {}))
+        self.particionar = particionar
+        # Usuarios leídos de la clave antigua en este contenedor: su próxima escritura la borra
+        self._antiguas = set()
+        self._lock = threading.Lock()
+        # Lecturas que tuvieron que ir a la clave antigua (para métricas y pruebas)
+        self.lecturas_antiguas = 0
+
+    def _clave_antigua(self, user_id):
+        return join(self.path_prefix, user_id)
+
+    def _leer(self, clave):
+        """Documento guardado en `clave`; None si no existe."""
+        try:
+            obj = self.s3_client.get_object(Bucket=self.bucket_name, Key=clave)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return None
+            raise PersistenceException(f"No se pudo leer {clave} de {self.bucket_name}: {e}") from e
+        try:
+            cuerpo = obj.get(self.S3_OBJECT_BODY_NAME)
+            return json.loads(cuerpo.read()) if cuerpo else {}
+        except Exception as e:
+            raise PersistenceException(f"Documento ilegible en {clave}: {type(e).__name__}: {e}") from e
+
+    def get_attributes(self, request_envelope):
+        if not self.particionar:
+            return super().get_attributes(request_envelope)
+        user_id = request_envelope.context.system.user.user_id
+        attributes = self._leer(join(self.path_prefix, clave_particionada(request_envelope)))
+        if attributes is None:
+            attributes = self._leer(self._clave_antigua(user_id))
+            if attributes is not None:
+                with self._lock:
+                    self._antiguas.add(user_id)
+                    self.lecturas_antiguas += 1
+        return attributes or {}
+
+    def _borrar_antigua(self, user_id):
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=self._clave_antigua(user_id))
+        except Exception as e:
+            # Se vuelve a intentar en la próxima escritura; mientras, la clave nueva es la que se lee
+            logger.warning(f"Clave antigua de {user_id} sin borrar: {e}")
+            return False
+        with self._lock:
+            self._antiguas.discard(user_id)
+        return True
+
+    def save_attributes(self, request_envelope, attributes):
+        super().save_attributes(request_envelope, attributes)
+        if self.particionar:
+            user_id = request_envelope.context.system.user.user_id
+            if user_id in self._antiguas and self._borrar_antigua(user_id):
+                logger.info(f"🔀 Documento de {user_id} migrado a la clave particionada")
+
+    def delete_attributes(self, request_envelope):
+        super().delete_attributes(request_envelope)
+        if self.particionar:
+            self._borrar_antigua(request_envelope.context.system.user.user_id)
+
+
+# ==============================
+# Recorrido de usuarios (trabajos offline)
+# ==============================
+def envelope_de_usuario(user_id):
+    """RequestEnvelope mínimo para usar los adapters fuera de una petición de Alexa."""
+    return RequestEnvelope(context=Context(system=SystemState(user=User(user_id=user_id))))
+
+
+def iterar_usuarios(adapter):
+    """user_id de todos los documentos guardados por `adapter`, sin cargarlos."""
+    if hasattr(adapter, "iterar_usuarios"):
+        return adapter.iterar_usuarios()
+    if isinstance(adapter, S3Adapter):
+        return _iterar_objetos_s3(adapter)
+    raise RuntimeError(f"El adapter {type(adapter).__name__} no permite recorrer usuarios")
+
+
+def _iterar_objetos_s3(adapter):
+    # Un objeto por usuario en <path_prefix>/<user_id> o <path_prefix>/<partición>/<user_id>;
+    # un usuario a medio migrar puede tener los dos
+    prefijo = adapter.path_prefix.rstrip("/") + "/" if adapter.path_prefix else ""
+    paginador = adapter.s3_client.get_paginator("list_objects_v2")
+    vistos = set()
+    for pagina in paginador.paginate(Bucket=adapter.bucket_name, Prefix=prefijo):
+        for objeto in pagina.get("Contents", []):
+            user_id = objeto["Key"][len(prefijo):]
+            particion, _, resto = user_id.partition("/")
+            if resto and particion == particion_s3(resto):
+                user_id = resto
+            if user_id not in vistos:
+                vistos.add(user_id)
+                yield user_id
+
+
+# ==============================
+# Selección del backend
+# ==============================
+_ADAPTER = None
+
+def get_persistence_adapter():
+    """Adapter de persistencia según PERSISTENCE_BACKEND (s3, dynamodb, eventlog o fake); se crea una vez."""
+    global _ADAPTER
+    if _ADAPTER is not None:
+        return _ADAPTER
+
+    if PERSISTENCE_BACKEND == "fake":
+        from database import FakeS3Adapter
+        _ADAPTER = FakeS3Adapter()
+    elif PERSISTENCE_BACKEND == "dynamodb":
+        logger.info(f"🗄️ Usando DynamoDBSingleTableAdapter con tabla: {DDB_DATA_TABLE}")
+        _ADAPTER = DynamoDBSingleTableAdapter()
+    elif PERSISTENCE_BACKEND == "eventlog":
+        store = MemoryEventStore() if EVENT_STORE == "memoria" else DynamoDBEventStore()
+        logger.info(f"📜 Usando EventLogAdapter ({EVENT_STORE})")
+        _ADAPTER = EventLogAdapter(store=store)
+    elif PERSISTENCE_BACKEND == "s3":
+        if not S3_PERSISTENCE_BUCKET:
+            raise RuntimeError("S3_PERSISTENCE_BUCKET es requerido cuando PERSISTENCE_BACKEND=s3")
+        logger.info(f"🪣 Usando S3Adapter con bucket: {S3_PERSISTENCE_BUCKET}, claves {S3_KEY_LAYOUT}"
+                    f"{' (GET cubiertos)' if S3_HEDGE_ENABLED else ''}")
+        _ADAPTER = HedgedS3Adapter(bucket_name=S3_PERSISTENCE_BUCKET)
+    else:
+        raise RuntimeError(f"PERSISTENCE_BACKEND desconocido: {PERSISTENCE_BACKEND}")
+    instrumentar_metodos(_ADAPTER, ("get_attributes", "save_attributes", "save_changes", "delete_attributes",
+                                    "append_events"))
+    return _ADAPTER
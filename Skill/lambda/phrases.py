@@ -1,4 +1,87 @@
 import random
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from config import RENDER_CACHE_SIZE
+
+# Alexa rechaza respuestas con más de 8000 caracteres en outputSpeech
+MAX_CARACTERES_VOZ = 8000
+
+# ==============================
+# Plantillas (se compilan una vez al importar)
+# ==============================
+_T_TITULO = "'{}'".format
+_T_LISTA_CORTA = "Tienes {total} libros{filtro}: {titulos}. ".format
+_T_LISTA_INTRO = "Tienes {total} libros{filtro}. Te los voy a mostrar de {por_pagina} en {por_pagina}. ".format
+_T_LISTA_PAGINA = "Libros del {desde} al {hasta}: {titulos}. ".format
+_T_LISTA_QUEDAN = "Quedan {quedan} libros más. Di 'siguiente' para continuar o 'salir' para terminar.".format
+_T_LISTA_FIN = "Esos son todos tus libros{filtro}. ".format
+_T_PRESTAMOS_UNO = "Déjame ver... Solo tienes un libro prestado: {detalles}. ".format
+_T_PRESTAMOS_VARIOS = "Déjame revisar... Tienes {total} libros prestados. Estos son los primeros: {detalles}. ".format
+_T_PRESTAMOS_MAS = "Y {resto} más. ".format
+_T_ESTADO_FRECUENTE = "Veo que tienes {total} libros en tu biblioteca{prestamos}".format
+_T_ESTADO_PRESTAMOS = " y {prestamos} préstamos activos.".format
+_T_ESTADO_COLECCION = "Tienes {total} libros en tu colección. ¿Qué quieres hacer?".format
+
+
+def unir_limitado(partes, separador, limite=MAX_CARACTERES_VOZ):
+    """
+    Une las partes que caben en `limite` caracteres. La longitud se acumula
+    mientras se recorre, así que la cadena final se construye una sola vez.
+    """
+    total = 0
+    cuantas = 0
+    largo_sep = len(separador)
+    for parte in partes:
+        extra = len(parte) + (largo_sep if cuantas else 0)
+        if total + extra > limite:
+            break
+        total += extra
+        cuantas += 1
+    return separador.join(partes[:cuantas])
+
+
+def unir_titulos(titulos):
+    """["A", "B", "C"] -> "'A', 'B' y 'C'"."""
+    citados = [f"'{t}'" for t in titulos]
+    if len(citados) < 2:
+        return "".join(citados)
+    return f"{unir_limitado(citados[:-1], ', ')} y {citados[-1]}"
+
+
+class RenderCache:
+    """Fragmentos de voz ya renderizados, con desalojo LRU (el prefetch la llena desde otro hilo)."""
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            fragmento = self._items.get(clave)
+            if fragmento is not None:
+                self._items.move_to_end(clave)
+            return fragmento
+
+    def put(self, clave, fragmento):
+        with self._lock:
+            self._items[clave] = fragmento
+            self._items.move_to_end(clave)
+            if len(self._items) > self.capacidad:
+                self._items.popitem(last=False)
+
+    def obtener_o_renderizar(self, clave, renderizar):
+        fragmento = self.get(clave)
+        if fragmento is None:
+            fragmento = renderizar()
+            self.put(clave, fragmento)
+        return fragmento
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
 
 class PhrasesManager:
     # ==============================
@@ -70,21 +153,66 @@ class PhrasesManager:
         confirmacion = cls.get_random_phrase(cls.CONFIRMACIONES)
         return confirmacion
 
+    # Fragmentos memoizados por (usuario, versión del documento, tipo, página, filtro)
+    render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _render_estado_bienvenida(total_libros, prestamos_activos, usuario_frecuente):
+        if usuario_frecuente and total_libros > 0:
+            prestamos = _T_ESTADO_PRESTAMOS(prestamos=prestamos_activos) if prestamos_activos > 0 else "."
+            return _T_ESTADO_FRECUENTE(total=total_libros, prestamos=prestamos)
+        if total_libros == 0:
+            return "Veo que es tu primera vez aquí. ¡Empecemos a construir tu colección!"
+        return _T_ESTADO_COLECCION(total=total_libros)
+
+    @classmethod
+    def render_pagina_libros(cls, paginacion, pagina_actual, por_pagina):
+        """
+        Renderiza una página del listado. Retorna el texto (sin la frase final
+        aleatoria) y si quedan más páginas.
+        """
+        titulo_filtro = paginacion["titulo_filtro"]
+        total = paginacion["total_filtrados"]
+        titulos = unir_limitado([_T_TITULO(l.get("titulo", "Sin título")) for l in paginacion["libros_pagina"]], ", ")
+
+        if total <= por_pagina:
+            return {"texto": _T_LISTA_CORTA(total=total, filtro=titulo_filtro, titulos=titulos), "quedan_mas": False}
+
+        partes = []
+        if pagina_actual == 0:
+            partes.append(_T_LISTA_INTRO(total=total, filtro=titulo_filtro, por_pagina=por_pagina))
+        partes.append(_T_LISTA_PAGINA(desde=paginacion["inicio"] + 1, hasta=paginacion["fin"], titulos=titulos))
+        if paginacion["quedan_mas"]:
+            partes.append(_T_LISTA_QUEDAN(quedan=total - paginacion["fin"]))
+        else:
+            partes.append(_T_LISTA_FIN(filtro=titulo_filtro))
+        return {"texto": "".join(partes), "quedan_mas": paginacion["quedan_mas"]}
+
+    @classmethod
+    def render_resumen_prestamos(cls, resumen, max_detalles=5):
+        """Renderiza el detalle de préstamos activos de `obtener_resumen_prestamos`."""
+        total = resumen["total"]
+        detalles = unir_limitado(resumen["detalles"][:max_detalles], "; ")
+        if total == 1:
+            texto = _T_PRESTAMOS_UNO(detalles=detalles)
+        else:
+            texto = _T_PRESTAMOS_VARIOS(total=total, detalles=detalles)
+        if total > max_detalles:
+            texto += _T_PRESTAMOS_MAS(resto=total - max_detalles)
+        if resumen["hay_vencidos"]:
+            texto += "¡ALERTA! Tienes libros vencidos. Te sugiero pedir la devolución. "
+        elif resumen["hay_proximos"]:
+            texto += "Algunos están por vencer, ¡no lo olvides! "
+        return texto
+
     @classmethod
     def get_welcome_message(cls, user_data, total_libros, prestamos_activos, usuario_frecuente):
         if usuario_frecuente and total_libros > 0:
             saludo = "¡Hola de nuevo! ¡Qué bueno verte por aquí!"
-            estado = f"Veo que tienes {total_libros} libros en tu biblioteca"
-            if prestamos_activos > 0:
-                estado += f" y {prestamos_activos} préstamos activos."
-            else:
-                estado += "."
         else:
             saludo = cls.get_saludo() 
-            if total_libros == 0:
-                estado = "Veo que es tu primera vez aquí. ¡Empecemos a construir tu colección!"
-            else:
-                estado = f"Tienes {total_libros} libros en tu colección. ¿Qué quieres hacer?"
+        estado = cls._render_estado_bienvenida(total_libros, prestamos_activos, usuario_frecuente)
                 
         opciones = cls.get_opciones_menu()
         pregunta = cls.get_preguntas_que_hacer()   
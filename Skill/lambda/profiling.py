@@ -0,0 +1,135 @@
+import cProfile
+import gzip
+import hashlib
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import re
+import time
+import tracemalloc
+from functools import wraps
+
+from config import (
+    PROFILE_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_USERS, PROFILE_S3_BUCKET, PROFILE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Perfilado por petición
+# ==============================
+# Envuelve el lambda_handler completo (handlers, interceptores y persistencia).
+# Una invocación se perfila si PROFILE_ENABLED, si su usuario está en
+# PROFILE_USERS o por sorteo con PROFILE_SAMPLE_RATE; el resto sólo paga el sorteo.
+# Cada perfil deja dos archivos comprimidos bajo <intent>/<request_id>:
+#   .prof.gz -> estadísticas de cProfile con el grafo de llamadas (gunzip + pstats/snakeviz)
+#   .json.gz -> resumen: tiempos, funciones más costosas y asignaciones de tracemalloc
+
+FUNCIONES_EN_RESUMEN = 30
+ASIGNACIONES_EN_RESUMEN = 15
+# Frames por asignación: más profundidad encarece mucho tracemalloc
+FRAMES_TRACEMALLOC = 5
+
+_NO_SEGURO = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def _datos_peticion(event):
+    """(user_id, request_id, intent o tipo de petición) del evento crudo de Alexa."""
+    request = event.get("request") or {}
+    system = (event.get("context") or {}).get("System") or {}
+    user_id = (system.get("user") or {}).get("userId") or ((event.get("session") or {}).get("user") or {}).get("userId")
+    nombre = (request.get("intent") or {}).get("name") or request.get("type") or "desconocido"
+    return user_id, request.get("requestId") or f"sin-id-{int(time.time() * 1000)}", nombre
+
+
+def debe_perfilar(user_id):
+    if PROFILE_ENABLED or (user_id and user_id in PROFILE_USERS):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _resumen_funciones(perfil):
+    salida = io.StringIO()
+    pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(FUNCIONES_EN_RESUMEN)
+    return salida.getvalue()
+
+
+def _resumen_asignaciones(snapshot):
+    return [
+        {
+            "kb": round(estadistica.size / 1024, 1),
+            "bloques": estadistica.count,
+            "traza": [f"{frame.filename}:{frame.lineno}" for frame in estadistica.traceback],
+        }
+        for estadistica in snapshot.statistics("traceback")[:ASIGNACIONES_EN_RESUMEN]
+    ]
+
+
+def _guardar(clave, contenido):
+    comprimido = gzip.compress(contenido)
+    if PROFILE_S3_BUCKET:
+        from clients import cliente
+        cliente("s3").put_object(Bucket=PROFILE_S3_BUCKET, Key=f"perfiles/{clave}", Body=comprimido)
+        return f"s3://{PROFILE_S3_BUCKET}/perfiles/{clave}"
+    ruta = os.path.join(PROFILE_DIR, clave)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, "wb") as archivo:
+        archivo.write(comprimido)
+    return ruta
+
+
+def _guardar_reporte(perfil, snapshot, user_id, request_id, nombre, duracion_ms, pico_kb):
+    base = f"{_NO_SEGURO.sub('_', nombre)}/{_NO_SEGURO.sub('_', request_id)}"
+    resumen = {
+        "request_id": request_id,
+        "intent": nombre,
+        # El user_id de Alexa es un dato personal: sólo se guarda su huella
+        "usuario": hashlib.sha256((user_id or "").encode("utf-8")).hexdigest()[:16],
+        "duracion_ms": round(duracion_ms, 2),
+        "memoria_pico_kb": pico_kb,
+        "funciones": _resumen_funciones(perfil),
+        "asignaciones": _resumen_asignaciones(snapshot) if snapshot else [],
+    }
+    _guardar(f"{base}.prof.gz", marshal.dumps(pstats.Stats(perfil).stats))
+    destino = _guardar(f"{base}.json.gz", json.dumps(resumen, ensure_ascii=False).encode("utf-8"))
+    logger.info(f"🔬 Perfil de {nombre} ({duracion_ms:.1f} ms) guardado en {destino}")
+
+
+def perfilar(lambda_handler):
+    """Envuelve el handler de Lambda con el perfilado por petición."""
+    @wraps(lambda_handler)
+    def handler(event, context):
+        user_id, request_id, nombre = _datos_peticion(event or {})
+        if not debe_perfilar(user_id):
+            return lambda_handler(event, context)
+
+        # Si otro código ya usa tracemalloc no se le apaga al terminar
+        propio = not tracemalloc.is_tracing()
+        if propio:
+            tracemalloc.start(FRAMES_TRACEMALLOC)
+        tracemalloc.reset_peak()
+        perfil = cProfile.Profile()
+        inicio = time.perf_counter()
+        perfil.enable()
+        try:
+            return lambda_handler(event, context)
+        finally:
+            perfil.disable()
+            duracion_ms = (time.perf_counter() - inicio) * 1000
+            _, pico = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ))
+            if propio:
+                tracemalloc.stop()
+            try:
+                _guardar_reporte(perfil, snapshot, user_id, request_id, nombre, duracion_ms, pico // 1024)
+            except Exception as e:
+                # El perfilado nunca debe afectar la respuesta
+                logger.warning(f"Perfil no guardado: {e}")
+    return handler
@@ -0,0 +1,148 @@
+import heapq
+from bisect import bisect_left
+from models import ESTADO_DISPONIBLE, ESTADO_PRESTADO
+
+ORDEN_TITULO = "titulo"
+ORDEN_FECHA = "fecha"
+ORDEN_PRESTAMOS = "prestamos"
+
+class LibraryQuery:
+    """
+    Motor de consultas sobre una LibraryTable.
+
+    Cada predicado se resuelve con una lista de posiciones precalculada por
+    valor (equivalente a una máscara); se parte del más selectivo y el resto
+    se comprueba directamente sobre las columnas de los candidatos. El orden
+    usa permutaciones (argsort) calculadas una sola vez por tabla, así que
+    ordenar un resultado es ordenar enteros por su rango, y el top-k no
+    ordena todo el resultado.
+    Todo lo derivado se guarda en `tabla.cache` y se invalida con la tabla.
+    Sólo se recorren las filas vivas (`tabla.vivas()`): las lápidas de los
+    libros eliminados nunca aparecen en un resultado.
+    """
+
+    def __init__(self, tabla):
+        self.tabla = tabla
+
+    # ------------------------------
+    # Índices derivados (cacheados)
+    # ------------------------------
+    def _indice_por_valor(self, nombre, columna):
+        """{valor en minúsculas: [posiciones]} para una columna de texto."""
+        clave = "valores_" + nombre
+        indice = self.tabla.cache.get(clave)
+        if indice is None:
+            indice = {}
+            for i in self.tabla.vivas():
+                indice.setdefault(columna[i].lower(), []).append(i)
+            self.tabla.cache[clave] = indice
+        return indice
+
+    def _indice_por_estado(self):
+        indice = self.tabla.cache.get("valores_estado")
+        if indice is None:
+            indice = {ESTADO_DISPONIBLE: [], ESTADO_PRESTADO: []}
+            estados = self.tabla.estados
+            for i in self.tabla.vivas():
+                indice.setdefault(estados[i], []).append(i)
+            self.tabla.cache["valores_estado"] = indice
+        return indice
+
+    def _permutacion(self, orden):
+        """Posiciones ordenadas por `orden` y el rango de cada posición."""
+        clave = "orden_" + orden
+        resultado = self.tabla.cache.get(clave)
+        if resultado is None:
+            if orden == ORDEN_TITULO:
+                claves = [t.casefold() for t in self.tabla.titulos]
+            elif orden == ORDEN_FECHA:
+                claves = self.tabla.fechas
+            elif orden == ORDEN_PRESTAMOS:
+                claves = self.tabla.total_prestamos
+            else:
+                raise ValueError(f"Orden desconocido: {orden}")
+            permutacion = sorted(self.tabla.vivas(), key=claves.__getitem__)
+            # Indexado por fila (también las lápidas, que no tienen rango)
+            rangos = [0] * len(self.tabla.ids)
+            for posicion, i in enumerate(permutacion):
+                rangos[i] = posicion
+            resultado = (permutacion, rangos)
+            self.tabla.cache[clave] = resultado
+        return resultado
+
+    def _inicio_desde(self, epoch):
+        """Posición en la permutación por fecha del primer libro agregado en `epoch` o después."""
+        permutacion, _ = self._permutacion(ORDEN_FECHA)
+        fechas = self.tabla.cache.get("fechas_ordenadas")
+        if fechas is None:
+            fechas = [self.tabla.fechas[i] for i in permutacion]
+            self.tabla.cache["fechas_ordenadas"] = fechas
+        return bisect_left(fechas, epoch)
+
+    # ------------------------------
+    # Ejecución
+    # ------------------------------
+    def filtrar(self, autor=None, tipo=None, estado=None, agregado_desde=None):
+        """Devuelve las posiciones que cumplen todos los predicados, o None si no hay filtros."""
+        tabla = self.tabla
+        # (posiciones que cumplen, comprobación por posición) de cada predicado
+        predicados = []
+        if autor:
+            autor_lower = autor.lower()
+            predicados.append((self._indice_por_valor("autor", tabla.autores).get(autor_lower, []),
+                               lambda i: tabla.autores[i].lower() == autor_lower))
+        if tipo:
+            tipo_lower = tipo.lower()
+            predicados.append((self._indice_por_valor("tipo", tabla.tipos).get(tipo_lower, []),
+                               lambda i: tabla.tipos[i].lower() == tipo_lower))
+        if estado is not None:
+            predicados.append((self._indice_por_estado().get(estado, []),
+                               lambda i: tabla.estados[i] == estado))
+        if agregado_desde:
+            # Rango contiguo de la permutación por fecha: sólo se copia si resulta el más selectivo
+            inicio = self._inicio_desde(agregado_desde)
+            permutacion, _ = self._permutacion(ORDEN_FECHA)
+            predicados.append((range(inicio, len(permutacion)),
+                               lambda i: tabla.fechas[i] >= agregado_desde))
+
+        if not predicados:
+            return None
+        # Se parte del predicado más selectivo y el resto se comprueba sobre las columnas
+        predicados.sort(key=lambda p: len(p[0]))
+        candidatos = predicados[0][0]
+        if isinstance(candidatos, range):
+            candidatos = permutacion[candidatos.start:]
+        for _, cumple in predicados[1:]:
+            candidatos = [i for i in candidatos if cumple(i)]
+        return candidatos
+
+    def ejecutar(self, autor=None, tipo=None, estado=None, agregado_desde=None,
+                 orden=None, descendente=False, limite=None):
+        """
+        Filtra, ordena y recorta. Retorna la secuencia de posiciones del resultado;
+        sin `orden` se conserva el orden en que se agregaron los libros.
+        """
+        candidatos = self.filtrar(autor, tipo, estado, agregado_desde)
+
+        if candidatos is None:
+            if orden:
+                permutacion, _ = self._permutacion(orden)
+                ordenados = permutacion[::-1] if descendente else permutacion
+            else:
+                ordenados = self.tabla.vivas()
+                if descendente:
+                    ordenados = ordenados[::-1]
+            # Sin filtros ni orden bastan las filas vivas (un rango si no hay lápidas): no se copia nada
+            return ordenados[:limite] if limite else ordenados
+
+        if orden:
+            _, rangos = self._permutacion(orden)
+            clave = rangos.__getitem__
+        else:
+            clave = None
+
+        if limite:
+            if descendente:
+                return heapq.nlargest(limite, candidatos, key=clave)
+            return heapq.nsmallest(limite, candidatos, key=clave)
+        return sorted(candidatos, key=clave, reverse=descendente)
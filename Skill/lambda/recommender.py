@@ -0,0 +1,252 @@
+import heapq
+import logging
+import math
+import sys
+
+from config import (
+    PERSISTENCE_BACKEND, DDB_ENDPOINT_URL,
+    RECOMMENDATIONS_TABLE, RECOMMENDATIONS_TOP_N,
+)
+from fechas import ahora, en_dias
+import batch
+from clients import recurso
+from search import terminos
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Recomendaciones de lectura
+# ==============================
+# Trabajo offline: recorre todos los documentos, arma matrices dispersas de
+# co-ocurrencia (géneros y autores que aparecen juntos en una misma biblioteca)
+# y de frecuencia de préstamo, y guarda para cada usuario una lista corta de
+# ids de sus propios libros. "¿Qué leo ahora?" sólo lee esa lista.
+#
+#   python recommender.py [procesos]
+
+# Valores por defecto de Libro: no dicen nada del gusto del usuario
+_SIN_DATO = frozenset(("desconocid", "sin categori"))
+
+# Por usuario sólo se cruzan sus géneros/autores más pesados (los pares crecen al cuadrado)
+MAX_CLAVES_POR_USUARIO = 30
+# Las listas se recalculan a diario; una lista vieja se descarta sola
+DIAS_VIGENCIA = 7
+
+PREFIJO_RECOMENDACIONES = "RECOMENDACIONES#"
+
+
+def _clave(valor):
+    """'Realismo Mágico' -> 'realism magic'; None si el valor no aporta."""
+    clave = " ".join(terminos(valor))
+    if not clave or clave in _SIN_DATO:
+        return None
+    return clave
+
+
+def _pesos(documento, campo):
+    """{clave: peso} de un campo en la biblioteca: cada libro cuenta 1 más sus préstamos."""
+    pesos = {}
+    for libro in documento.get("libros_disponibles", []):
+        clave = _clave(libro.get(campo))
+        if clave:
+            pesos[clave] = pesos.get(clave, 0) + 1 + (libro.get("total_prestamos") or 0)
+    return pesos
+
+
+class MatrizDispersa:
+    """Conteos {fila: {columna: n}}; sólo existen las celdas distintas de cero."""
+    __slots__ = ("filas",)
+
+    def __init__(self):
+        self.filas = {}
+
+    def sumar(self, fila, columna, valor=1):
+        celdas = self.filas.setdefault(fila, {})
+        celdas[columna] = celdas.get(columna, 0) + valor
+
+    def fila(self, fila):
+        return self.filas.get(fila, {})
+
+    def fusionar(self, otra):
+        for fila, celdas in otra.filas.items():
+            propias = self.filas.setdefault(fila, {})
+            for columna, valor in celdas.items():
+                propias[columna] = propias.get(columna, 0) + valor
+
+
+class MatricesRecomendacion:
+    """
+    Estadísticas globales para recomendar, acumuladas usuario a usuario:
+      usuarios_*   -> en cuántas bibliotecas aparece cada género/autor
+      co_*         -> en cuántas bibliotecas aparecen juntos dos géneros/autores
+      prestamos_*  -> préstamos totales de cada género/autor
+    Las vistas de varios procesos se combinan con `fusionar`.
+    """
+    __slots__ = ("usuarios_tipo", "usuarios_autor", "co_tipos", "co_autores",
+                 "prestamos_tipo", "prestamos_autor")
+
+    def __init__(self):
+        self.usuarios_tipo = {}
+        self.usuarios_autor = {}
+        self.co_tipos = MatrizDispersa()
+        self.co_autores = MatrizDispersa()
+        self.prestamos_tipo = {}
+        self.prestamos_autor = {}
+
+    # ------------------------------
+    # Acumulación
+    # ------------------------------
+    @staticmethod
+    def _acumular(pesos, usuarios, co, prestamos, documento, campo):
+        principales = heapq.nlargest(MAX_CLAVES_POR_USUARIO, pesos, key=pesos.get)
+        for clave in principales:
+            usuarios[clave] = usuarios.get(clave, 0) + 1
+            for otra in principales:
+                if otra != clave:
+                    co.sumar(clave, otra)
+        for libro in documento.get("libros_disponibles", []):
+            veces = libro.get("total_prestamos") or 0
+            clave = _clave(libro.get(campo)) if veces else None
+            if clave:
+                prestamos[clave] = prestamos.get(clave, 0) + veces
+
+    def agregar_documento(self, documento):
+        self._acumular(_pesos(documento, "tipo"), self.usuarios_tipo, self.co_tipos,
+                       self.prestamos_tipo, documento, "tipo")
+        self._acumular(_pesos(documento, "autor"), self.usuarios_autor, self.co_autores,
+                       self.prestamos_autor, documento, "autor")
+
+    def fusionar(self, otra):
+        for propio, ajeno in (
+            (self.usuarios_tipo, otra.usuarios_tipo), (self.usuarios_autor, otra.usuarios_autor),
+            (self.prestamos_tipo, otra.prestamos_tipo), (self.prestamos_autor, otra.prestamos_autor),
+        ):
+            for clave, valor in ajeno.items():
+                propio[clave] = propio.get(clave, 0) + valor
+        self.co_tipos.fusionar(otra.co_tipos)
+        self.co_autores.fusionar(otra.co_autores)
+
+    # ------------------------------
+    # Puntuación
+    # ------------------------------
+    @staticmethod
+    def _afinidad(pesos, usuarios, co):
+        """
+        {clave: afinidad} del usuario: su propia proporción de cada clave más
+        P(clave | clave del usuario) según las demás bibliotecas.
+        """
+        total = sum(pesos.values()) or 1
+        afinidad = {}
+        for clave, peso in pesos.items():
+            proporcion = peso / total
+            afinidad[clave] = afinidad.get(clave, 0.0) + proporcion
+            apariciones = usuarios.get(clave)
+            if not apariciones:
+                continue
+            for otra, juntas in co.fila(clave).items():
+                afinidad[otra] = afinidad.get(otra, 0.0) + proporcion * juntas / apariciones
+        return afinidad
+
+    @staticmethod
+    def _popularidad(prestamos):
+        maximo = math.log1p(max(prestamos.values(), default=0)) or 1.0
+        return lambda clave: math.log1p(prestamos.get(clave, 0)) / maximo
+
+    def recomendar(self, documento, n=RECOMMENDATIONS_TOP_N):
+        """Ids de los `n` libros del propio usuario más afines a su biblioteca; los prestados no entran."""
+        afinidad_tipo = self._afinidad(_pesos(documento, "tipo"), self.usuarios_tipo, self.co_tipos)
+        afinidad_autor = self._afinidad(_pesos(documento, "autor"), self.usuarios_autor, self.co_autores)
+        popularidad_tipo = self._popularidad(self.prestamos_tipo)
+        popularidad_autor = self._popularidad(self.prestamos_autor)
+        prestados = {p.get("libro_id") for p in documento.get("prestamos_activos", [])}
+
+        candidatos = []
+        for libro in documento.get("libros_disponibles", []):
+            libro_id = libro.get("id")
+            if not libro_id or libro_id in prestados or libro.get("estado") == "prestado":
+                continue
+            tipo, autor = _clave(libro.get("tipo")), _clave(libro.get("autor"))
+            puntuacion = (
+                2.0 * afinidad_autor.get(autor, 0.0)
+                + afinidad_tipo.get(tipo, 0.0)
+                + 0.25 * (popularidad_autor(autor) + popularidad_tipo(tipo))
+            )
+            # Un libro que ya circuló mucho probablemente ya se leyó
+            candidatos.append((puntuacion / (1 + (libro.get("total_prestamos") or 0)), libro_id))
+        return [libro_id for _, libro_id in heapq.nlargest(n, candidatos)]
+
+
+# ==============================
+# Almacén de recomendaciones
+# ==============================
+# Item aparte por usuario en RECOMMENDATIONS_TABLE (por defecto la tabla de
+# caché, clave user_id = RECOMENDACIONES#<id>): el trabajo no reescribe el
+# documento del usuario y no compite con sus escrituras.
+_RECOMENDACIONES = {}
+
+def _tabla():
+    return recurso("dynamodb", endpoint_url=DDB_ENDPOINT_URL).Table(RECOMMENDATIONS_TABLE)
+
+def guardar_recomendaciones(resultados):
+    """Guarda [(user_id, [libro_id, ...])]."""
+    generado = ahora()
+    if PERSISTENCE_BACKEND == "fake":
+        for user_id, libros in resultados:
+            _RECOMENDACIONES[user_id] = {"libros": libros, "generado": generado}
+        return
+    with _tabla().batch_writer() as lote:
+        for user_id, libros in resultados:
+            lote.put_item(Item={
+                "user_id": PREFIJO_RECOMENDACIONES + user_id,
+                "libros": libros,
+                "generado": generado,
+                "ttl": en_dias(DIAS_VIGENCIA, generado),
+            })
+
+def leer_recomendaciones(user_id):
+    """Lista precalculada de ids (mejor primero); vacía si el trabajo no la ha generado."""
+    if PERSISTENCE_BACKEND == "fake":
+        return _RECOMENDACIONES.get(user_id, {}).get("libros", [])
+    try:
+        item = _tabla().get_item(Key={"user_id": PREFIJO_RECOMENDACIONES + user_id}).get("Item")
+    except Exception as e:
+        logger.warning(f"No se pudieron leer las recomendaciones: {e}")
+        return []
+    return list(item.get("libros", [])) if item else []
+
+
+# ==============================
+# Trabajo por lotes (map/reduce)
+# ==============================
+def _contar_lote(user_ids):
+    """Fase 1 (en un proceso del pool): matrices parciales de un lote de usuarios."""
+    parcial = MatricesRecomendacion()
+    for _, documento in batch.documentos(user_ids):
+        parcial.agregar_documento(documento)
+    return parcial
+
+def _recomendar_lote(user_ids):
+    """Fase 2: listas top-N del lote con las matrices globales (el contexto del proceso)."""
+    matrices = batch.contexto()
+    return [(user_id, matrices.recomendar(documento)) for user_id, documento in batch.documentos(user_ids)]
+
+def ejecutar(procesos=None):
+    """Calcula y guarda las recomendaciones de todos los usuarios. Devuelve cuántos usuarios se procesaron."""
+    procesos = batch.numero_de_procesos(procesos)
+
+    matrices = MatricesRecomendacion()
+    for parcial in batch.mapear(_contar_lote, batch.usuarios(), procesos):
+        matrices.fusionar(parcial)
+    logger.info(f"🧮 Matrices: {len(matrices.usuarios_tipo)} géneros y {len(matrices.usuarios_autor)} autores")
+
+    total = 0
+    for resultados in batch.mapear(_recomendar_lote, batch.usuarios(), procesos, matrices):
+        guardar_recomendaciones(resultados)
+        total += len(resultados)
+    logger.info(f"📚 Recomendaciones guardadas para {total} usuarios")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ejecutar(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+
+from config import RETRY_QUEUE_DIR, RETRY_QUEUE_MAX_AGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Cola local de escrituras pendientes
+# ==============================
+# Cuando la persistencia no responde a tiempo, el documento se guarda en
+# RETRY_QUEUE_DIR (/tmp sobrevive entre invocaciones del mismo contenedor,
+# incluso si el runtime se reinicia tras un timeout) y se reintenta en la
+# siguiente petición del usuario. Hay a lo sumo una entrada por usuario:
+# la última escritura contiene a las anteriores.
+#   {"user_id", "documento", "encolado"}
+# El reintento guarda el documento completo (no los eventos): si la llamada
+# cortada sí llegó a escribirse, repetirla no duplica nada. Antes de reintentar
+# se compara con la versión guardada (otro contenedor pudo escribir una más
+# nueva), y una entrada con más de RETRY_QUEUE_MAX_AGE_SECONDS se descarta.
+
+_LOCK = threading.Lock()
+# user_id -> (ruta del archivo, momento en que se encoló); se carga del directorio la primera vez
+_INDICE = None
+
+
+def _ruta(user_id):
+    return os.path.join(RETRY_QUEUE_DIR, hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32] + ".json")
+
+
+def _a_json(valor):
+    if isinstance(valor, Decimal):
+        return int(valor) if valor == valor.to_integral_value() else float(valor)
+    raise TypeError(f"{type(valor).__name__} no serializable")
+
+
+def _indice():
+    global _INDICE
+    if _INDICE is None:
+        _INDICE = {}
+        if os.path.isdir(RETRY_QUEUE_DIR):
+            for nombre in os.listdir(RETRY_QUEUE_DIR):
+                if not nombre.endswith(".json"):
+                    continue
+                ruta = os.path.join(RETRY_QUEUE_DIR, nombre)
+                try:
+                    with open(ruta, encoding="utf-8") as archivo:
+                        entrada = json.load(archivo)
+                    _INDICE[entrada["user_id"]] = (ruta, entrada.get("encolado", 0))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Escritura pendiente ilegible {nombre}: {e}")
+    return _INDICE
+
+
+def _vigente(user_id):
+    """Ruta de la entrada del usuario, o None; una entrada vencida se descarta."""
+    registrada = _indice().get(user_id)
+    if registrada is None:
+        return None
+    ruta, encolado = registrada
+    if time.time() - encolado > RETRY_QUEUE_MAX_AGE_SECONDS:
+        logger.warning(f"🗑️ Escritura pendiente de {user_id} descartada: lleva más de "
+                       f"{RETRY_QUEUE_MAX_AGE_SECONDS} s en la cola")
+        descartar(user_id)
+        return None
+    return ruta
+
+
+def hay_pendiente(user_id):
+    return _vigente(user_id) is not None
+
+
+def leer(user_id):
+    """Entrada pendiente (y vigente) del usuario, o None."""
+    ruta = _vigente(user_id)
+    if ruta is None:
+        return None
+    try:
+        with open(ruta, encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Escritura pendiente de {user_id} ilegible: {e}")
+        return None
+
+
+def encolar(user_id, documento):
+    """Guarda (de forma atómica) el documento pendiente del usuario, reemplazando al anterior si es más viejo."""
+    anterior = leer(user_id)
+    if anterior is not None and anterior["documento"].get("version", 0) > documento.get("version", 0):
+        return
+    # Reemplazar la entrada renueva su antigüedad: el documento nuevo parte de una lectura reciente
+    entrada = {"user_id": user_id, "documento": documento, "encolado": time.time()}
+    ruta = _ruta(user_id)
+    with _LOCK:
+        os.makedirs(RETRY_QUEUE_DIR, exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(entrada, archivo, ensure_ascii=False, default=_a_json)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, ruta)
+        _indice()[user_id] = (ruta, entrada["encolado"])
+    logger.warning(f"📥 Escritura de {user_id} encolada para reintento (versión {documento.get('version')})")
+
+
+def descartar(user_id):
+    with _LOCK:
+        registrada = _indice().pop(user_id, None)
+        if registrada:
+            try:
+                os.remove(registrada[0])
+            except FileNotFoundError:
+                pass
+
+
+def pendientes():
+    """user_ids con escrituras pendientes."""
+    return [user_id for user_id in list(_indice()) if hay_pendiente(user_id)]
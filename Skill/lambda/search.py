@@ -0,0 +1,147 @@
+import heapq
+import math
+import re
+import unicodedata
+from functools import lru_cache
+
+# ==============================
+# Análisis de texto (español)
+# ==============================
+# Clave con la que los documentos antiguos guardaban el índice; ya no se persiste
+CLAVE_INDICE_BUSQUEDA = "indice_busqueda"
+
+# Peso de cada campo: un término del título cuenta más que uno del género
+PESOS_CAMPOS = (("titulo", 3), ("autor", 2), ("tipo", 1))
+
+# Parámetros de BM25
+K1 = 1.2
+B = 0.75
+
+_PALABRAS = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset((
+    "a", "al", "con", "de", "del", "e", "el", "en", "la", "las", "lo", "los",
+    "o", "para", "por", "sobre", "u", "un", "una", "unos", "unas", "y",
+    "libro", "libros", "mis", "mi", "tengo", "busca", "buscar",
+))
+
+# Sufijos que se recortan (el más largo primero); aproximación ligera a Snowball
+_SUFIJOS = (
+    "amientos", "imientos", "amiento", "imiento", "aciones", "uciones",
+    "adoras", "adores", "ancias", "mente", "acion", "ucion", "adora", "ador",
+    "ancia", "idad", "ivas", "ivos", "iva", "ivo", "osas", "osos", "osa", "oso",
+    "es", "os", "as", "s", "a", "o", "e",
+)
+_RAIZ_MINIMA = 3
+
+def _sin_acentos(texto):
+    texto = texto.casefold()
+    if texto.isascii():
+        return texto
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+@lru_cache(maxsize=8192)
+def raiz(palabra):
+    """Raíz de una palabra ya normalizada ('mágicos' -> 'magic')."""
+    for sufijo in _SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= _RAIZ_MINIMA:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+def terminos(texto):
+    """Texto libre -> raíces sin stopwords, en orden."""
+    if not texto:
+        return []
+    return [raiz(p) for p in _PALABRAS.findall(_sin_acentos(texto)) if p not in STOPWORDS]
+
+def terminos_libro(libro):
+    """{raíz: frecuencia ponderada por campo} de un libro."""
+    frecuencias = {}
+    for campo, peso in PESOS_CAMPOS:
+        for termino in terminos(libro.get(campo)):
+            frecuencias[termino] = frecuencias.get(termino, 0) + peso
+    return frecuencias
+
+
+# ==============================
+# Índice invertido con BM25
+# ==============================
+class SearchIndex:
+    """
+    Índice invertido por usuario sobre título, autor y tipo.
+
+    Vive en memoria junto al documento (no se persiste: crecería con la
+    biblioteca el objeto de S3 y el item de la caché de DynamoDB) y se
+    construye en la primera búsqueda tras cargarlo:
+        {"t": {raíz: {libro_id: frecuencia}}, "l": {libro_id: longitud}, "s": suma de longitudes}
+    Agregar o quitar un libro sólo toca las listas de sus propios términos.
+    """
+    __slots__ = ("datos",)
+
+    def __init__(self, datos=None):
+        self.datos = datos or {"t": {}, "l": {}, "s": 0}
+
+    @classmethod
+    def de_libros(cls, libros):
+        indice = cls()
+        for libro in libros:
+            indice.agregar(libro)
+        return indice
+
+    @property
+    def total(self):
+        """Libros indexados."""
+        return len(self.datos["l"])
+
+    def agregar(self, libro):
+        libro_id = libro.get("id")
+        if not libro_id or libro_id in self.datos["l"]:
+            return
+        frecuencias = terminos_libro(libro)
+        postings = self.datos["t"]
+        for termino, frecuencia in frecuencias.items():
+            postings.setdefault(termino, {})[libro_id] = frecuencia
+        longitud = sum(frecuencias.values())
+        self.datos["l"][libro_id] = longitud
+        self.datos["s"] += longitud
+
+    def quitar(self, libro):
+        libro_id = libro.get("id")
+        longitud = self.datos["l"].pop(libro_id, None)
+        if longitud is None:
+            return
+        self.datos["s"] -= longitud
+        postings = self.datos["t"]
+        for termino in terminos_libro(libro):
+            lista = postings.get(termino)
+            if lista is not None:
+                lista.pop(libro_id, None)
+                if not lista:
+                    del postings[termino]
+
+    def buscar(self, texto, limite=10):
+        """
+        ([(libro_id, puntuación)] de los `limite` mejores por BM25, total de
+        libros que coinciden). El total cuenta también los que no entran en la página.
+        """
+        consulta = set(terminos(texto))
+        n = len(self.datos["l"])
+        if not consulta or not n:
+            return [], 0
+        promedio = self.datos["s"] / n
+        longitudes = self.datos["l"]
+        # Normalización de longitud de BM25: K1 * (1 - B + B * longitud / promedio)
+        base = K1 * (1 - B)
+        pendiente = K1 * B / promedio
+        puntuaciones = {}
+        obtener = puntuaciones.get
+        for termino in consulta:
+            lista = self.datos["t"].get(termino)
+            if not lista:
+                continue
+            idf = math.log(1 + (n - len(lista) + 0.5) / (len(lista) + 0.5)) * (K1 + 1)
+            for libro_id, frecuencia in lista.items():
+                puntuaciones[libro_id] = obtener(libro_id, 0.0) + idf * frecuencia / (
+                    frecuencia + base + pendiente * longitudes[libro_id])
+        return heapq.nlargest(limite, puntuaciones.items(), key=lambda par: par[1]), len(puntuaciones)
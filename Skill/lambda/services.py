@@ -1,8 +1,25 @@
+import logging
+import re
 from database import DatabaseManager
-from phrases import PhrasesManager 
-from models import generar_id_unico, Libro, Prestamo
-from datetime import datetime, timedelta
-from config import LIBROS_POR_PAGINA
+from phrases import RenderCache
+from models import (
+    Libro, Prestamo, ESTADO_DISPONIBLE, ESTADO_PRESTADO,
+    CLAVE_ESTADISTICAS_PERSONAS, contar_para_persona, normalizar_persona,
+)
+from datetime import datetime
+from fechas import ahora, dias_restantes, normalizar_campos
+from events import libro_prestado, libro_devuelto, libro_eliminado
+from config import LIBROS_POR_PAGINA, RENDER_CACHE_SIZE
+from query import LibraryQuery, ORDEN_TITULO, ORDEN_FECHA, ORDEN_PRESTAMOS
+from recommender import leer_recomendaciones
+from tracing import instrumentar_clase
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_FECHA_PRESTAMO = ("fecha_prestamo", "fecha_limite")
+
+# Separadores entre títulos al prestar varios a la vez ("A, B y C")
+_SEPARADOR_TITULOS = re.compile(r"(\s*,\s*|\s+y\s+)", re.IGNORECASE)
 
 def buscar_libro_por_titulo(libros, titulo_buscado):
     if not titulo_buscado:
@@ -27,26 +44,61 @@ def buscar_libro_por_titulo_exacto(libros, titulo):
             return libro
     return None
 
+ORDENES_POR_SLOT = {
+    "por título": ORDEN_TITULO,
+    "más recientes": ORDEN_FECHA,
+    "más prestados": ORDEN_PRESTAMOS,
+}
+
+# Resultados derivados del documento, memoizados por versión. El prefetch los
+# calienta al terminar una respuesta para que el siguiente turno no recalcule.
+_RESULTADOS = RenderCache(RENDER_CACHE_SIZE)
+
+def _memo_por_version(handler_input, nombre, calcular, *extra):
+    clave = (
+        DatabaseManager._user_id(handler_input),
+        DatabaseManager.get_version(handler_input),
+        nombre,
+    ) + extra
+    return _RESULTADOS.obtener_o_renderizar(clave, calcular)
+
 class BibliotecaService:
     @staticmethod
-    def agregar_libro(handler_input, titulo, autor, tipo):
-        
+    def agregar_libro(handler_input, titulo, autor, tipo, aceptar_parecido=False):
+        """
+        Retorna el Libro agregado; False si el título ya existe, o el libro ya
+        guardado (dict) cuyo título es casi igual, salvo con `aceptar_parecido`.
+        """
+        # Agregar escribe el documento, así que siempre se carga: el título repetido se
+        # confirma contra el índice (el filtro del resumen puede dar falsos positivos)
         user_data = DatabaseManager.get_user_data(handler_input)
-        libros = user_data.get("libros_disponibles", [])
+        indice = DatabaseManager.get_library_index(handler_input)
         
-        if any(libro.get("titulo", "").lower() == titulo.lower() for libro in libros):
+        if indice.libro_por_titulo(titulo):
             return False
+        if not aceptar_parecido:
+            parecidos = DatabaseManager.get_duplicate_index(handler_input).parecidos(titulo, indice.libros)
+            if parecidos:
+                return parecidos[0][1]
 
-        nuevo_libro = Libro(titulo=titulo, autor=autor, tipo=tipo)
-        
-        libros.append(nuevo_libro.to_dict())
-        stats = user_data.setdefault("estadisticas", {})
-        stats["total_libros"] = len(libros)
-        
-        DatabaseManager.save_user_data(handler_input, user_data)
+        nuevo_libro = Libro(titulo=titulo, autor=autor, tipo=tipo, id_libro=indice.nuevo_id())
+        DatabaseManager.append_libro(handler_input, user_data, nuevo_libro.to_dict())
         
         return nuevo_libro
     
+    @staticmethod
+    def titulo_repetido(handler_input, titulo):
+        """
+        True si el título ya está en la biblioteca (para avisar apenas se dicta).
+        Con el documento fuera de memoria, un título que el filtro del resumen
+        no conoce se descarta sin cargarlo; un positivo del filtro se confirma
+        contra el índice. agregar_libro vuelve a comprobarlo al guardar.
+        """
+        resumen = DatabaseManager.get_resumen(handler_input)
+        if resumen is not None and not resumen.puede_tener_titulo(titulo):
+            return False
+        return DatabaseManager.get_library_index(handler_input).libro_por_titulo(titulo) is not None
+
     @staticmethod
     def limpiar_y_normalizar_valor(valor, esperando):
         if not valor:
@@ -81,33 +133,61 @@ class BibliotecaService:
         return user_data.get("libros_disponibles", [])
 
     @staticmethod
-    def sincronizar_y_filtrar_libros(handler_input, filtro_tipo, autor):
+    def _fecha_desde_slot(valor):
+        """Convierte un AMAZON.DATE ('2024-05-01' o '2024-05') a epoch; None si no aplica."""
+        if not valor:
+            return None
+        try:
+            if len(valor) == 7:
+                valor = f"{valor}-01"
+            return int(datetime.fromisoformat(valor).timestamp())
+        except ValueError:
+            return None
+
+    @staticmethod
+    def consultar_libros(handler_input, filtro_tipo=None, autor=None, tipo=None,
+                         desde=None, orden=None, limite=None):
         """
-        Sincroniza el estado de los préstamos, guarda los datos y luego filtra.
-        Retorna: lista de libros filtrados, el título del filtro aplicado.
+        Ejecuta una consulta combinada sobre la tabla columnar del usuario.
+        Retorna: la tabla, las posiciones del resultado y el título del filtro aplicado.
         """
-        user_data = DatabaseManager.get_user_data(handler_input)
-
-        todos_libros = user_data.get("libros_disponibles", [])
-        prestamos = user_data.get("prestamos_activos", [])
-        libros_filtrados = todos_libros.copy()
+        tabla = DatabaseManager.get_library_table(handler_input)
+        estado = None
         titulo_filtro = ""
-        
-        if autor:
-            libros_filtrados = [l for l in libros_filtrados if l.get("autor", "").lower() == autor.lower()]
-            titulo_filtro = f" de {autor}"
-        elif filtro_tipo:
+
+        if filtro_tipo:
             filtro_tipo_lower = filtro_tipo.lower()
             if filtro_tipo_lower in ["prestados", "prestado"]:
-                ids_prestados = [p.get("libro_id") for p in prestamos]
-                libros_filtrados = [l for l in libros_filtrados if l.get("id") in ids_prestados]
-                titulo_filtro = " prestados"
+                estado = ESTADO_PRESTADO
+                titulo_filtro += " prestados"
             elif filtro_tipo_lower in ["disponibles", "disponible"]:
-                ids_prestados = [p.get("libro_id") for p in prestamos]
-                libros_filtrados = [l for l in libros_filtrados if l.get("id") not in ids_prestados]
-                titulo_filtro = " disponibles"
-                
-        return libros_filtrados, titulo_filtro
+                estado = ESTADO_DISPONIBLE
+                titulo_filtro += " disponibles"
+        if tipo:
+            titulo_filtro += f" de tipo {tipo}"
+        if autor:
+            titulo_filtro += f" de {autor}"
+        agregado_desde = BibliotecaService._fecha_desde_slot(desde)
+        if agregado_desde:
+            titulo_filtro += " agregados desde esa fecha"
+
+        descendente = orden in [ORDEN_FECHA, ORDEN_PRESTAMOS]
+        indices = LibraryQuery(tabla).ejecutar(
+            autor=autor, tipo=tipo, estado=estado, agregado_desde=agregado_desde,
+            orden=orden, descendente=descendente, limite=limite
+        )
+        return tabla, indices, titulo_filtro
+
+    @staticmethod
+    def sincronizar_y_filtrar_libros(handler_input, filtro_tipo, autor):
+        """
+        Filtra los libros según el estado de los préstamos o el autor.
+        Retorna: lista de libros filtrados, el título del filtro aplicado.
+        """
+        tabla, indices, titulo_filtro = BibliotecaService.consultar_libros(
+            handler_input, filtro_tipo=filtro_tipo, autor=autor
+        )
+        return tabla.filas(indices), titulo_filtro
 
     @staticmethod
     def obtener_pagina_libros(libros_filtrados, pagina_actual):
@@ -126,187 +206,308 @@ class BibliotecaService:
             "quedan_mas": fin < total_libros,
             "es_ultima_pagina": fin == total_libros
         }
+
+    @staticmethod
+    def obtener_pagina_consulta(handler_input, listado, pagina_actual):
+        """
+        Pagina el resultado de una consulta sin materializar más que la página pedida.
+        `listado` contiene los parámetros de la consulta (filtro_tipo, autor, tipo, desde, orden).
+        """
+        tabla, indices, titulo_filtro = BibliotecaService.consultar_libros(handler_input, **listado)
+        paginacion = BibliotecaService.obtener_pagina_libros(indices, pagina_actual)
+        paginacion["libros_pagina"] = tabla.filas(paginacion["libros_pagina"])
+        paginacion["titulo_filtro"] = titulo_filtro
+        paginacion["total_libros_usuario"] = len(tabla)
+        return paginacion
         
     @staticmethod
-    def registrar_prestamo(handler_input, titulo, nombre_persona):
-        """Busca el libro, valida el estado y registra el préstamo. Retorna Prestamo, o cadena de error."""
+    def separar_titulos(handler_input, texto):
+        """
+        Divide "Rayuela, Aura y Pedro Páramo" en títulos. Si el texto completo
+        es un título ("Orgullo y prejuicio") no se divide; si no, se toma de
+        izquierda a derecha el tramo más largo que sea un título exacto.
+        """
+        indice = DatabaseManager.get_library_index(handler_input)
+        if not texto or indice.libro_por_titulo(texto.strip()):
+            return [texto.strip()] if texto else []
+        # [parte, separador, parte, separador, ...]
+        trozos = _SEPARADOR_TITULOS.split(texto.strip())
+        partes = trozos[0::2]
+        titulos = []
+        i = 0
+        while i < len(partes):
+            fin = i
+            for j in range(len(partes) - 1, i, -1):
+                if indice.libro_por_titulo("".join(trozos[2 * i:2 * j + 1])):
+                    fin = j
+                    break
+            titulo = "".join(trozos[2 * i:2 * fin + 1]).strip()
+            if titulo:
+                titulos.append(titulo)
+            i = fin + 1
+        return titulos
+
+    @staticmethod
+    def registrar_prestamos(handler_input, titulos, nombre_persona):
+        """
+        Presta varios libros a una persona. Se validan todos contra los índices
+        y los préstamos válidos se guardan con una sola escritura.
+        Retorna [(titulo, Prestamo o cadena de error)] en el orden recibido.
+        """
         user_data = DatabaseManager.get_user_data(handler_input)
-        libros = user_data.get("libros_disponibles", [])
-        prestamos_dicts = user_data.get("prestamos_activos", [])
-        
-        libro = buscar_libro_por_titulo_exacto(libros, titulo)
-        
-        if not libro:
-            return "no_encontrado"
+        indice = DatabaseManager.get_library_index(handler_input)
+        tabla = DatabaseManager.tabla_en_cache(handler_input, user_data)
+        resultados = []
+        nuevos = []
 
-        if not libro.get("id"):
-            libro["id"] = generar_id_unico()
-            for l in libros:
-                if l.get("titulo") == libro.get("titulo"):
-                    l["id"] = libro["id"]
-                    break
-        prestamo_existente = next((p for p in prestamos_dicts if p.get("libro_id") == libro.get("id")), None)
-
-        if prestamo_existente:
-            return "ya_prestado"
-        nuevo_prestamo = Prestamo(
-            libro_id=libro["id"], 
-            titulo=libro["titulo"], 
-            nombre_persona=nombre_persona
-        )
-        prestamos_dicts.append(nuevo_prestamo.to_dict())
-        for l in libros:
-            if l.get("id") == libro.get("id"):
-                l["estado"] = "prestado"
-                l["total_prestamos"] = l.get("total_prestamos", 0) + 1
-                break
-                
-        stats = user_data.setdefault("estadisticas", {})
-        stats["total_prestamos"] = stats.get("total_prestamos", 0) + 1
+        for titulo in titulos:
+            libro = indice.libro_por_titulo(titulo)
+            if not libro:
+                resultados.append((titulo, "no_encontrado"))
+                continue
+            if indice.prestamo_de_libro(libro["id"]):
+                resultados.append((titulo, "ya_prestado"))
+                continue
+            nuevo_prestamo = Prestamo(
+                libro_id=libro["id"], 
+                titulo=libro["titulo"], 
+                nombre_persona=nombre_persona,
+                id_prestamo=indice.nuevo_id()
+            )
+            prestamo_dict = nuevo_prestamo.to_dict()
+            indice.agregar_prestamo(prestamo_dict)
+            if tabla is not None and not tabla.actualizar(libro, prestado=True):
+                tabla = None
+            nuevos.append(prestamo_dict)
+            resultados.append((titulo, nuevo_prestamo))
 
-        user_data["libros_disponibles"] = libros
-        user_data["prestamos_activos"] = prestamos_dicts
-        
-        DatabaseManager.save_user_data(handler_input, user_data)
+        if nuevos:
+            stats = user_data.setdefault("estadisticas", {})
+            stats["total_prestamos"] = stats.get("total_prestamos", 0) + len(nuevos)
+            contar_para_persona(user_data, nuevos[0]["persona"], prestamos=len(nuevos))
         
-        return nuevo_prestamo
+            DatabaseManager.save_user_data(handler_input, user_data, tabla=tabla, indice=indice,
+                                           eventos=[libro_prestado(p) for p in nuevos])
+        return resultados
+
+    @staticmethod
+    def registrar_prestamo(handler_input, titulo, nombre_persona):
+        """Busca el libro, valida el estado y registra el préstamo. Retorna Prestamo, o cadena de error."""
+        [(_, resultado)] = BibliotecaService.registrar_prestamos(handler_input, [titulo], nombre_persona)
+        return resultado
         
     @staticmethod
     def get_libros_disponibles_info(handler_input):
-        user_data = DatabaseManager.get_user_data(handler_input)
-        libros = user_data.get("libros_disponibles", [])
-        prestamos = user_data.get("prestamos_activos", [])
-        
-        ids_prestados = {p.get("libro_id") for p in prestamos}
-        disponibles = [l for l in libros if l.get("id") and l.get("id") not in ids_prestados]
-        
-        num_disponibles = len(disponibles)
-        ejemplos = [l.get("titulo") for l in disponibles[:2]]
+        def calcular():
+            indice = DatabaseManager.get_library_index(handler_input)
+            prestados = indice.prestamo_por_libro
+        
+            num_disponibles = len(indice.libros) - sum(1 for libro_id in prestados if libro_id in indice.libros)
+            ejemplos = []
+            # Basta con recorrer hasta encontrar dos libros sin préstamo
+            for libro_id, libro in indice.libros.items():
+                if len(ejemplos) == 2:
+                    break
+                if libro_id not in prestados:
+                    ejemplos.append(libro.get("titulo"))
 
-        return num_disponibles, ejemplos
-    
+            return num_disponibles, ejemplos
+
+        return _memo_por_version(handler_input, "disponibles", calcular)
+        
     @staticmethod
-    def buscar_libros(handler_input, titulo):
-        user_data = DatabaseManager.get_user_data(handler_input)
-        libros = user_data.get("libros_disponibles", [])
-        libros_encontrados = buscar_libro_por_titulo(libros, titulo)
-        return libros_encontrados
+    def buscar_libros(handler_input, texto, limite=10):
+        """
+        Búsqueda de texto libre en título, autor y tipo, ordenada por relevancia (BM25).
+        Un título exacto va siempre primero; si el índice no encuentra nada se
+        cae a la búsqueda por parte del título.
+        Retorna (los `limite` primeros, total de libros que coinciden).
+        """
+        indice = DatabaseManager.get_library_index(handler_input)
+        busqueda = DatabaseManager.get_search_index(handler_input)
+        mejores, total = busqueda.buscar(texto, limite)
+        encontrados = [indice.libro(libro_id) for libro_id, _ in mejores]
+        encontrados = [l for l in encontrados if l is not None]
+        exacto = indice.libro_por_titulo(texto)
+        if exacto is not None:
+            encontrados = [exacto] + [l for l in encontrados if l is not exacto]
+        if not encontrados:
+            encontrados = buscar_libro_por_titulo(list(indice.libros.values()), texto)
+            total = len(encontrados)
+        # Un título formado sólo por palabras vacías no pasa por el índice
+        return encontrados[:limite], max(total, min(len(encontrados), limite))
         
     @staticmethod
-    def buscar_prestamo_activo(prestamos_dicts, titulo, id_prestamo):
-        if not prestamos_dicts:
-            return None, -1
-        prestamo_encontrado = None
-        indice = -1
+    def buscar_prestamo_activo(indice, titulo, id_prestamo):
+        """Préstamo activo por id, por título exacto o, si no, por parte del título."""
+        if not indice.prestamos:
+            return None
         if id_prestamo:
-            for i, p in enumerate(prestamos_dicts):
-                if p.get("id") == id_prestamo:
-                    return p, i
+            prestamo = indice.prestamo(id_prestamo)
+            if prestamo:
+                return prestamo
         if titulo:
+            libro = indice.libro_por_titulo(titulo)
+            prestamo = indice.prestamo_de_libro(libro["id"]) if libro else None
+            if prestamo:
+                return prestamo
             titulo_lower = titulo.lower()
-            for i, p in enumerate(prestamos_dicts):
+            for p in indice.prestamos.values():
                 if titulo_lower in p.get("titulo", "").lower():
-                    return p, i
-        return None, -1
+                    return p
+        return None
+
+    @staticmethod
+    def _finalizar_prestamos(handler_input, user_data, indice, prestamos):
+        """
+        Pasa los préstamos al historial, libera sus libros y guarda todo con
+        una sola escritura. Retorna los registros de historial creados.
+        """
+        historial_prestamos = user_data.setdefault("historial_prestamos", [])
+        libros = indice.quitar_prestamos(prestamos)
+        tabla = DatabaseManager.tabla_en_cache(handler_input, user_data)
+        fecha_devolucion = ahora()
+        finalizados = []
+
+        for prestamo, libro in zip(prestamos, libros):
+            prestamo_finalizado = normalizar_campos(prestamo.copy(), CAMPOS_FECHA_PRESTAMO)
+            prestamo_finalizado["fecha_devolucion"] = fecha_devolucion
+            prestamo_finalizado["estado"] = "devuelto"
+        
+            fecha_limite = prestamo_finalizado.get("fecha_limite")
+            prestamo_finalizado["devuelto_a_tiempo"] = not fecha_limite or fecha_devolucion <= fecha_limite
+
+            historial_prestamos.append(prestamo_finalizado)
+            contar_para_persona(user_data, prestamo_finalizado.get("persona"), devoluciones=1,
+                                devoluciones_tarde=0 if prestamo_finalizado["devuelto_a_tiempo"] else 1)
+            if tabla is not None and (libro is None or not tabla.actualizar(libro, prestado=False)):
+                tabla = None
+            finalizados.append(prestamo_finalizado)
+
+        stats = user_data.setdefault("estadisticas", {})
+        stats["total_devoluciones"] = stats.get("total_devoluciones", 0) + len(finalizados)
+
+        DatabaseManager.save_user_data(handler_input, user_data, tabla=tabla, indice=indice,
+                                       eventos=[libro_devuelto(f) for f in finalizados])
+        return finalizados
 
     @staticmethod
     def registrar_devolucion(handler_input, titulo=None, id_prestamo=None):
         user_data = DatabaseManager.get_user_data(handler_input)
-        libros = user_data.get("libros_disponibles", [])
-        prestamos_activos = user_data.get("prestamos_activos", [])
-        historial_prestamos = user_data.get("historial_prestamos", [])
-        if not prestamos_activos:
+        indice = DatabaseManager.get_library_index(handler_input)
+        if not indice.prestamos:
             return "no_prestamos"
-        prestamo_a_devolver, indice = BibliotecaService.buscar_prestamo_activo(
-            prestamos_activos, titulo, id_prestamo
-        )
+        prestamo_a_devolver = BibliotecaService.buscar_prestamo_activo(indice, titulo, id_prestamo)
 
         if not prestamo_a_devolver:
             return "no_encontrado"
-        prestamo_finalizado = prestamo_a_devolver.copy() 
-        
-        prestamos_activos.pop(indice) 
-        
-        prestamo_finalizado["fecha_devolucion"] = datetime.now().isoformat()
-        prestamo_finalizado["estado"] = "devuelto"
-        
-        fecha_limite = datetime.fromisoformat(prestamo_finalizado.get("fecha_limite"))
-        prestamo_finalizado["devuelto_a_tiempo"] = datetime.now() <= fecha_limite
 
-        historial_prestamos.append(prestamo_finalizado)
+        finalizados = BibliotecaService._finalizar_prestamos(handler_input, user_data, indice, [prestamo_a_devolver])
+        return finalizados[0]
 
-        for l in libros:
-            if l.get("id") == prestamo_finalizado.get("libro_id"):
-                l["estado"] = "disponible"
-                break
-        stats = user_data.setdefault("estadisticas", {})
-        stats["total_devoluciones"] = stats.get("total_devoluciones", 0) + 1
+    @staticmethod
+    def prestamos_de_persona(handler_input, nombre_persona):
+        """Préstamos activos de una persona y sus estadísticas de por vida, sin recorrer todos los préstamos."""
+        user_data = DatabaseManager.get_user_data(handler_input)
+        indice = DatabaseManager.get_library_index(handler_input)
+        prestamos = indice.prestamos_de_persona(nombre_persona)
+        estadisticas = user_data.get(CLAVE_ESTADISTICAS_PERSONAS, {}).get(normalizar_persona(nombre_persona), {})
+        return prestamos, estadisticas
 
-        user_data["prestamos_activos"] = prestamos_activos
-        user_data["historial_prestamos"] = historial_prestamos
-        DatabaseManager.save_user_data(handler_input, user_data)
+    @staticmethod
+    def devolver_todo_de_persona(handler_input, nombre_persona):
+        """Registra la devolución de todos los libros que tiene una persona. Retorna los registros, o cadena de error."""
+        user_data = DatabaseManager.get_user_data(handler_input)
+        indice = DatabaseManager.get_library_index(handler_input)
+        prestamos = indice.prestamos_de_persona(nombre_persona)
+        if not prestamos:
+            return "sin_prestamos"
+        return BibliotecaService._finalizar_prestamos(handler_input, user_data, indice, prestamos)
 
-        return prestamo_finalizado
+    @staticmethod
+    def recomendar_libro(handler_input, descartados=()):
+        """
+        Siguiente libro recomendado que sigue en la biblioteca y no está prestado.
+        Usa la lista precalculada por recommender.py; sin ella, un libro disponible cualquiera.
+        """
+        indice = DatabaseManager.get_library_index(handler_input)
+        for libro_id in leer_recomendaciones(DatabaseManager._user_id(handler_input)):
+            libro = indice.libro(libro_id)
+            if libro is not None and libro_id not in indice.prestamo_por_libro and libro_id not in descartados:
+                return libro
+        _, ejemplos = BibliotecaService.get_libros_disponibles_info(handler_input)
+        for titulo in ejemplos:
+            libro = indice.libro_por_titulo(titulo)
+            if libro is not None and libro.get("id") not in descartados:
+                return libro
+        return None
 
     @staticmethod
     def get_prestamos_activos_info(handler_input):
-        user_data = DatabaseManager.get_user_data(handler_input)
-        prestamos = user_data.get("prestamos_activos", [])
-        
-        num_prestados = len(prestamos)
-        ejemplos = [
-            f"'{p.get('titulo')}' a {p.get('persona', 'un amigo')}" 
-            for p in prestamos[:3]
-        ]
+        def calcular():
+            user_data = DatabaseManager.get_user_data(handler_input)
+            prestamos = user_data.get("prestamos_activos", [])
+        
+            num_prestados = len(prestamos)
+            ejemplos = [
+                f"'{p.get('titulo')}' a {p.get('persona', 'un amigo')}" 
+                for p in prestamos[:3]
+            ]
 
-        return num_prestados, ejemplos
+            return num_prestados, ejemplos
+
+        return _memo_por_version(handler_input, "prestamos_info", calcular)
         
     @staticmethod
     def obtener_resumen_prestamos(handler_input):
-        user_data = DatabaseManager.get_user_data(handler_input)
-        prestamos_activos = user_data.get("prestamos_activos", [])
-        
-        if not prestamos_activos:
-            return {
-                "total": 0,
-                "detalles": [],
-                "hay_vencidos": False,
-                "hay_proximos": False
-            }
+        def calcular():
+            user_data = DatabaseManager.get_user_data(handler_input)
+            prestamos_activos = user_data.get("prestamos_activos", [])
+        
+            if not prestamos_activos:
+                return {
+                    "total": 0,
+                    "detalles": [],
+                    "hay_vencidos": False,
+                    "hay_proximos": False
+                }
 
-        total_prestamos = len(prestamos_activos)
-        detalles_analizados = []
-        hay_vencidos = False
-        hay_proximos = False
-        
-        fecha_actual = datetime.now()
-        for p in prestamos_activos:
-            detalle = f"'{p['titulo']}' está con {p.get('persona', 'alguien')}"
+            total_prestamos = len(prestamos_activos)
+            detalles_analizados = []
+            hay_vencidos = False
+            hay_proximos = False
+        
+            fecha_actual = ahora()
+            for p in prestamos_activos:
+                detalle = f"'{p['titulo']}' está con {p.get('persona', 'alguien')}"
             
-            try:
-                fecha_limite = datetime.fromisoformat(p.get('fecha_limite'))
-                dias_restantes = (fecha_limite - fecha_actual).days
+                # Documentos antiguos: la fecha ISO se convierte una vez y queda como epoch
+                fecha_limite = normalizar_campos(p, CAMPOS_FECHA_PRESTAMO).get('fecha_limite')
+                if fecha_limite:
+                    restantes = dias_restantes(fecha_limite, fecha_actual)
                 
-                if dias_restantes < 0:
-                    detalle += " (¡ya venció!)"
-                    hay_vencidos = True
-                elif dias_restantes == 0:
-                    detalle += " (vence hoy)"
-                    hay_proximos = True
-                elif dias_restantes <= 2:
-                    detalle += f" (vence en {dias_restantes} días)"
-                    hay_proximos = True
-            except:
-                detalle += " (fecha límite desconocida)"
+                    if restantes < 0:
+                        detalle += " (¡ya venció!)"
+                        hay_vencidos = True
+                    elif restantes == 0:
+                        detalle += " (vence hoy)"
+                        hay_proximos = True
+                    elif restantes <= 2:
+                        detalle += f" (vence en {restantes} días)"
+                        hay_proximos = True
+                else:
+                    detalle += " (fecha límite desconocida)"
             
-            detalles_analizados.append(detalle)
+                detalles_analizados.append(detalle)
             
-        return {
-            "total": total_prestamos,
-            "detalles": detalles_analizados,
-            "hay_vencidos": hay_vencidos,
-            "hay_proximos": hay_proximos
-        }
+            return {
+                "total": total_prestamos,
+                "detalles": detalles_analizados,
+                "hay_vencidos": hay_vencidos,
+                "hay_proximos": hay_proximos
+            }
+
+        return _memo_por_version(handler_input, "resumen_prestamos", calcular, datetime.now().date().toordinal())
         
     @staticmethod
     def obtener_resumen_historial(handler_input):
@@ -352,26 +553,37 @@ class BibliotecaService:
     @staticmethod
     def eliminar_libro(handler_input, titulo):
         user_data = DatabaseManager.get_user_data(handler_input)
-        libros = user_data.get("libros_disponibles", [])
-        prestamos_activos = user_data.get("prestamos_activos", [])
-        libro_a_eliminar = buscar_libro_por_titulo_exacto(libros, titulo)
+        indice = DatabaseManager.get_library_index(handler_input)
+        libro_a_eliminar = indice.libro_por_titulo(titulo)
         
         if not libro_a_eliminar:
             return "no_encontrado"
             
         libro_id = libro_a_eliminar.get("id")
-        if any(p.get("libro_id") == libro_id for p in prestamos_activos):
+        if indice.prestamo_de_libro(libro_id):
             return "esta_prestado"
         try:
-            libros_actualizada = [l for l in libros if l.get("id") != libro_id]
-            user_data["libros_disponibles"] = libros_actualizada
+            busqueda = DatabaseManager.busqueda_en_cache(handler_input, user_data)
+            duplicados = DatabaseManager.duplicados_en_cache(handler_input, user_data)
+            indice.quitar_libro(libro_a_eliminar)
+            if busqueda is not None:
+                busqueda.quitar(libro_a_eliminar)
+            if duplicados is not None:
+                duplicados.quitar(libro_a_eliminar)
             
             stats = user_data.setdefault("estadisticas", {})
-            stats["total_libros"] = len(libros_actualizada)
+            stats["total_libros"] = len(indice.libros)
             
-            DatabaseManager.save_user_data(handler_input, user_data)
+            tabla = DatabaseManager.tabla_en_cache(handler_input, user_data)
+            if tabla is not None and not tabla.quitar(libro_id):
+                tabla = None
+            DatabaseManager.save_user_data(handler_input, user_data, tabla=tabla, indice=indice,
+                                           eventos=[libro_eliminado(libro_a_eliminar)])
             
             return libro_a_eliminar
         except Exception as e:
             logger.error(f"Error al eliminar el libro {titulo}: {e}", exc_info=True)
-            return "error_interno"
\ No newline at end of file
+            return "error_interno"
+
+
+instrumentar_clase(BibliotecaService, incluir_privados=True)
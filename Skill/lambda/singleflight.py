@@ -0,0 +1,148 @@
+import threading
+
+from deadline import restante, PlazoAgotado
+
+# ==============================
+# Una carga en vuelo por clave
+# ==============================
+# Peticiones simultáneas del mismo usuario (reintentos de Alexa, varios
+# dispositivos de la casa) no repiten la lectura del almacenamiento: la
+# primera la hace y las demás esperan su resultado (o su error). La espera
+# respeta el plazo de la petición (deadline.py).
+
+
+def _esperar(esperar):
+    queda = restante()
+    if queda is not None and queda <= 0:
+        raise PlazoAgotado("sin tiempo restante esperando otra petición")
+    if not esperar(queda):
+        raise PlazoAgotado("otra petición del mismo usuario no terminó a tiempo")
+
+
+class _Vuelo:
+    __slots__ = ("evento", "resultado", "error")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vuelos = {}
+        # Llamadas que se sirvieron del vuelo de otra (para métricas y pruebas)
+        self.compartidas = 0
+
+    def hacer(self, clave, funcion):
+        """Resultado de `funcion()`; si ya hay una en curso para `clave`, espera la suya."""
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+            else:
+                self.compartidas += 1
+
+        if not lider:
+            _esperar(vuelo.evento.wait)
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            vuelo.resultado = funcion()
+            return vuelo.resultado
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._vuelos[clave]
+            vuelo.evento.set()
+
+
+# ==============================
+# Escrituras agrupadas por clave
+# ==============================
+class _Cola:
+    __slots__ = ("escribiendo", "siguiente", "agrupadas", "confirmada", "fallida", "esperando")
+
+    def __init__(self):
+        self.escribiendo = False
+        # (versión, función) de la escritura más nueva que espera turno
+        self.siguiente = None
+        # Cuántas escrituras representa `siguiente` (más de una: se reemplazaron)
+        self.agrupadas = 0
+        self.confirmada = -1
+        # (versión, error) de la última escritura fallida
+        self.fallida = None
+        self.esperando = 0
+
+
+class EscriturasAgrupadas:
+    """
+    Una escritura a la vez por clave. Las que llegan mientras otra está en
+    curso se agrupan: sólo se escribe la de versión más alta, que contiene a
+    las anteriores, y todas terminan cuando se confirma (o falla) esa.
+    `funcion(agrupada)` recibe True si su escritura reemplaza a otras.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._colas = {}
+        # Escrituras que no llegaron al almacenamiento porque otra más nueva las incluyó
+        self.ahorradas = 0
+
+    def _limpiar(self, clave, cola):
+        # Sin escritura en curso ni pendiente y sin nadie esperando: la cola se olvida
+        if not cola.escribiendo and cola.siguiente is None and cola.esperando == 0 and self._colas.get(clave) is cola:
+            del self._colas[clave]
+
+    def escribir(self, clave, version, funcion):
+        with self._cond:
+            cola = self._colas.get(clave)
+            if cola is None:
+                cola = self._colas[clave] = _Cola()
+            if cola.siguiente is None or version >= cola.siguiente[0]:
+                if cola.siguiente is not None:
+                    self.ahorradas += 1
+                cola.siguiente = (version, funcion)
+                cola.agrupadas += 1
+            else:
+                # Ya espera una escritura más nueva que incluye a esta
+                self.ahorradas += 1
+            cola.esperando += 1
+            try:
+                while True:
+                    if cola.confirmada >= version:
+                        return
+                    if cola.fallida is not None and cola.confirmada < version <= cola.fallida[0]:
+                        raise cola.fallida[1]
+                    if not cola.escribiendo and cola.siguiente is not None:
+                        break
+                    _esperar(self._cond.wait)
+                turno, escribir = cola.siguiente
+                agrupada = cola.agrupadas > 1
+                cola.siguiente, cola.agrupadas = None, 0
+                cola.escribiendo = True
+            finally:
+                cola.esperando -= 1
+                self._limpiar(clave, cola)
+
+        error = None
+        try:
+            escribir(agrupada)
+        except Exception as e:
+            error = e
+        with self._cond:
+            cola.escribiendo = False
+            if error is None:
+                cola.confirmada = max(cola.confirmada, turno)
+            else:
+                cola.fallida = (turno, error)
+            self._limpiar(clave, cola)
+            self._cond.notify_all()
+        if error is not None and version <= turno:
+            raise error
@@ -0,0 +1,151 @@
+import hashlib
+import math
+
+from config import SUMMARY_BLOOM_FP_RATE
+
+# ==============================
+# Resumen por usuario
+# ==============================
+# Lo que algunas respuestas necesitan del documento sin cargarlo entero: los
+# contadores del saludo, la versión y un filtro de Bloom de los títulos. Se
+# guarda en la tabla de caché (clave RESUMEN#<user_id>) cada vez que se
+# escribe ahí el documento, así que sigue cada mutación. Pesa unos cientos de bytes.
+#   {"user_id", "version", "libros", "prestamos", "frecuente", "bloom", "k", "ttl"}
+# El filtro no tiene falsos negativos: si no conoce un título, ese título no
+# está. Si lo conoce, puede estar: con SUMMARY_BLOOM_FP_RATE (1 en 10 000 por
+# defecto) un título nuevo también da positivo, así que un positivo nunca basta
+# para rechazar un título; se confirma contra el documento. El resumen se
+# escribe sin garantía (si falla queda el anterior hasta su TTL): no sirve
+# para decidir una escritura.
+# En memoria el resumen se mantiene junto al documento: un libro nuevo entra
+# al filtro y los contadores se leen del documento al escribir. Se reconstruye
+# sólo si el número de libros no cuadra (se eliminó alguno: el filtro no puede
+# quitar un título) o si el filtro se llenó.
+
+PREFIJO_RESUMEN = "RESUMEN#"
+MAX_FUNCIONES_HASH = 16
+# Títulos que caben en el filtro además de los del documento, para no reconstruirlo en cada alta
+HOLGURA_TITULOS = 64
+
+
+def clave_resumen(user_id):
+    return PREFIJO_RESUMEN + user_id
+
+
+def clave_titulo(titulo):
+    # La misma normalización que LibraryIndex.libro_por_titulo
+    return (titulo or "").lower()
+
+
+def _hashes(texto):
+    digest = hashlib.blake2b(texto.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class FiltroBloom:
+    """Conjunto aproximado de cadenas: `in` puede dar falsos positivos, nunca falsos negativos."""
+    __slots__ = ("bits", "k")
+
+    def __init__(self, bits, k):
+        self.bits = bytearray(bits)
+        self.k = k
+
+    @classmethod
+    def para(cls, elementos, probabilidad=SUMMARY_BLOOM_FP_RATE, capacidad=None):
+        """
+        Filtro con `elementos` dimensionado para `capacidad` elementos (por
+        defecto, los dados) con la probabilidad de falso positivo dada.
+        """
+        n = max(capacidad or len(elementos), 1)
+        m = max(64, math.ceil(-n * math.log(probabilidad) / math.log(2) ** 2))
+        k = min(MAX_FUNCIONES_HASH, max(1, round(m / n * math.log(2))))
+        filtro = cls(bytes((m + 7) // 8), k)
+        for elemento in elementos:
+            filtro.agregar(elemento)
+        return filtro
+
+    def _posiciones(self, elemento):
+        # Doble hashing mejorado (Dillinger-Manolios): k posiciones a partir de dos
+        # hashes; el término cúbico evita que se repitan cuando h2 y m comparten factores
+        h1, h2 = _hashes(elemento)
+        m = len(self.bits) * 8
+        return ((h1 + i * h2 + (i ** 3 - i) // 6) % m for i in range(self.k))
+
+    def agregar(self, elemento):
+        for posicion in self._posiciones(elemento):
+            self.bits[posicion >> 3] |= 1 << (posicion & 7)
+
+    def __contains__(self, elemento):
+        return all(self.bits[posicion >> 3] & (1 << (posicion & 7)) for posicion in self._posiciones(elemento))
+
+
+class Resumen:
+    __slots__ = ("version", "total_libros", "prestamos_activos", "usuario_frecuente", "titulos", "libres")
+
+    def __init__(self, version, total_libros, prestamos_activos, usuario_frecuente, titulos, libres=0):
+        self.version = version
+        self.total_libros = total_libros
+        self.prestamos_activos = prestamos_activos
+        self.usuario_frecuente = usuario_frecuente
+        self.titulos = titulos
+        # Títulos que todavía caben en el filtro (sólo en memoria)
+        self.libres = libres
+
+    @classmethod
+    def del_documento(cls, data):
+        libros = data.get("libros_disponibles", [])
+        titulos = {clave_titulo(l.get("titulo")) for l in libros}
+        return cls(
+            version=data.get("version", 0),
+            total_libros=len(libros),
+            prestamos_activos=len(data.get("prestamos_activos", [])),
+            usuario_frecuente=bool(data.get("usuario_frecuente", False)),
+            titulos=FiltroBloom.para(titulos, capacidad=len(titulos) + HOLGURA_TITULOS),
+            libres=HOLGURA_TITULOS,
+        )
+
+    def agregar_titulo(self, titulo):
+        """Un libro nuevo en el documento: su título entra al filtro."""
+        self.titulos.agregar(clave_titulo(titulo))
+        self.total_libros += 1
+        self.libres -= 1
+
+    def actualizar(self, data):
+        """
+        Pone versión y contadores al día con `data` sin recorrerlo. False si el
+        filtro ya no sirve (faltan o sobran libros, o se llenó): hay que reconstruirlo.
+        """
+        if self.libres < 0 or self.total_libros != len(data.get("libros_disponibles", [])):
+            return False
+        self.version = data.get("version", 0)
+        self.prestamos_activos = len(data.get("prestamos_activos", []))
+        self.usuario_frecuente = bool(data.get("usuario_frecuente", False))
+        return True
+
+    def a_item(self, user_id, ttl):
+        """Item de DynamoDB (resource) del resumen."""
+        return {
+            "user_id": clave_resumen(user_id),
+            "version": self.version,
+            "libros": self.total_libros,
+            "prestamos": self.prestamos_activos,
+            "frecuente": self.usuario_frecuente,
+            "bloom": bytes(self.titulos.bits),
+            "k": self.titulos.k,
+            "ttl": ttl,
+        }
+
+    @classmethod
+    def desde_item(cls, item):
+        """Resumen de un item ya pasado por `desde_dynamo`."""
+        return cls(
+            version=item.get("version", 0),
+            total_libros=item["libros"],
+            prestamos_activos=item["prestamos"],
+            usuario_frecuente=item["frecuente"],
+            titulos=FiltroBloom(item["bloom"], item["k"]),
+        )
+
+    def puede_tener_titulo(self, titulo):
+        """False si el título seguro no está; True si (casi seguro) está."""
+        return clave_titulo(titulo) in self.titulos
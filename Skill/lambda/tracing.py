@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from config import TRACING_ENABLED, TRACE_EXPORTER, TRACE_FILE
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Spans
+# ==============================
+# Con TRACING_ENABLED=false los decoradores e instrumentadores devuelven las
+# funciones originales y `span()` un context manager vacío: no hay costo.
+# Un span sin padre es la raíz de su traza; al cerrarse se exporta la traza completa.
+ACTIVO = TRACING_ENABLED
+
+_SPAN_ACTUAL = ContextVar("span_actual", default=None)
+
+
+class Span:
+    __slots__ = ("nombre", "trace_id", "span_id", "padre_id", "inicio_ns", "fin_ns",
+                 "atributos", "error", "_traza", "_token")
+
+    def __init__(self, nombre, padre=None, atributos=None):
+        self.nombre = nombre
+        self.trace_id = padre.trace_id if padre else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.padre_id = padre.span_id if padre else None
+        self.atributos = atributos or {}
+        self.error = None
+        self.inicio_ns = self.fin_ns = 0
+        # Spans terminados de la traza; la lista la comparte toda la traza
+        self._traza = padre._traza if padre else []
+        self._token = None
+
+    def __enter__(self):
+        self._token = _SPAN_ACTUAL.set(self)
+        self.inicio_ns = time.time_ns()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.fin_ns = time.time_ns()
+        if valor is not None:
+            self.error = f"{tipo.__name__}: {valor}"
+        _SPAN_ACTUAL.reset(self._token)
+        self._traza.append(self)
+        if self.padre_id is None:
+            exportar(self._traza)
+        return False
+
+    @property
+    def duracion_ms(self):
+        return (self.fin_ns - self.inicio_ns) / 1e6
+
+
+class _SpanNulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *_):
+        return False
+
+
+_NULO = _SpanNulo()
+
+
+def span(nombre, **atributos):
+    """`with span("nombre", clave=valor):` — hijo del span actual, o raíz si no hay ninguno."""
+    if not ACTIVO:
+        return _NULO
+    return Span(nombre, _SPAN_ACTUAL.get(), atributos)
+
+
+def span_actual():
+    return _SPAN_ACTUAL.get()
+
+
+def anotar(clave, valor):
+    """Atributo en el span actual (si hay trazas activas)."""
+    if ACTIVO:
+        actual = _SPAN_ACTUAL.get()
+        if actual is not None:
+            actual.atributos[clave] = valor
+
+
+def trazar(nombre=None):
+    """Decorador: cada llamada a la función es un span."""
+    def decorar(funcion):
+        if not ACTIVO:
+            return funcion
+        etiqueta = nombre or funcion.__qualname__
+
+        @wraps(funcion)
+        def envuelta(*args, **kwargs):
+            with Span(etiqueta, _SPAN_ACTUAL.get()):
+                return funcion(*args, **kwargs)
+        return envuelta
+    return decorar
+
+
+# ==============================
+# Instrumentación automática
+# ==============================
+def instrumentar_clase(clase, incluir_privados=False):
+    """Envuelve en spans los métodos estáticos de `clase` ('Clase.metodo')."""
+    if not ACTIVO:
+        return clase
+    for nombre, atributo in list(vars(clase).items()):
+        if nombre.startswith("__") or (nombre.startswith("_") and not incluir_privados):
+            continue
+        if isinstance(atributo, staticmethod):
+            etiqueta = f"{clase.__name__}.{nombre}"
+            setattr(clase, nombre, staticmethod(trazar(etiqueta)(atributo.__func__)))
+    return clase
+
+
+def instrumentar_metodos(objetivo, nombres, prefijo=None):
+    """Envuelve en spans los métodos `nombres` de una clase o de una instancia (los que existan)."""
+    if not ACTIVO:
+        return objetivo
+    prefijo = prefijo or (objetivo.__name__ if isinstance(objetivo, type) else type(objetivo).__name__)
+    for nombre in nombres:
+        metodo = getattr(objetivo, nombre, None)
+        if metodo is not None:
+            setattr(objetivo, nombre, trazar(f"{prefijo}.{nombre}")(metodo))
+    return objetivo
+
+
+def trazar_lambda(lambda_handler):
+    """Span raíz por invocación, con el request id y el intent."""
+    if not ACTIVO:
+        return lambda_handler
+
+    @wraps(lambda_handler)
+    def handler(event, context):
+        request = (event or {}).get("request") or {}
+        atributos = {
+            "request_id": request.get("requestId", ""),
+            "intent": (request.get("intent") or {}).get("name") or request.get("type", ""),
+        }
+        with Span("lambda_handler", None, atributos):
+            return lambda_handler(event, context)
+    return handler
+
+
+# ==============================
+# Exportadores
+# ==============================
+_ESCRITURA = threading.Lock()
+
+
+def _como_dict(s):
+    return {
+        "trace_id": s.trace_id,
+        "span_id": s.span_id,
+        "parent_id": s.padre_id,
+        "nombre": s.nombre,
+        "inicio_ns": s.inicio_ns,
+        "duracion_ms": round(s.duracion_ms, 3),
+        "atributos": s.atributos,
+        "error": s.error,
+    }
+
+
+def _valor_otlp(valor):
+    if isinstance(valor, bool):
+        return {"boolValue": valor}
+    if isinstance(valor, int):
+        return {"intValue": str(valor)}
+    if isinstance(valor, float):
+        return {"doubleValue": valor}
+    return {"stringValue": str(valor)}
+
+
+def _como_otlp(spans):
+    """ExportTraceServiceRequest en JSON (el formato del file exporter de OpenTelemetry)."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "biblioteca-skill"}}]},
+        "scopeSpans": [{
+            "scope": {"name": "biblioteca.tracing"},
+            "spans": [{
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.padre_id or "",
+                "name": s.nombre,
+                "kind": 1,
+                "startTimeUnixNano": str(s.inicio_ns),
+                "endTimeUnixNano": str(s.fin_ns),
+                "attributes": [{"key": k, "value": _valor_otlp(v)} for k, v in s.atributos.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+def exportar(spans):
+    """Agrega la traza terminada a TRACE_FILE; un error al escribir sólo se registra."""
+    try:
+        if TRACE_EXPORTER == "otlp":
+            lineas = [json.dumps(_como_otlp(spans), ensure_ascii=False)]
+        else:
+            lineas = [json.dumps(_como_dict(s), ensure_ascii=False, default=str) for s in spans]
+        with _ESCRITURA, open(TRACE_FILE, "a", encoding="utf-8") as archivo:
+            archivo.write("\n".join(lineas) + "\n")
+    except Exception as e:
+        logger.warning(f"Traza no exportada: {e}")
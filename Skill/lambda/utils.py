@@ -1,8 +1,9 @@
 import logging
 import os
-import boto3
 from botocore.exceptions import ClientError
 
+from clients import cliente
+
 
 def create_presigned_url(object_name):
     """Generate a presigned URL to share an S3 object with a capped expiration of 60 seconds
@@ -10,9 +11,9 @@ def create_presigned_url(object_name):
     :param object_name: string
     :return: Presigned URL as string. If error, returns None.
     """
-    s3_client = boto3.client('s3',
-                             region_name=os.environ.get('S3_PERSISTENCE_REGION'),
-                             config=boto3.session.Config(signature_version='s3v4',s3={'addressing_style': 'path'}))
+    s3_client = cliente('s3',
+                        region_name=os.environ.get('S3_PERSISTENCE_REGION'),
+                        signature_version='s3v4', s3={'addressing_style': 'path'})
     try:
         bucket_name = os.environ.get('S3_PERSISTENCE_BUCKET')
         response = s3_client.generate_presigned_url('get_object',
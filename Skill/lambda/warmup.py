@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+from boto3.dynamodb.types import TypeDeserializer
+from ask_sdk_core.attributes_manager import AttributesManager
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_model import RequestEnvelope, ResponseEnvelope
+
+from config import (
+    ENABLE_DDB_CACHE, WARMUP_USERS, WARMUP_LOOKBACK_HOURS, WARMUP_BUDGET_MS, WARMUP_PUBLISH_SECONDS,
+    CACHE_TTL_SECONDS, PERSISTENCE_TIMEOUT_MS,
+)
+from clients import cliente
+from database import DatabaseManager
+from persistence import get_persistence_adapter, desde_dynamo
+from deadline import llamar, plazo, PlazoAgotado
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# Calentamiento del contenedor
+# ==============================
+# Un contenedor nuevo empieza con la caché en memoria vacía: la primera
+# petición de cada usuario paga la lectura completa, y la creación de clientes,
+# el DescribeTable de la tabla de caché y el primer dispatch del SDK caen en el
+# camino de la respuesta. Un evento programado (EventBridge, `"source":
+# "aws.events"`, o cualquier evento con `"calentar": true`) hace todo eso antes:
+#   1. crea los clientes de la persistencia y verifica la tabla de caché;
+#   2. pasa peticiones de muestra por el dispatcher (deserialización, can_handle
+#      de todos los handlers y serialización de una respuesta);
+#   3. precarga en memoria los documentos de los WARMUP_USERS usuarios más
+#      recientes, con BatchGetItem sobre la tabla de caché (ENABLE_DDB_CACHE).
+# Todo dentro de WARMUP_BUDGET_MS: lo que no alcance se carga con normalidad.
+# Con concurrencia aprovisionada lo mismo corre en la inicialización, antes de
+# que el contenedor reciba tráfico.
+#
+# Actividad reciente: cada contenedor junta los usuarios que atiende y cada
+# WARMUP_PUBLISH_SECONDS los agrega (ADD a un conjunto de strings) al item de
+# su hora en la tabla de caché, clave RECIENTES#<AAAAMMDDHH> (UTC), que vence
+# con el TTL de la tabla. Un item por hora en lugar de uno por usuario: el
+# calentamiento lee las últimas WARMUP_LOOKBACK_HOURS con un solo BatchGetItem.
+
+PREFIJO_RECIENTES = "RECIENTES#"
+# Límites de BatchGetItem: claves por llamada y reintentos de las no procesadas
+MAX_CLAVES_POR_LOTE = 100
+MAX_REINTENTOS_LOTE = 3
+
+_LOCK = threading.Lock()
+# user_id -> último momento (epoch) en que este contenedor lo atendió, sin publicar
+_VISTOS = {}
+_ULTIMA_PUBLICACION = 0.0
+_DESERIALIZADOR = TypeDeserializer()
+
+
+def _ddb():
+    # Cliente compartido (no un resource por hilo): lo usan hilos de vida corta
+    return cliente("dynamodb", region_name="us-east-1")
+
+
+def _hora(momento):
+    return time.strftime("%Y%m%d%H", time.gmtime(momento))
+
+
+def es_calentamiento(event):
+    return isinstance(event, dict) and (event.get("source") == "aws.events" or bool(event.get("calentar")))
+
+
+def _user_id(event):
+    sistema = ((event or {}).get("context") or {}).get("System") or {}
+    return (sistema.get("user") or {}).get("userId")
+
+
+# ==============================
+# Registro de actividad reciente
+# ==============================
+def registrar(user_id):
+    """Anota que el usuario hizo una petición; se publica como mucho cada WARMUP_PUBLISH_SECONDS."""
+    global _ULTIMA_PUBLICACION
+    if not ENABLE_DDB_CACHE or not user_id:
+        return
+    ahora = time.time()
+    with _LOCK:
+        _VISTOS[user_id] = ahora
+        if ahora - _ULTIMA_PUBLICACION < WARMUP_PUBLISH_SECONDS:
+            return
+        _ULTIMA_PUBLICACION = ahora
+        vistos = dict(_VISTOS)
+        _VISTOS.clear()
+    # Fuera del camino de la respuesta; si Lambda congela el hilo sigue en la próxima invocación
+    threading.Thread(target=_publicar, args=(vistos,), name="recientes", daemon=True).start()
+
+
+def _publicar(vistos):
+    por_hora = {}
+    for user_id, momento in vistos.items():
+        por_hora.setdefault(_hora(momento), []).append(user_id)
+    vence = int(time.time()) + max(CACHE_TTL_SECONDS, WARMUP_LOOKBACK_HOURS * 3600)
+    for hora, usuarios in por_hora.items():
+        try:
+            _ddb().update_item(
+                TableName=DatabaseManager.DDB_TABLE,
+                Key={"user_id": {"S": PREFIJO_RECIENTES + hora}},
+                UpdateExpression="ADD usuarios :u SET #ttl = :ttl",
+                ExpressionAttributeNames={"#ttl": "ttl"},
+                ExpressionAttributeValues={":u": {"SS": usuarios}, ":ttl": {"N": str(vence)}},
+            )
+        except Exception as e:
+            # Sólo se pierde la precarga de estos usuarios
+            logger.warning(f"Actividad reciente sin publicar ({len(usuarios)} usuarios): {e}")
+
+
+def _lote(claves, proyeccion):
+    """Items de BatchGetItem para `claves` (<= 100), reintentando las no procesadas."""
+    items = []
+    pedido = {DatabaseManager.DDB_TABLE: {
+        "Keys": [{"user_id": {"S": clave}} for clave in claves],
+        "ProjectionExpression": proyeccion,
+    }}
+    # "data" y "ttl" son palabras reservadas de DynamoDB
+    nombres = {alias: nombre for alias, nombre in (("#data", "data"), ("#ttl", "ttl")) if alias in proyeccion}
+    if nombres:
+        pedido[DatabaseManager.DDB_TABLE]["ExpressionAttributeNames"] = nombres
+    for intento in range(MAX_REINTENTOS_LOTE):
+        respuesta = llamar(lambda: _ddb().batch_get_item(RequestItems=pedido),
+                           timeout_ms=PERSISTENCE_TIMEOUT_MS, nivel="calentamiento")
+        items.extend(
+            {campo: _DESERIALIZADOR.deserialize(valor) for campo, valor in item.items()}
+            for item in respuesta.get("Responses", {}).get(DatabaseManager.DDB_TABLE, [])
+        )
+        # Con más de 16 MB (documentos grandes) o con la tabla limitada quedan claves sin procesar
+        pedido = respuesta.get("UnprocessedKeys") or {}
+        if not pedido:
+            break
+        time.sleep(0.05 * 2 ** intento)
+    return items
+
+
+def recientes(n=WARMUP_USERS):
+    """Hasta `n` usuarios con actividad en las últimas WARMUP_LOOKBACK_HOURS, los más recientes primero."""
+    ahora = time.time()
+    horas = [_hora(ahora - 3600 * h) for h in range(min(WARMUP_LOOKBACK_HOURS, MAX_CLAVES_POR_LOTE))]
+    items = _lote([PREFIJO_RECIENTES + hora for hora in horas], "user_id, usuarios")
+    usuarios = []
+    vistos = set()
+    for item in sorted(items, key=lambda i: i["user_id"], reverse=True):
+        # Dentro de una misma hora el orden no importa
+        for user_id in sorted(item.get("usuarios", ())):
+            if user_id not in vistos:
+                vistos.add(user_id)
+                usuarios.append(user_id)
+    return usuarios[:n]
+
+
+def precargar(user_ids):
+    """Deja en memoria los documentos de la tabla de caché de `user_ids`; devuelve cuántos cargó."""
+    faltan = [u for u in user_ids if not DatabaseManager.en_memoria(u)]
+    cargados = 0
+    for inicio in range(0, len(faltan), MAX_CLAVES_POR_LOTE):
+        ahora = time.time()
+        for item in _lote(faltan[inicio:inicio + MAX_CLAVES_POR_LOTE], "user_id, #data, #ttl"):
+            if "data" not in item or int(item.get("ttl", 0)) < ahora:
+                continue
+            DatabaseManager.precargar(item["user_id"], desde_dynamo(item["data"]))
+            cargados += 1
+    return cargados
+
+
+# ==============================
+# Dispatch de la skill
+# ==============================
+def handler_de_skill(skill):
+    """Como `sb.lambda_handler()`, pero con la misma CustomSkill en todas las invocaciones (el SDK crea una en cada una)."""
+    def handler(event, context):
+        request_envelope = skill.serializer.deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
+        response_envelope = skill.invoke(request_envelope=request_envelope, context=context)
+        return skill.serializer.serialize(response_envelope)
+    return handler
+
+
+def _muestra(request):
+    usuario = {"userId": "calentamiento"}
+    aplicacion = {"applicationId": "calentamiento"}
+    return {
+        "version": "1.0",
+        "session": {"new": True, "sessionId": "calentamiento", "application": aplicacion,
+                    "user": usuario, "attributes": {}},
+        "context": {"System": {"application": aplicacion, "user": usuario,
+                               "device": {"deviceId": "calentamiento", "supportedInterfaces": {}}}},
+        "request": dict(request, requestId="calentamiento", locale="es-MX",
+                        timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())),
+    }
+
+
+MUESTRAS = (
+    {"type": "LaunchRequest"},
+    # Un intent que ningún handler atiende: se evalúan todos los can_handle
+    {"type": "IntentRequest", "dialogState": "STARTED", "intent": {
+        "name": "Calentamiento", "confirmationStatus": "NONE", "slots": {"titulo": {
+            "name": "titulo", "value": "calentamiento", "confirmationStatus": "NONE",
+            "resolutions": {"resolutionsPerAuthority": [{
+                "authority": "calentamiento", "status": {"code": "ER_SUCCESS_MATCH"},
+                "values": [{"value": {"name": "calentamiento", "id": "calentamiento"}}],
+            }]},
+        }},
+    }},
+    {"type": "SessionEndedRequest", "reason": "USER_INITIATED"},
+)
+
+
+def _preparar_dispatch(skill):
+    """Recorre el dispatch con peticiones de muestra sin ejecutar ningún handler."""
+    for request in MUESTRAS:
+        envelope = skill.serializer.deserialize(payload=json.dumps(_muestra(request)), obj_type=RequestEnvelope)
+        handler_input = HandlerInput(request_envelope=envelope,
+                                     attributes_manager=AttributesManager(request_envelope=envelope))
+        for mapper in skill.request_dispatcher.request_mappers:
+            mapper.get_request_handler_chain(handler_input)
+    respuesta = handler_input.response_builder.speak("calentamiento").ask("calentamiento").response
+    skill.serializer.serialize(ResponseEnvelope(response=respuesta, version="1.0", session_attributes={}))
+
+
+# ==============================
+# Calentamiento
+# ==============================
+def preparar(skill):
+    """Clientes y dispatch; no lee documentos."""
+    get_persistence_adapter()
+    if ENABLE_DDB_CACHE:
+        # En el hilo de las llamadas con tiempo límite: ahí queda su resource y su conexión
+        llamar(DatabaseManager._get_ddb_table, timeout_ms=PERSISTENCE_TIMEOUT_MS, nivel="calentamiento")
+        _ddb()
+    _preparar_dispatch(skill)
+
+
+def calentar(skill):
+    """Prepara el contenedor y precarga los usuarios recientes dentro de WARMUP_BUDGET_MS."""
+    inicio = time.monotonic()
+    resultado = {"calentado": True, "usuarios": 0, "precargados": 0}
+    with plazo(WARMUP_BUDGET_MS):
+        try:
+            preparar(skill)
+            if ENABLE_DDB_CACHE and WARMUP_USERS > 0:
+                usuarios = recientes()
+                resultado["usuarios"] = len(usuarios)
+                resultado["precargados"] = precargar(usuarios)
+        except PlazoAgotado as e:
+            logger.warning(f"Calentamiento cortado por tiempo: {e}")
+        except Exception as e:
+            # Un calentamiento fallido sólo deja el contenedor como estaba
+            logger.warning(f"Calentamiento incompleto: {e}")
+    resultado["ms"] = round((time.monotonic() - inicio) * 1000)
+    logger.info(f"🔥 Contenedor calentado: {resultado['precargados']}/{resultado['usuarios']} "
+                f"usuarios en memoria ({resultado['ms']} ms)")
+    return resultado
+
+
+def al_iniciar(skill):
+    """En la inicialización del contenedor: calentamiento completo con concurrencia aprovisionada, si no sólo lo barato."""
+    try:
+        if os.getenv("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+            calentar(skill)
+        else:
+            with plazo(WARMUP_BUDGET_MS):
+                preparar(skill)
+    except Exception as e:
+        logger.warning(f"Preparación inicial omitida: {e}")
+
+
+def con_calentamiento(lambda_handler, skill):
+    """Envuelve el handler de Lambda: atiende los eventos de calentamiento y registra la actividad."""
+    @wraps(lambda_handler)
+    def handler(event, context):
+        if es_calentamiento(event):
+            return calentar(skill)
+        registrar(_user_id(event))
+        return lambda_handler(event, context)
+    return handler